@@ -8,8 +8,11 @@ from flask_bcrypt import Bcrypt
 from celery import Celery
 import os
 
+from .db_routing import RoutingSession, configure_engines, init_read_routing
+from .celery_config import celery_settings
+
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
 bcrypt = Bcrypt()
 celery = Celery()
@@ -17,6 +20,7 @@ celery = Celery()
 # Import logging components
 from .logging_config import setup_logging, get_logger
 from .middleware import log_requests
+from .rate_limit import init_rate_limiting
 
 # Sleep configuration for retrying database connection on startup
 SLEEP_INTERVAL = 5  # times
@@ -40,6 +44,29 @@ def create_celery(app):
         beat_schedule={},  # Will be populated dynamically
         beat_schedule_filename='/tmp/celerybeat-schedule',  # Store schedule file
     )
+    # Queues, routes and worker options from the environment
+    celery.conf.update(celery_settings(app.config))
+    # Pin the consumed set: routing to another queue adds it to amqp.queues, but a
+    # specialised worker must keep consuming only its own
+    celery.amqp.queues.select([queue.name for queue in celery.conf.task_queues])
+    
+    # Prefork children may exit without running atexit; write their buffered metrics first
+    from celery.signals import worker_process_shutdown
+    
+    @worker_process_shutdown.connect(weak=False)
+    def flush_worker_metrics(**kwargs):
+        from .metrics import flush_metrics
+        with app.app_context():
+            flush_metrics()
+    
+    # Prefork children must not reuse DB connections opened by the parent
+    from celery.signals import worker_process_init
+    
+    @worker_process_init.connect(weak=False)
+    def reset_db_connections(**kwargs):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
     
     class ContextTask(celery.Task):
         def __call__(self, *args, **kwargs):
@@ -49,8 +76,8 @@ def create_celery(app):
     celery.Task = ContextTask
     return celery
 
-def create_app(config_name=None):
-    """Application factory"""
+def create_app(config_name=None, process_role=None):
+    """Application factory (process_role: web, worker or scheduler; defaults to PROCESS_ROLE)"""
     app = Flask(__name__)
     
     # Load configuration
@@ -59,6 +86,11 @@ def create_app(config_name=None):
     
     app.config.from_object(f'config.{config_name.capitalize()}Config')
     
+    # Behind the ingress, take the client IP (used for login throttling) from X-Forwarded-For
+    if app.config.get('PROXY_FIX_X_FOR'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    
     # Setup logging first
     log_level = 'DEBUG' if config_name == 'development' else 'INFO'
     setup_logging('notion-email-backend', log_level)
@@ -67,16 +99,27 @@ def create_app(config_name=None):
     logger = get_logger(__name__)
     logger.info(f"Starting Notion Email application in {config_name} mode")
     
+    # Pool sizing for this process role, plus the optional read replica
+    configure_engines(app, process_role or app.config['PROCESS_ROLE'])
+    
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     bcrypt.init_app(app)
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     
+    # orjson for all JSON bodies; gzip runs last (after_request hooks run in reverse)
+    from .responses import OrjsonProvider, init_compression
+    app.json = OrjsonProvider(app)
+    init_compression(app)
+    
     # Setup request logging middleware
     log_requests(app)
     logger.info("Request logging middleware configured")
     
+    init_rate_limiting(app)
+    init_read_routing(app, db)
+    
     # Initialize Celery
     create_celery(app)
     logger.info("Celery configured")
@@ -90,6 +133,7 @@ def create_app(config_name=None):
     from .frontend_logs import frontend_logs_bp
     from .tokens import tokens_bp
     from .admin import admin_bp
+    from .metrics import metrics_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(user_bp, url_prefix='/api/user')
@@ -99,6 +143,7 @@ def create_app(config_name=None):
     app.register_blueprint(frontend_logs_bp, url_prefix='/api/frontend')
     app.register_blueprint(tokens_bp, url_prefix='/api/tokens')
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(metrics_bp)  # Prometheus scrape target at /metrics
     
     logger.info("All blueprints registered")
     
@@ -108,6 +153,12 @@ def create_app(config_name=None):
             with app.app_context():
                 db.create_all()
                 logger.info("Database tables created/verified")
+                
+                from .user_search import ensure_search_index
+                try:
+                    ensure_search_index()
+                except Exception as e:
+                    logger.warning(f"Could not create the user search index (run migrate_db.py): {e}")
                 break  # If successful, break out of retry loop
         except Exception as e:
             logger.warning(f"Failed to create database tables on attempt {i+1}: {e}")
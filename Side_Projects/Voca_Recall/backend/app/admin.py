@@ -1,9 +1,18 @@
-from flask import Blueprint, request, jsonify
+import math
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
 from email_validator import validate_email, EmailNotValidError
-from .models import User, db
+from sqlalchemy import and_, case, func
+from .models import User, EmailLog, db
 from .logging_config import get_logger
+from .passwords import PasswordHasherBusy
 from .middleware import log_api_call, admin_required
+from .redis_utils import get_pool_stats, measure_latency
+from .maintenance import run_maintenance_task
+from .user_search import ranked_user_ids, load_users
+from .smtp_pool import pool_status
+from .outbox import outbox_summary
 
 admin_bp = Blueprint('admin', __name__)
 logger = get_logger(__name__)
@@ -19,19 +28,23 @@ def list_users():
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '', type=str)
         
-        # Build query
-        query = User.query
+        # Searches page through the ranked, index-backed match list
+        if search.strip():
+            matched_ids = ranked_user_ids(search)
+            page_ids = matched_ids[(page - 1) * per_page:page * per_page]
+            users_data = [user.to_dict() for user in load_users(page_ids)]
+            
+            logger.info(f"Listed {len(users_data)} of {len(matched_ids)} users matching search (page {page})")
+            
+            return jsonify({
+                'users': users_data,
+                'total': len(matched_ids),
+                'pages': math.ceil(len(matched_ids) / per_page) if per_page else 0,
+                'current_page': page,
+                'per_page': per_page
+            }), 200
         
-        # Apply search filter if provided
-        if search:
-            search_filter = f"%{search}%"
-            query = query.filter(
-                db.or_(
-                    User.email.ilike(search_filter),
-                    User.first_name.ilike(search_filter),
-                    User.last_name.ilike(search_filter)
-                )
-            )
+        query = User.query
         
         # Paginate results
         pagination = query.order_by(User.created_at.desc()).paginate(
@@ -172,6 +185,10 @@ def create_user():
             'user': user.to_dict()
         }), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        logger.warning("User creation rejected: password hashing pool is busy")
+        return jsonify({'error': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         logger.error(f"User creation error: {str(e)}", exc_info=True)
@@ -241,11 +258,180 @@ def search_users():
                 logger.info(f"Found user by exact email match: {email}")
                 return jsonify({'users': [user.to_dict()]}), 200
             
-            # Partial match
-            users = User.query.filter(User.email.ilike(f"%{email}%")).limit(10).all()
-            logger.info(f"Found {len(users)} users by partial email match: {email}")
+            # Ranked prefix / full-text match
+            users = load_users(ranked_user_ids(email, limit=10))
+            logger.info(f"Found {len(users)} users by partial match: {email}")
             return jsonify({'users': [u.to_dict() for u in users]}), 200
         
     except Exception as e:
         logger.error(f"Error searching users: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to search users', 'details': str(e)}), 500
+
+@admin_bp.route('/redis/pool', methods=['GET'])
+@jwt_required()
+@admin_required()
+@log_api_call("Redis Pool Stats")
+def redis_pool_stats():
+    """Redis connection pool utilisation for this worker process (admin only)"""
+    try:
+        # Ping first so the pool exists before it is inspected
+        ping = {}
+        try:
+            ping['ping_ms'] = round(measure_latency(), 2)
+            ping['reachable'] = True
+        except Exception as e:
+            logger.warning(f"Redis ping failed: {str(e)}")
+            ping['reachable'] = False
+            ping['error'] = str(e)
+        
+        stats = get_pool_stats()
+        stats.update(ping)
+        return jsonify(stats), 200
+        
+    except Exception as e:
+        logger.error(f"Error reading Redis pool stats: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to read Redis pool stats', 'details': str(e)}), 500
+
+
+@admin_bp.route('/smtp/accounts', methods=['GET'])
+@jwt_required()
+@admin_required()
+@log_api_call("SMTP Pool Status")
+def smtp_pool_status():
+    """Usage, quotas, cooldowns and health of each SMTP sender account (admin only)"""
+    try:
+        return jsonify({
+            'routing': current_app.config.get('SMTP_ROUTING', 'least_loaded'),
+            'accounts': pool_status(current_app.config),
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error reading SMTP pool status: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to read SMTP pool status', 'details': str(e)}), 500
+
+
+@admin_bp.route('/outbox', methods=['GET'])
+@jwt_required()
+@admin_required()
+@log_api_call("Outbox Status")
+def outbox_status():
+    """Email outbox rows per status and the age of the oldest undelivered row (admin only)"""
+    try:
+        return jsonify(outbox_summary()), 200
+        
+    except Exception as e:
+        logger.error(f"Error reading outbox status: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to read outbox status', 'details': str(e)}), 500
+
+
+# Upper bounds (ms) of the lag histogram the SLO report counts in SQL
+LAG_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000, 900000, 3600000)
+
+
+def _hour_of(column):
+    """SQL truncating a DATETIME column to its hour, as 'YYYY-MM-DD HH:00:00'"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    return func.date_format(column, '%Y-%m-%d %H:00:00')
+
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _percentile(cumulative, sent, max_ms, pct):
+    """Nearest-rank percentile from cumulative bucket counts: the bound of its bucket, capped at the max"""
+    if not sent:
+        return None
+    rank = min(sent, max(1, math.ceil(pct / 100 * sent)))
+    for bound, count in zip(LAG_BUCKETS_MS, cumulative):
+        if count >= rank:
+            return min(bound, max_ms)
+    return max_ms
+
+
+def _summarize_lags(sent, failed, on_time, max_ms, cumulative):
+    total = sent + failed
+    return {
+        'sent': sent,
+        'failed': failed,
+        'p50_ms': _percentile(cumulative, sent, max_ms, 50),
+        'p95_ms': _percentile(cumulative, sent, max_ms, 95),
+        'p99_ms': _percentile(cumulative, sent, max_ms, 99),
+        'max_ms': max_ms,
+        # Failed sends count against the SLO
+        'on_time_pct': round(on_time / total * 100, 2) if total else None,
+    }
+
+
+@admin_bp.route('/delivery/slo', methods=['GET'])
+@jwt_required()
+@admin_required()
+@log_api_call("Delivery SLO Report")
+def delivery_slo():
+    """
+    Hourly dispatch-lag percentiles and on-time percentage (admin only).
+    
+    Aggregated in SQL over the ix_email_logs_slo index: per hour, the counts of
+    sent, failed and on-time sends, the max lag, and a cumulative histogram of
+    lag_ms over LAG_BUCKETS_MS. Percentiles are the bucket bound they fall in.
+    """
+    try:
+        hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 14)
+        on_time_seconds = request.args.get(
+            'on_time_seconds', current_app.config.get('DELIVERY_ON_TIME_SECONDS', 60), type=int
+        )
+        on_time_ms = on_time_seconds * 1000
+        since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+        
+        hour = _hour_of(EmailLog.scheduled_at).label('hour')
+        delivered = and_(EmailLog.status == 'sent', EmailLog.lag_ms.isnot(None))
+        rows = db.session.query(
+            hour,
+            func.count(),
+            _count_where(delivered),
+            _count_where(and_(delivered, EmailLog.lag_ms <= on_time_ms)),
+            func.max(case((delivered, EmailLog.lag_ms))),
+            *[_count_where(and_(delivered, EmailLog.lag_ms <= bound)) for bound in LAG_BUCKETS_MS]
+        ).filter(
+            EmailLog.scheduled_at >= since,
+            # An empty database is not a delivery
+            EmailLog.status != 'skipped'
+        ).group_by(hour).order_by(hour).all()
+        
+        hourly = []
+        totals = [0] * (3 + len(LAG_BUCKETS_MS))
+        overall_max = None
+        for hour_text, count, sent, on_time, max_ms, *cumulative in rows:
+            sent, on_time, cumulative = int(sent), int(on_time), [int(value) for value in cumulative]
+            summary = _summarize_lags(sent, count - sent, on_time, max_ms, cumulative)
+            summary['hour'] = str(hour_text).replace(' ', 'T') + 'Z'
+            hourly.append(summary)
+            for index, value in enumerate([sent, count - sent, on_time, *cumulative]):
+                totals[index] += value
+            if max_ms is not None:
+                overall_max = max_ms if overall_max is None else max(overall_max, max_ms)
+        
+        return jsonify({
+            'since': since.isoformat() + 'Z',
+            'on_time_seconds': on_time_seconds,
+            'overall': _summarize_lags(totals[0], totals[1], totals[2], overall_max, totals[3:]),
+            'hourly': hourly
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error building delivery SLO report: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to build delivery SLO report', 'details': str(e)}), 500
+
+@admin_bp.route('/maintenance/run', methods=['POST'])
+@jwt_required()
+@admin_required()
+@log_api_call("Run Maintenance")
+def run_maintenance_now():
+    """Enqueue a maintenance pass outside the scheduler's interval (admin only)"""
+    try:
+        task = run_maintenance_task.delay()
+        return jsonify({'message': 'Maintenance queued', 'task_id': task.id}), 202
+    except Exception as e:
+        logger.error(f"Error queueing maintenance: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to queue maintenance', 'details': str(e)}), 500
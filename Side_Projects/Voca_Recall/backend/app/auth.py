@@ -2,7 +2,8 @@ from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from email_validator import validate_email, EmailNotValidError
 from .models import User, PasswordResetToken, db
-from . import bcrypt
+from .passwords import PasswordHasherBusy
+from .login_throttle import login_retry_after, record_login_failure, clear_login_failures
 from .logging_config import get_logger
 from .middleware import log_api_call, log_database_operations
 from .email import send_email
@@ -67,6 +68,10 @@ def register():
             'refresh_token': refresh_token
         }), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        logger.warning("Registration rejected: password hashing pool is busy")
+        return jsonify({'error': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         logger.error(f"Registration error: {str(e)}", exc_info=True)
@@ -85,17 +90,29 @@ def login():
             logger.warning("Login failed: missing email or password")
             return jsonify({'error': 'Email and password are required'}), 400
         
+        # Reject throttled IPs/accounts before doing any bcrypt work
+        client_ip = request.remote_addr
+        retry_after = login_retry_after(client_ip, data['email'])
+        if retry_after:
+            logger.warning(f"Login throttled for '{data.get('email')}' from {client_ip}")
+            return jsonify({
+                'error': 'Too many failed login attempts, please try again later',
+                'retry_after': retry_after
+            }), 429, {'Retry-After': str(retry_after)}
+        
         # Find user by email
         user = User.query.filter_by(email=data['email']).first()
         
         # Check if user exists
         if not user:
             logger.warning(f"Login failed: user not found for '{data.get('email')}'")
+            record_login_failure(client_ip, data['email'])
             return jsonify({'error': 'No account found with this email address'}), 401
         
         # Check if password is correct
         if not user.check_password(data['password']):
             logger.warning(f"Login failed: incorrect password for '{data.get('email')}'")
+            record_login_failure(client_ip, data['email'])
             return jsonify({'error': 'Incorrect password'}), 401
         
         # Check if account is active
@@ -103,6 +120,18 @@ def login():
             logger.warning(f"Login failed: account deactivated for '{data.get('email')}'")
             return jsonify({'error': 'Account is deactivated'}), 401
         
+        # Upgrade hashes made with an older BCRYPT_LOG_ROUNDS while we have the plaintext
+        if user.password_needs_rehash():
+            try:
+                user.set_password(data['password'])
+                db.session.commit()
+                logger.info(f"Rehashed password for user ID {user.id} at the configured work factor")
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Password rehash failed for user ID {user.id}: {str(e)}")
+        
+        # Only a login that gets tokens resets the throttle
+        clear_login_failures(data['email'])
         logger.info(f"User logged in successfully: {user.email} (ID: {user.id})")
         
         # Create access and refresh tokens with role
@@ -117,6 +146,9 @@ def login():
             'refresh_token': refresh_token
         }), 200
         
+    except PasswordHasherBusy:
+        logger.warning("Login rejected: password hashing pool is busy")
+        return jsonify({'error': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
     except Exception as e:
         logger.error(f"Login error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Login failed', 'details': str(e)}), 500
@@ -406,6 +438,10 @@ def reset_password():
             'message': 'Password reset successful. You can now log in with your new password.'
         }), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        logger.warning("Password reset rejected: password hashing pool is busy")
+        return jsonify({'error': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         logger.error(f"Password reset error: {str(e)}", exc_info=True)
@@ -0,0 +1,90 @@
+"""
+Celery routing and worker settings, chosen from the environment.
+
+Each task type has its own queue (TASK_QUEUES, overridable per task with
+CELERY_TASK_QUEUES), so slow SMTP sends never hold the slots maintenance or
+schedule reloads need, and each queue can get its own worker pool. A worker
+consumes the queues in CELERY_WORKER_QUEUES, or all of them when unset, so a
+single worker still runs everything.
+
+- CELERY_PREFETCH_MULTIPLIER (default 1): tasks reserved per process.
+  Sends are long and uneven, so one at a time keeps them from queueing
+  behind a busy process.
+- CELERY_ACKS_LATE (default on): a task is acknowledged only after it
+  finishes, so a worker crash redelivers it. This is safe because outbox
+  batches re-check their claim and maintenance holds a lock.
+- CELERY_IGNORE_RESULT_TASKS: tasks whose return value nobody reads, so
+  their results are not written to Redis.
+- CELERY_QUEUE_RATE_LIMITS, e.g. "email=600/m": applied to every task
+  routed to the queue. Celery enforces these per worker node and per task
+  type.
+"""
+from kombu import Queue
+
+# Queue of each task unless CELERY_TASK_QUEUES says otherwise
+TASK_QUEUES = {
+    'app.outbox.deliver_outbox_batch': 'email',
+    'app.email.send_email_service_task': 'email',
+    'app.email.send_digest_task': 'email',
+    'app.maintenance.run_maintenance_task': 'maintenance',
+    'app.email.reload_email_schedules': 'maintenance',
+}
+
+
+def _pairs(spec):
+    """'a=1, b=2' -> {'a': '1', 'b': '2'}"""
+    return {
+        key.strip(): value.strip()
+        for key, value in (part.split('=', 1) for part in (spec or '').split(',') if '=' in part)
+    }
+
+
+def _names(spec):
+    return [name.strip() for name in (spec or '').split(',') if name.strip()]
+
+
+def _task_name(name):
+    """Full task name for 'deliver_outbox_batch' or 'app.outbox.deliver_outbox_batch'"""
+    if '.' in name:
+        return name
+    return next((task for task in TASK_QUEUES if task.rsplit('.', 1)[1] == name), name)
+
+
+def celery_settings(config):
+    """Celery settings (routes, queues, annotations, worker options) from app config"""
+    routes = dict(TASK_QUEUES)
+    routes.update({_task_name(task): queue for task, queue in _pairs(config.get('CELERY_TASK_QUEUES')).items()})
+
+    default_queue = config.get('CELERY_DEFAULT_QUEUE', 'celery')
+    known_queues = [default_queue] + sorted(set(routes.values()) - {default_queue})
+    worker_queues = _names(config.get('CELERY_WORKER_QUEUES')) or known_queues
+
+    rate_limits = _pairs(config.get('CELERY_QUEUE_RATE_LIMITS'))
+    ignore_result = {_task_name(name) for name in _names(config.get('CELERY_IGNORE_RESULT_TASKS'))}
+    annotations = {}
+    for task, queue in routes.items():
+        options = {}
+        if queue in rate_limits:
+            options['rate_limit'] = rate_limits[queue]
+        if task in ignore_result:
+            options['ignore_result'] = True
+        if options:
+            annotations[task] = options
+
+    settings = {
+        'task_default_queue': default_queue,
+        'task_routes': {task: {'queue': queue} for task, queue in routes.items()},
+        # Queues this process consumes when it runs as a worker; producers still
+        # route to any queue (missing ones are created on first use)
+        'task_queues': [Queue(name, routing_key=name) for name in worker_queues],
+        'task_annotations': annotations,
+        'task_acks_late': config.get('CELERY_ACKS_LATE', True),
+        'worker_prefetch_multiplier': config.get('CELERY_PREFETCH_MULTIPLIER', 1),
+        # With acks_late, Redis redelivers a task still unacknowledged after this long
+        'broker_transport_options': {'visibility_timeout': config.get('CELERY_VISIBILITY_TIMEOUT', 3600)},
+    }
+    if config.get('CELERY_WORKER_CONCURRENCY'):
+        settings['worker_concurrency'] = config['CELERY_WORKER_CONCURRENCY']
+    if config.get('CELERY_WORKER_MAX_TASKS_PER_CHILD'):
+        settings['worker_max_tasks_per_child'] = config['CELERY_WORKER_MAX_TASKS_PER_CHILD']
+    return settings
@@ -0,0 +1,270 @@
+"""
+Compiled cron expressions for email service schedules.
+
+An expression is parsed once (and cached per process) into one bitmask per
+field. The next fire time is found by skipping whole months and days whose
+bits don't match, then taking the lowest set hour/minute bit at or after the
+current position, so the cost depends on the gap to the next match rather
+than on the number of minutes in between.
+
+Fields: minute hour day-of-month month day-of-week (0 or 7 = Sunday), with
+`*`, lists, ranges, `/step` and three-letter month/day names, plus the
+@hourly/@daily/@weekly/@monthly/@yearly shortcuts. As in cron, when both
+day-of-month and day-of-week are restricted a day matching either one fires.
+
+Beyond cron, a schedule can be limited to every N days counted from an
+anchor date (compile_cron(expression, interval_days, anchor)), which is how
+"every 3 days at 08:00" is expressed.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import pytz
+from celery import schedules
+
+ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+MONTH_NAMES = {name: i for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+DAY_NAMES = {name: i for i, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+
+# (name, lowest, highest, names); day-of-week accepts 7 as an alias for Sunday
+FIELDS = (
+    ('minute', 0, 59, None),
+    ('hour', 0, 23, None),
+    ('day of month', 1, 31, None),
+    ('month', 1, 12, MONTH_NAMES),
+    ('day of week', 0, 7, DAY_NAMES),
+)
+
+# Feb 29 on a given weekday can be 28 years away; anything beyond never fires
+MAX_SEARCH_YEARS = 28
+
+# Five copies of a 7-bit weekday pattern, enough to cover a month
+WEEK_REPEAT = sum(1 << (7 * week) for week in range(5))
+
+
+def _next_bit(mask, start):
+    """Lowest set bit position >= start, or None"""
+    shifted = mask >> start
+    if not shifted:
+        return None
+    return start + (shifted & -shifted).bit_length() - 1
+
+
+def _parse_value(text, names, field):
+    text = text.strip().lower()
+    if names and text in names:
+        return names[text]
+    if not text.isdigit():
+        raise ValueError(f"Invalid {field} value '{text}'")
+    return int(text)
+
+
+def _parse_field(text, field, low, high, names):
+    """Parse one cron field into (bitmask, restricted)"""
+    mask = 0
+    for part in text.split(','):
+        step = 1
+        has_step = '/' in part
+        if has_step:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) < 1:
+                raise ValueError(f"Invalid {field} step '{step_text}'")
+            step = int(step_text)
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = _parse_value(start_text, names, field), _parse_value(end_text, names, field)
+        else:
+            start = _parse_value(part, names, field)
+            # "5/15" means "from 5 every 15"
+            end = high if has_step else start
+
+        if not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f"{field.capitalize()} '{part}' is outside {low}-{high}")
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+
+    return mask, text.strip() != '*'
+
+
+class CronSchedule:
+    """A parsed cron expression; use compile_cron() to get a cached instance"""
+
+    __slots__ = ('expression', 'minutes', 'hours', 'days', 'months', 'weekdays',
+                 'dom_restricted', 'dow_restricted', 'interval_days', 'anchor')
+
+    def __init__(self, expression, interval_days=None, anchor=None):
+        self.expression = expression
+        if interval_days is not None and interval_days < 1:
+            raise ValueError("interval_days must be at least 1")
+        # Only days a multiple of interval_days away from anchor can fire
+        self.interval_days = interval_days if interval_days and interval_days > 1 else None
+        self.anchor = (anchor or date(1970, 1, 1)).toordinal()
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("Cron expression must have 5 fields: minute hour day-of-month month day-of-week")
+
+        masks = [_parse_field(text, *spec) for text, spec in zip(fields, FIELDS)]
+        (self.minutes, _), (self.hours, _), (self.days, self.dom_restricted), \
+            (self.months, _), (self.weekdays, self.dow_restricted) = masks
+        if self.weekdays & (1 << 7):
+            self.weekdays = (self.weekdays | 1) & 0x7f
+
+    def _day_mask(self, year, month):
+        """Days of year/month the schedule fires on, as a bitmask (bit d = day d)"""
+        first = date(year, month, 1)
+        month_days = (1 << (calendar.monthrange(year, month)[1] + 1)) - 2
+        if self.dow_restricted:
+            # Rotate the weekdays so bit i is the weekday of day i + 1 (cron: Sunday = 0)
+            offset = (first.weekday() + 1) % 7
+            week = ((self.weekdays >> offset) | (self.weekdays << (7 - offset))) & 0x7f
+            dow = (week * WEEK_REPEAT) << 1
+        if self.dom_restricted and self.dow_restricted:
+            mask = self.days | dow
+        elif self.dom_restricted:
+            mask = self.days
+        elif self.dow_restricted:
+            mask = dow
+        else:
+            mask = month_days
+        mask &= month_days
+
+        if self.interval_days:
+            interval_mask = 0
+            for day in range((self.anchor - first.toordinal()) % self.interval_days + 1, 32, self.interval_days):
+                interval_mask |= 1 << day
+            mask &= interval_mask
+        return mask
+
+    def _first_time(self, hour, minute):
+        """First (hour, minute) at or after hour:minute on a matching day, or None"""
+        next_hour = _next_bit(self.hours, hour)
+        if next_hour is None:
+            return None
+        if next_hour == hour:
+            next_minute = _next_bit(self.minutes, minute)
+            if next_minute is not None:
+                return hour, next_minute
+            next_hour = _next_bit(self.hours, hour + 1)
+            if next_hour is None:
+                return None
+        return next_hour, _next_bit(self.minutes, 0)
+
+    def next_local(self, after):
+        """First matching naive wall-clock time strictly after `after` (naive)"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        year, month, day = start.year, start.month, start.day
+        hour, minute = start.hour, start.minute
+
+        while year <= start.year + MAX_SEARCH_YEARS:
+            if self.months >> month & 1:
+                days = self._day_mask(year, month)
+                matched = _next_bit(days, day)
+                if matched != day:
+                    hour = minute = 0
+                while matched is not None:
+                    found = self._first_time(hour, minute)
+                    if found:
+                        return datetime(year, month, matched, *found)
+                    matched = _next_bit(days, matched + 1)
+                    hour = minute = 0
+            # Jump to the first day of the next month with its bit set
+            month = _next_bit(self.months, month + 1)
+            if month is None:
+                year, month = year + 1, _next_bit(self.months, 1)
+            day, hour, minute = 1, 0, 0
+
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def next_fire(self, from_time, tz=pytz.UTC):
+        """
+        Next fire time after `from_time`, evaluated in `tz`.
+
+        Args:
+            from_time: reference time; naive values are taken as UTC
+            tz: pytz timezone the expression is written in
+
+        Returns:
+            naive UTC datetime, suitable for DB storage. A time skipped by a DST
+            jump fires at the same offset after the jump; a repeated time fires
+            on its first occurrence.
+        """
+        if from_time.tzinfo is None:
+            from_time = pytz.utc.localize(from_time)
+        candidate = from_time.astimezone(tz).replace(tzinfo=None)
+
+        # Normally one iteration; more only around the repeated hour of a DST change
+        for _ in range(4):
+            candidate = self.next_local(candidate)
+            try:
+                aware = tz.localize(candidate, is_dst=None)
+            except pytz.NonExistentTimeError:
+                aware = tz.normalize(tz.localize(candidate, is_dst=False))
+            except pytz.AmbiguousTimeError:
+                aware = tz.localize(candidate, is_dst=True)
+            if aware > from_time:
+                return aware.astimezone(pytz.utc).replace(tzinfo=None)
+
+        raise ValueError(f"Could not resolve next fire time for '{self.expression}' in {tz}")
+
+
+@lru_cache(maxsize=4096)
+def compile_cron(expression, interval_days=None, anchor=None):
+    """
+    Parse a cron expression once per process (raises ValueError if invalid).
+    With interval_days, only every interval_days-th day counted from the
+    `anchor` date fires.
+    """
+    return CronSchedule(expression, interval_days, anchor)
+
+
+def validate_cron_expression(expression):
+    """Raise ValueError unless the expression parses and fires at least once"""
+    if not expression or len(expression) > 100:
+        raise ValueError("Cron expression is required (max 100 characters)")
+    compile_cron(expression).next_local(datetime.utcnow())
+
+class CronBeatSchedule(schedules.BaseSchedule):
+    """
+    Celery beat schedule for a cron expression, or an already compiled
+    CronSchedule (e.g. EmailService.schedule(), every-N-days included),
+    in a given timezone.
+    """
+
+    def __init__(self, schedule, timezone='UTC', nowfun=None, app=None):
+        super().__init__(nowfun=nowfun, app=app)
+        self.cron = schedule if isinstance(schedule, CronSchedule) else compile_cron(schedule)
+        self.expression = self.cron.expression
+        self.timezone = timezone
+        self.tz = pytz.timezone(timezone)
+
+    def __reduce__(self):
+        return (self.__class__, (self.cron, self.timezone))
+
+    def __repr__(self):
+        every = f" every {self.cron.interval_days} days" if self.cron.interval_days else ""
+        return f"<cron: {self.expression}{every} ({self.timezone})>"
+
+    def remaining_estimate(self, last_run_at):
+        next_run = pytz.utc.localize(self.cron.next_fire(last_run_at, self.tz))
+        return next_run - self.now().astimezone(pytz.utc)
+
+    def is_due(self, last_run_at):
+        remaining = self.remaining_estimate(last_run_at).total_seconds()
+        if remaining > 0:
+            return schedules.schedstate(is_due=False, next=remaining)
+        now = self.now().astimezone(pytz.utc)
+        following = pytz.utc.localize(self.cron.next_fire(now, self.tz))
+        return schedules.schedstate(is_due=True, next=(following - now).total_seconds())
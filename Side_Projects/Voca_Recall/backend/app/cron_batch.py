@@ -0,0 +1,304 @@
+"""
+Next fire times for many email services at once, with NumPy datetime64.
+
+The built-in frequencies (daily at send_time, weekly on Monday, monthly on
+the 1st) are computed per timezone group with array arithmetic:
+
+1. The UTC offset of each reference time is looked up in the zone's pytz
+   transition table (np.searchsorted, as pytz's fromutc does). The table is
+   built once per zone.
+2. The next matching local wall-clock time is found with day arithmetic:
+   today or tomorrow, then rounded up to Monday, to the 1st of a month, or
+   to the next day a multiple of interval_days from the interval anchor.
+3. That wall-clock time is converted back to UTC with the offset of the
+   period it falls in.
+
+Some rows are sent to the scalar CronSchedule.next_fire instead, so results
+are identical to EmailService.calculate_next_run:
+- custom cron expressions;
+- wall-clock times that fall in a DST gap or repeated hour, or within a few
+  days of zone transitions that are close together;
+- rows whose answer does not check out, i.e. the offset differs or the time
+  is not after the reference.
+The scalar results are memoised per (schedule, timezone, reference time), so
+services sharing a reference time cost one call per distinct schedule.
+
+Reference times, send minutes and frequency codes given as NumPy arrays are
+used without a per-row Python loop; the scheduler passes its ZSET scores
+(UTC epoch seconds) straight through.
+"""
+from datetime import date, datetime, time
+from functools import lru_cache
+import numpy as np
+import pytz
+from .cron import compile_cron
+
+DAILY, WEEKLY, MONTHLY, CUSTOM, INTERVAL = 0, 1, 2, 3, 4
+FREQUENCY_KINDS = {'daily': DAILY, 'weekly': WEEKLY, 'monthly': MONTHLY, 'custom': CUSTOM, 'interval': INTERVAL}
+
+ONE_MINUTE = np.timedelta64(1, 'm')
+# Transitions closer together than this get a wider unsafe window, since pytz
+# only looks one day either side when localizing
+CLOSE_TRANSITIONS = np.timedelta64(5, 'D')
+CLOSE_TRANSITION_MARGIN = np.timedelta64(2, 'D')
+EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday (Monday = 0)
+# Anchor of an interval service without one (as CronSchedule assumes)
+DEFAULT_ANCHOR = np.datetime64('1970-01-01', 'D')
+
+
+def _zone(name):
+    """pytz timezone for `name`, UTC if unknown (as calculate_next_run does)"""
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return pytz.UTC
+
+
+@lru_cache(maxsize=1024)
+def _zone_table(name):
+    """
+    (transitions, offsets, local_starts, unsafe_lo, unsafe_hi) for a zone.
+
+    transitions[i] (UTC, datetime64[us]) starts a period with UTC offset
+    offsets[i] (seconds); local_starts[i] is that start in local wall-clock
+    time. Local times in [unsafe_lo[k], unsafe_hi[k]) can't be localized
+    without pytz's ambiguity rules.
+    """
+    tz = _zone(name)
+    if not hasattr(tz, '_utc_transition_times'):
+        # UTC and fixed-offset zones
+        offset = int(tz.utcoffset(datetime(2000, 1, 1)).total_seconds())
+        empty = np.array([], dtype='M8[us]')
+        return (np.array([np.datetime64('0001-01-01', 'us')]), np.array([offset], dtype='i8'),
+                np.array([np.datetime64('0001-01-01', 'us')]), empty, empty)
+
+    transitions = np.array(tz._utc_transition_times, dtype='M8[us]')
+    offsets = np.array([int(info[0].total_seconds()) for info in tz._transition_info], dtype='i8')
+    offset_deltas = offsets.astype('m8[s]')
+    local_starts = transitions + offset_deltas
+    local_starts[0] = transitions[0]
+
+    # Wall-clock window each transition skips or repeats: [before, after) or [after, before)
+    before = transitions[1:] + offset_deltas[:-1]
+    after = transitions[1:] + offset_deltas[1:]
+    unsafe_lo, unsafe_hi = np.minimum(before, after), np.maximum(before, after)
+    gaps = np.diff(transitions)
+    close = np.zeros(len(unsafe_lo), dtype=bool)
+    close[1:] |= gaps[1:] < CLOSE_TRANSITIONS
+    close[:-1] |= gaps[1:] < CLOSE_TRANSITIONS
+    unsafe_lo = np.where(close, unsafe_lo - CLOSE_TRANSITION_MARGIN, unsafe_lo)
+    unsafe_hi = np.where(close, unsafe_hi + CLOSE_TRANSITION_MARGIN, unsafe_hi)
+    return transitions, offsets, local_starts, unsafe_lo, np.maximum.accumulate(unsafe_hi)
+
+
+def _offsets_at(transitions, offsets, instants):
+    """UTC offset (seconds) in effect at each UTC instant"""
+    index = np.searchsorted(transitions, instants, side='right') - 1
+    return offsets[np.maximum(index, 0)]
+
+
+def _next_local(local_refs, minutes, kinds, intervals=None, anchors=None):
+    """First daily/weekly/monthly/interval wall-clock time at send minute `minutes` strictly after each reference"""
+    start = local_refs.astype('M8[m]') + ONE_MINUTE
+    day = start.astype('M8[D]')
+    minute_of_day = (start - day).astype('m8[m]').astype('i8')
+    day = day + (minute_of_day > minutes).astype('m8[D]')
+
+    weekly = kinds == WEEKLY
+    if weekly.any():
+        weekday = (day.astype('i8') + EPOCH_WEEKDAY) % 7
+        day = np.where(weekly, day + ((-weekday) % 7).astype('m8[D]'), day)
+
+    monthly = kinds == MONTHLY
+    if monthly.any():
+        month = day.astype('M8[M]')
+        first = month.astype('M8[D]')
+        day = np.where(monthly & (first != day), (month + 1).astype('M8[D]'), day)
+
+    interval = kinds == INTERVAL
+    if interval.any():
+        wait = (anchors - day).astype('i8') % np.where(interval, intervals, 1)
+        day = np.where(interval, day + wait.astype('m8[D]'), day)
+
+    return day.astype('M8[us]') + minutes.astype('m8[m]')
+
+
+def _group_next_fire(table, refs, minutes, kinds, intervals=None, anchors=None):
+    """
+    Vectorised next fire for one timezone group.
+
+    Returns:
+        (naive UTC datetime64[us] array, bool array of rows to recompute with the scalar path)
+    """
+    transitions, offsets, local_starts, unsafe_lo, unsafe_hi = table
+    local_refs = refs + _offsets_at(transitions, offsets, refs).astype('m8[s]')
+    local = _next_local(local_refs, minutes, kinds, intervals, anchors)
+
+    # Local period the wall-clock time falls in, and the UTC instant it maps to
+    offset = offsets[np.maximum(np.searchsorted(local_starts, local, side='right') - 1, 0)]
+    fire = local - offset.astype('m8[s]')
+
+    recheck = _offsets_at(transitions, offsets, fire) != offset
+    recheck |= fire <= refs
+    if len(unsafe_lo):
+        window = np.searchsorted(unsafe_lo, local, side='right') - 1
+        recheck |= (window >= 0) & (local < unsafe_hi[np.maximum(window, 0)])
+    return fire, recheck
+
+
+def _minutes_of_day(send_times):
+    """Minutes after midnight: integer and timedelta64 arrays are used as they are"""
+    if isinstance(send_times, np.ndarray):
+        if send_times.dtype.kind == 'm':
+            return send_times.astype('m8[m]').astype('i8')
+        return send_times.astype('i8', copy=False)
+    values = list(send_times)
+    if len(values) and isinstance(values[0], time):
+        return np.fromiter((value.hour * 60 + value.minute for value in values), dtype='i8', count=len(values))
+    return np.asarray(values, dtype='i8')
+
+
+def _epoch_to_datetime64(seconds):
+    return (np.asarray(seconds, dtype='f8') * 1e6).round().astype('i8').view('M8[us]')
+
+
+def _naive_utc(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value
+
+
+def _reference_times(from_times, count):
+    """
+    Naive UTC datetime64[us] array from one reference time or one per row.
+
+    A reference is a datetime, or UTC epoch seconds; per-row references given
+    as a datetime64 or numeric array are converted without a Python loop.
+    """
+    if isinstance(from_times, datetime):
+        return np.full(count, np.datetime64(_naive_utc(from_times), 'us'))
+    if isinstance(from_times, (int, float, np.number, np.datetime64)):
+        from_times = np.full(count, from_times)
+    if not isinstance(from_times, np.ndarray):
+        values = list(from_times)
+        if values and isinstance(values[0], datetime):
+            return np.array([_naive_utc(value) for value in values], dtype='M8[us]')
+        from_times = np.asarray(values)
+    if from_times.dtype.kind == 'M':
+        return from_times.astype('M8[us]')
+    return _epoch_to_datetime64(from_times)
+
+
+def _frequency_kinds(frequencies, count):
+    """FREQUENCY_KINDS code per row; an integer array is taken as codes already"""
+    if isinstance(frequencies, np.ndarray) and frequencies.dtype.kind in 'iu':
+        return frequencies.astype('i1')
+    frequencies = list(frequencies)
+    kind_of = {frequency: FREQUENCY_KINDS.get(frequency, DAILY) for frequency in set(frequencies)}
+    return np.fromiter(map(kind_of.__getitem__, frequencies), dtype='i1', count=count)
+
+
+def _scalar_spec(kind, minute_of_day, cron_expression):
+    """The cron expression calculate_next_run would evaluate for this row"""
+    minute, hour = minute_of_day % 60, minute_of_day // 60
+    if kind == CUSTOM:
+        try:
+            compile_cron(cron_expression)
+            return cron_expression
+        except ValueError:
+            # Same fallback as calculate_next_run for a bad stored expression
+            pass
+    if kind == WEEKLY:
+        return f"{minute} {hour} * * 1"
+    if kind == MONTHLY:
+        return f"{minute} {hour} 1 * *"
+    return f"{minute} {hour} * * *"
+
+
+def _interval_arrays(kinds, interval_days, interval_anchors, count):
+    """(interval days, anchor datetime64[D]) per row; interval rows without a usable interval fire daily"""
+    rows = np.flatnonzero(kinds == INTERVAL)
+    intervals = np.zeros(count, dtype='i8')
+    anchors = np.full(count, DEFAULT_ANCHOR)
+    if interval_days is None:
+        kinds[rows] = DAILY
+        return intervals, anchors
+    for row in rows:
+        interval = interval_days[row]
+        anchor = interval_anchors[row] if interval_anchors is not None else None
+        if not interval or interval < 1:
+            kinds[row] = DAILY
+            continue
+        intervals[row] = interval
+        if anchor is not None:
+            anchors[row] = np.datetime64(anchor, 'D')
+    return intervals, anchors
+
+
+def next_fire_batch(send_times, timezones, frequencies, from_times, cron_expressions=None,
+                    interval_days=None, interval_anchors=None):
+    """
+    EmailService.calculate_next_run for many services in one pass.
+
+    Args:
+        send_times: datetime.time values, or minutes after midnight (an integer
+            or timedelta64 array), one per service
+        timezones: IANA timezone names (unknown names are treated as UTC)
+        frequencies: 'daily', 'weekly', 'monthly' or 'custom' (anything else is
+            daily), or an integer array of FREQUENCY_KINDS codes
+        from_times: one reference time for all services, or one per service:
+            datetimes (naive values are UTC), UTC epoch seconds, or a
+            datetime64 / numeric array of either
+        cron_expressions: expressions for 'custom' services (None elsewhere)
+        interval_days: day counts for 'interval' services (None elsewhere)
+        interval_anchors: anchor dates for 'interval' services (None elsewhere)
+
+    Returns:
+        numpy datetime64[us] array of naive UTC next fire times
+    """
+    timezones = list(timezones)
+    count = len(timezones)
+    minutes = _minutes_of_day(send_times)
+    refs = _reference_times(from_times, count)
+    kinds = _frequency_kinds(frequencies, count)
+    # Like cron_spec(): unknown frequencies, and custom without an expression,
+    # fire daily at send_time
+    if cron_expressions is None:
+        kinds[kinds == CUSTOM] = DAILY
+    else:
+        for row in np.flatnonzero(kinds == CUSTOM):
+            if not cron_expressions[row]:
+                kinds[row] = DAILY
+    intervals, anchors = _interval_arrays(kinds, interval_days, interval_anchors, count)
+
+    # Group rows by timezone: factorize the names, then one stable sort
+    zone_ids = dict.fromkeys(timezones)
+    for code, name in enumerate(zone_ids):
+        zone_ids[name] = code
+    codes = np.fromiter(map(zone_ids.__getitem__, timezones), dtype='i8', count=count)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(zone_ids)))))
+
+    results = np.empty(count, dtype='M8[us]')
+    scalar = kinds == CUSTOM
+    for name, code in zone_ids.items():
+        rows = order[bounds[code]:bounds[code + 1]]
+        rows = rows[~scalar[rows]]
+        if not len(rows):
+            continue
+        fire, recheck = _group_next_fire(_zone_table(name), refs[rows], minutes[rows], kinds[rows],
+                                         intervals[rows], anchors[rows])
+        results[rows] = fire
+        scalar[rows[recheck]] = True
+
+    memo = {}
+    for row in np.flatnonzero(scalar):
+        spec = _scalar_spec(kinds[row], int(minutes[row]), cron_expressions[row] if cron_expressions is not None else None)
+        interval = (int(intervals[row]), anchors[row].astype(date)) if kinds[row] == INTERVAL else (None, None)
+        key = (spec, interval, timezones[row], refs[row])
+        if key not in memo:
+            memo[key] = np.datetime64(
+                compile_cron(spec, *interval).next_fire(refs[row].astype(datetime), _zone(timezones[row])), 'us'
+            )
+        results[row] = memo[key]
+    return results
@@ -1,10 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from notion_client import Client
+from .notion_utils import get_notion_client
 import re
-from .models import NotionDatabase, NotionToken, User, db
+import time
+from .models import NotionDatabase, NotionToken, User, EmailService, db
 from .logging_config import get_logger
 from .middleware import log_api_call, log_function_call
+from .notion_cache import get_database_schema, store_database_schema
+from .notion_health import check_databases, error_code
+from .token_cache import get_token_handle, invalidate_token, is_token_rejection, record_token_rejection, token_api_key
+from .responses import row_version, list_etag, not_modified, with_etag
 
 database_bp = Blueprint('database', __name__)
 logger = get_logger(__name__)
@@ -37,16 +42,15 @@ def extract_database_id(input_str: str):
     return normalized
 
 @log_function_call("Notion database validation")
-def validate_notion_database(api_key, database_id):
-    """Validate Notion database access"""
+def validate_notion_database(api_key, database_id, refresh=False):
+    """Validate Notion database access (cached per token and database, see notion_cache)"""
     try:
         logger.info(f"Validating Notion database access for database {database_id}")
         
-        notion = Client(auth=api_key)
-        database = notion.databases.retrieve(database_id)
+        schema = get_database_schema(api_key, database_id, refresh=refresh)
         
-        title = database.get('title', [{}])[0].get('plain_text', 'Untitled Database')
-        logger.info(f"Successfully validated database: {title}")
+        title = schema['title']
+        logger.info(f"Successfully validated database: {title} (cached: {schema['from_cache']})")
         
         return True, title
     except Exception as e:
@@ -84,7 +88,7 @@ def add_database():
             ).first()
             if not notion_token:
                 return jsonify({'error': 'Token not found or inactive'}), 404
-            api_key = notion_token.token
+            api_key = token_api_key(notion_token)
 
         # Accept either explicit database_id or a URL containing it
         provided_id = data.get('database_id')
@@ -152,11 +156,23 @@ def get_databases():
     """Get user's Notion databases"""
     try:
         current_user_id = int(get_jwt_identity())
-        databases = NotionDatabase.query.filter_by(user_id=current_user_id).all()
         
-        return jsonify({
-            'databases': [db.to_dict() for db in databases]
-        }), 200
+        # email_services_count comes from the services table
+        etag = list_etag(
+            row_version(NotionDatabase, NotionDatabase.user_id == current_user_id),
+            row_version(EmailService, EmailService.user_id == current_user_id),
+            params=(current_user_id,)
+        )
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        databases = NotionDatabase.query.filter_by(user_id=current_user_id)\
+            .options(db.selectinload(NotionDatabase.email_services)).all()
+        
+        return with_etag(jsonify({
+            'databases': [database.to_dict() for database in databases]
+        }), etag), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get databases', 'details': str(e)}), 500
@@ -225,7 +241,7 @@ def update_database(database_pk):
                 ).first()
                 if not notion_token:
                     return jsonify({'error': 'Token not found or inactive'}), 404
-                api_key = notion_token.token
+                api_key = token_api_key(notion_token)
                 database.token_id = token_id
 
             new_id = extract_database_id(data.get('database_id') or data.get('database_url'))
@@ -329,17 +345,18 @@ def test_database_connection(database_id):
             if not token:
                 return jsonify({'error': 'Token not found or inactive'}), 404
             
-            api_key = token.token
+            api_key = token_api_key(token)
         
-        # Test connection and get sample data
-        is_valid, result = validate_notion_database(api_key, database.database_id)
+        # Test connection and get sample data. Always ask Notion: a cached access
+        # marker would report success for a token revoked since it was stored
+        is_valid, result = validate_notion_database(api_key, database.database_id, refresh=True)
         
         if not is_valid:
             return jsonify({'error': 'Failed to connect to database', 'details': result}), 400
         
         # Get sample data (first few items)
         try:
-            notion = Client(auth=api_key)
+            notion = get_notion_client(api_key)
             response = notion.databases.query(
                 database_id=database.database_id,
                 page_size=5
@@ -374,6 +391,100 @@ def test_database_connection(database_id):
         return jsonify({'error': 'Failed to test connection', 'details': str(e)}), 500
 
 
+def _health_result(database, outcome=None, error=None, title=None):
+    """One database's line in the health check stream"""
+    result = {
+        'id': database.id,
+        'database_id': database.database_id,
+        'database_name': database.database_name,
+    }
+    if outcome is None:
+        result.update({'ok': False, 'error': error, 'error_code': 'token_unavailable'})
+        return result
+
+    (_, retrieve_error, retrieve_ms), (queried, query_error, query_ms) = outcome['retrieve'], outcome['query']
+    failure = retrieve_error or query_error
+    result.update({
+        'ok': failure is None,
+        'timings_ms': {'retrieve': retrieve_ms, 'query': query_ms},
+    })
+    if title is not None:
+        result['title'] = title
+    if queried is not None:
+        result['has_items'] = bool(queried.get('results'))
+    if failure is not None:
+        result.update({
+            'error': str(failure),
+            'error_code': error_code(failure),
+            'failed_check': 'retrieve' if retrieve_error else 'query',
+        })
+    return result
+
+
+@database_bp.route('/health', methods=['POST'])
+@jwt_required()
+@log_api_call("Check Notion databases health")
+def check_databases_health():
+    """Check all of the user's databases against Notion at once
+
+    Optional body: {"database_ids": [...]} to check only some of them.
+    Streams newline-delimited JSON: one result per database as its checks
+    complete, then a {"summary": ...} line.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        
+        query = NotionDatabase.query.filter_by(user_id=current_user_id)
+        if data.get('database_ids'):
+            query = query.filter(NotionDatabase.id.in_(data['database_ids']))
+        databases = query.order_by(NotionDatabase.id).all()
+        
+        # One Notion client per token, shared by all of its databases
+        clients, targets, unavailable = {}, [], []
+        for database in databases:
+            token = get_token_handle(database.token_id, user_id=current_user_id) if database.token_id else None
+            if not token:
+                unavailable.append(database)
+                continue
+            if token.id not in clients:
+                clients[token.id] = get_notion_client(token.api_key)
+            targets.append(((database, token), clients[token.id], database.database_id))
+    except Exception as e:
+        return jsonify({'error': 'Failed to check databases', 'details': str(e)}), 500
+    
+    def generate():
+        started = time.perf_counter()
+        healthy = 0
+        for database in unavailable:
+            yield current_app.json.dumps(_health_result(database, error='Token not found or inactive')) + '\n'
+        
+        concurrency = current_app.config.get('NOTION_HEALTH_CHECK_CONCURRENCY', 40)
+        for (database, token), outcome in check_databases(targets, concurrency):
+            retrieved = outcome['retrieve'][0]
+            # Keep the schema cache in step with what Notion just returned
+            title = store_database_schema(database.database_id, retrieved, token.api_key)['title'] \
+                if retrieved is not None else None
+            for _, error, _ in outcome.values():
+                if is_token_rejection(error):
+                    record_token_rejection(token.api_key)
+                    break
+            result = _health_result(database, outcome, title=title)
+            healthy += result['ok']
+            yield current_app.json.dumps(result) + '\n'
+        
+        summary = {
+            'total': len(databases),
+            'healthy': healthy,
+            'unhealthy': len(databases) - healthy,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+        logger.info(f"Health check of {len(databases)} databases for user {current_user_id}: {healthy} healthy in {summary['elapsed_ms']}ms")
+        yield current_app.json.dumps({'summary': summary}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 # Token Management Endpoints
 
 @database_bp.route('/tokens', methods=['GET'])
@@ -463,6 +574,7 @@ def update_token(token_id):
             token.is_active = bool(data['is_active'])
         
         db.session.commit()
+        invalidate_token(token_id)
         
         return jsonify({
             'message': 'Token updated successfully',
@@ -499,6 +611,7 @@ def delete_token(token_id):
         
         db.session.delete(token)
         db.session.commit()
+        invalidate_token(token_id)
         
         return jsonify({
             'message': 'Token deleted successfully'
@@ -512,9 +625,13 @@ def delete_token(token_id):
 @jwt_required()
 @log_api_call("Get database properties")
 def get_database_properties(database_id):
-    """Get the properties (columns) of a Notion database"""
+    """Get the properties (columns) of a Notion database
+
+    The schema is served from the Redis cache; pass ?refresh=true to re-read it from Notion.
+    """
     try:
         current_user_id = int(get_jwt_identity())
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
         
         # Verify database belongs to user
         database = NotionDatabase.query.filter_by(
@@ -533,21 +650,14 @@ def get_database_properties(database_id):
         if not token or not token.is_active:
              return jsonify({'error': 'Token not found or inactive'}), 400
              
-        # Fetch properties from Notion
-        notion = Client(auth=token.token)
-        # Using retrieve to get database properties schema
-        db_info = notion.databases.retrieve(database.database_id)
-        properties = db_info.get('properties', {})
-        
-        # Format properties list
-        columns = []
-        for name, prop in properties.items():
-            columns.append({
-                'name': name,
-                'type': prop.get('type')
-            })
-            
-        return jsonify({'columns': columns}), 200
+        # Fetch properties schema (Redis cache, falling back to Notion)
+        schema = get_database_schema(token_api_key(token), database.database_id, refresh=refresh)
+        
+        return jsonify({
+            'columns': schema['properties'],
+            'last_edited_time': schema['last_edited_time'],
+            'cached': schema['from_cache']
+        }), 200
         
     except Exception as e:
         logger.error(f"Failed to get database properties: {str(e)}")
@@ -0,0 +1,137 @@
+"""
+Database engine options per process role, and read-replica routing.
+
+Each process role holds connections differently. These are the pool
+defaults per role (DB_POOL_SIZE / DB_MAX_OVERFLOW override them):
+- web: one per gthread request thread.
+- worker: one task at a time per prefork child.
+- scheduler: a single loop.
+Every engine pings connections on checkout and recycles them after
+DB_POOL_RECYCLE_SECONDS, so connections MySQL dropped while idle are
+replaced instead of failing the next query.
+
+When DATABASE_READ_URL is set it becomes the `replica` bind. RoutingSession
+sends SELECTs to it during GET requests. Everything else goes to the primary:
+flushes, queries after the request has written, other methods, Celery and the
+scheduler. Views that read and then write on GET opt out with
+@use_primary_db. After a user's write request their reads stay on the primary
+for DB_REPLICA_PIN_SECONDS so they don't see replica lag.
+"""
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from .logging_config import get_logger
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+REPLICA_BIND = 'replica'
+PIN_KEY_PREFIX = 'db:primary_pin:'
+
+# (pool_size, max_overflow) per process role
+ROLE_POOL_DEFAULTS = {
+    'web': (8, 4),        # gunicorn gthread: 8 threads per worker process
+    'worker': (2, 2),     # Celery prefork child: one task at a time
+    'scheduler': (2, 0),  # single scheduling loop
+}
+
+
+def engine_options(config, role):
+    """SQLALCHEMY_ENGINE_OPTIONS for a process of the given role"""
+    if role not in ROLE_POOL_DEFAULTS:
+        raise ValueError(f"Unknown process role '{role}'")
+    pool_size, max_overflow = ROLE_POOL_DEFAULTS[role]
+    options = {
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE_SECONDS', 1800),
+    }
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    # In-memory SQLite uses StaticPool, which takes no sizing
+    if not (uri.startswith('sqlite') and ':memory:' in uri):
+        options.update({
+            'pool_size': config.get('DB_POOL_SIZE') or pool_size,
+            'max_overflow': config.get('DB_MAX_OVERFLOW') if config.get('DB_MAX_OVERFLOW') is not None else max_overflow,
+            'pool_timeout': config.get('DB_POOL_TIMEOUT_SECONDS', 10),
+        })
+    return options
+
+
+def configure_engines(app, role):
+    """Set engine options for `role` and the replica bind (before db.init_app)"""
+    options = engine_options(app.config, role)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    app.config['PROCESS_ROLE'] = role
+    if app.config.get('DATABASE_READ_URL'):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {**options, 'url': app.config['DATABASE_READ_URL']}
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def use_primary_db(view):
+    """Mark a GET view that writes based on what it reads, so it never reads from the replica"""
+    view.use_primary_db = True
+    return view
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends read-only GET queries to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not self.info.get('wrote')
+                and isinstance(clause, (sa.Select, sa.CompoundSelect))
+                and has_request_context() and g.get('db_use_replica')):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _mark_session_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+
+def _current_user_id():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def init_read_routing(app, db):
+    """Decide per request whether reads may use the replica"""
+    if not app.config.get('DATABASE_READ_URL'):
+        return
+
+    @app.before_request
+    def route_reads():
+        if request.method != 'GET' or request.endpoint is None:
+            return None
+        view = app.view_functions.get(request.endpoint)
+        if getattr(view, 'use_primary_db', False):
+            return None
+        user_id = _current_user_id()
+        if user_id is not None:
+            try:
+                if get_redis_client().exists(f"{PIN_KEY_PREFIX}{user_id}"):
+                    return None
+            except Exception as e:
+                # Without the pin we can't rule out lag for this user, so stay on the primary
+                logger.warning(f"Replica pin check failed, reading from primary: {str(e)}")
+                return None
+        g.db_use_replica = True
+        return None
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if request.method != 'GET' and db.session.info.get('wrote'):
+            user_id = _current_user_id()
+            if user_id is not None:
+                try:
+                    get_redis_client().set(f"{PIN_KEY_PREFIX}{user_id}", 1,
+                                           ex=current_app.config.get('DB_REPLICA_PIN_SECONDS', 5))
+                except Exception as e:
+                    logger.warning(f"Failed to pin user {user_id} to the primary: {str(e)}")
+        return response
@@ -1,24 +1,36 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from notion_client import Client
-import smtplib
+from notion_client import APIErrorCode
+from .notion_cache import query_database_cached, query_database_page, get_database_sample
+from .recent_items import select_unsent, record_sent_items
+from .spaced_repetition import seed_reviews, select_for_review, record_reviews
+from .cron import CronBeatSchedule
+from .token_cache import REJECTED, get_token_handle, is_token_rejection, lookup_token, record_token_rejection
+from .email_compact import compact_email
+from . import smtp_pool
+from email.charset import Charset, QP
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import random
 from datetime import date, datetime
-from celery.schedules import crontab
-import pytz
 import re
+import time
 from typing import Any, TypedDict
-from .models import User, NotionDatabase, NotionToken, EmailService, EmailLog, db
+from .models import User, NotionDatabase, EmailService, EmailLog, db
 from . import celery
 from .logging_config import get_logger
 from .middleware import log_api_call, log_function_call
+from .metrics import track_duration, inc
+from .responses import row_version, list_etag, not_modified, with_etag
 
 email_bp = Blueprint('email', __name__)
 logger = get_logger(__name__)
 
 
+class VocabularyFetchError(Exception):
+    """Notion could not be read for a send; the send is retried rather than dropped"""
+
+
 class ColumnSelectionItem(TypedDict, total=False):
     name: str
     type: str
@@ -33,6 +45,10 @@ ColumnSelection = list[ColumnSelectionItem | str]
 EMAIL_CLIENTS = ('apple_mail', 'gmail', 'outlook')
 DEFAULT_EMAIL_CLIENT = 'apple_mail'
 
+# spaced_repetition needs a service's review history, so one-off test sends
+# without a service fall back to random
+SELECTION_METHODS = ('random', 'latest', 'date_range', 'spaced_repetition')
+
 
 def normalize_email_client(email_client: str | None) -> str:
     """Return a valid email client identifier, falling back to the default."""
@@ -61,90 +77,168 @@ def format_vocabulary_in_sentence(sentence, vocabulary_word):
     
     return formatted_sentence
 
+# Quoted-printable keeps mostly-ASCII HTML near its raw size (base64 adds a third)
+BODY_CHARSET = Charset('utf-8')
+BODY_CHARSET.body_encoding = QP
+
+
+def prepare_email_body(html_content, email_client=None):
+    """
+    Compact rendered email HTML and derive its text/plain part.
+    
+    Returns:
+        tuple: (html_content, text_content, stats); with EMAIL_COMPACT_ENABLED
+        off the HTML is returned unchanged and the text part is still generated
+    """
+    if current_app.config.get('EMAIL_COMPACT_ENABLED', True):
+        html_content, text_content, stats = compact_email(html_content, email_client)
+    else:
+        _, text_content, stats = compact_email(html_content, email_client)
+        stats['html_bytes_after'] = stats['html_bytes_before']
+    
+    inc('voca_email_bytes_total', stats['html_bytes_before'], stage='raw')
+    inc('voca_email_bytes_total', stats['html_bytes_after'], stage='compact')
+    logger.debug(f"Email body {stats['html_bytes_before']} -> {stats['html_bytes_after']} bytes "
+                 f"(text part {stats['text_bytes']} bytes)")
+    return html_content, text_content, stats
+
+
 @log_function_call("Email sending")
-def send_email(to_email, subject, html_content, text_content=None):
-    """Send email using SMTP"""
+@track_duration('voca_smtp_send_seconds')
+def send_email(to_email, subject, html_content, text_content=None, message_id=None):
+    """Send email through the SMTP account pool, failing over between accounts"""
     try:
         logger.info(f"Preparing to send email to {to_email} with subject: {subject}")
         
-        # Check if SMTP is configured
-        smtp_user = current_app.config.get('SMTP_USER')
-        smtp_password = current_app.config.get('SMTP_PASSWORD')
-        
-        if not smtp_user or not smtp_password:
-            logger.warning("SMTP credentials not configured, cannot send email")
-            return False, "SMTP credentials not configured"
-        
-        # Ensure smtp_user is a string (decode if bytes)
-        if isinstance(smtp_user, bytes):
-            smtp_user = smtp_user.decode('utf-8')
-        else:
-            smtp_user = str(smtp_user)
-        
         msg = MIMEMultipart('alternative')
         msg['Subject'] = subject
-        msg['From'] = smtp_user
         msg['To'] = to_email
+        if message_id:
+            msg['Message-ID'] = message_id
         
         # Add text and HTML parts
         if text_content:
-            text_part = MIMEText(text_content, 'plain')
+            text_part = MIMEText(text_content, 'plain', BODY_CHARSET)
             msg.attach(text_part)
         
-        html_part = MIMEText(html_content, 'html')
+        html_part = MIMEText(html_content, 'html', BODY_CHARSET)
         msg.attach(html_part)
         
-        # Ensure password is a string (decode if bytes)
-        if isinstance(smtp_password, bytes):
-            password = smtp_password.decode('utf-8')
-        elif smtp_password:
-            password = str(smtp_password)
-        else:
-            password = ""
-        
-        # Send email
-        with smtplib.SMTP(current_app.config['SMTP_HOST'], current_app.config['SMTP_PORT']) as server:
-            if current_app.config['SMTP_USE_TLS']:
-                server.starttls()
-            server.login(smtp_user, password)
-            server.send_message(msg)
+        # From is set per account by the pool
+        success, error, account = smtp_pool.send_message(msg, current_app.config)
+        if not success:
+            logger.error(f"Failed to send email to {to_email}: {error}")
+            return False, error
         
-        logger.info(f"Email sent successfully to {to_email}")
+        logger.info(f"Email sent successfully to {to_email} via SMTP account {account}")
         return True, None
     except Exception as e:
         logger.error(f"Failed to send email to {to_email}: {str(e)}")
         return False, str(e)
 
+def project_vocabulary_page(page):
+    """
+    Reduce a Notion page to {'id': page id, 'data': {property name: plain value}}.
+
+    This is the projection cached by the shared Notion query cache, so it must
+    stay JSON-serialisable.
+    """
+    properties = page.get('properties', {})
+    item_data = {}
+    
+    # Extract common vocabulary fields
+    for prop_name, prop_value in properties.items():
+        prop_type = prop_value.get('type')
+        
+        if prop_type == 'title':
+            title = prop_value.get('title', [])
+            # Concatenate all title segments to handle formatted text
+            item_data[prop_name] = ''.join([segment.get('plain_text', '') for segment in title]) if title else ''
+        elif prop_type == 'rich_text':
+            rich_text = prop_value.get('rich_text', [])
+            # Concatenate all rich text segments to handle links, bold, italic, etc.
+            item_data[prop_name] = ''.join([segment.get('plain_text', '') for segment in rich_text]) if rich_text else ''
+        elif prop_type == 'select':
+            select = prop_value.get('select')
+            item_data[prop_name] = select.get('name', '') if select else ''
+        elif prop_type == 'multi_select':
+            multi_select = prop_value.get('multi_select', [])
+            if not multi_select: continue
+            item_data[prop_name] = [option.get('name', '') for option in multi_select]
+        elif prop_type == 'url':
+            item_data[prop_name] = prop_value.get('url', '')
+        elif prop_type == 'email':
+            item_data[prop_name] = prop_value.get('email', '')
+        elif prop_type == 'phone_number':
+            item_data[prop_name] = prop_value.get('phone_number', '')
+        elif prop_type == 'number':
+            item_data[prop_name] = prop_value.get('number', '')
+        elif prop_type == 'checkbox':
+            item_data[prop_name] = prop_value.get('checkbox', False)
+        elif prop_type == 'date':
+            date_obj = prop_value.get('date')
+            if date_obj:
+                item_data[prop_name] = date_obj.get('start', '')
+            else:
+                item_data[prop_name] = ''
+        elif prop_type == 'created_time':
+            # Created time property - returns ISO 8601 datetime string
+            item_data[prop_name] = prop_value.get('created_time', '')
+        elif prop_type == 'last_edited_time':
+            # Last edited time property - returns ISO 8601 datetime string
+            item_data[prop_name] = prop_value.get('last_edited_time', '')
+        elif prop_type == 'unique_id':
+            # Unique ID property - returns a number or prefix-number combination
+            unique_id = prop_value.get('unique_id', {})
+            if unique_id:
+                prefix = unique_id.get('prefix')
+                number = unique_id.get('number')
+                if prefix:
+                    item_data[prop_name] = f"{prefix}-{number}" if number else prefix
+                else:
+                    item_data[prop_name] = str(number) if number else ''
+            else:
+                item_data[prop_name] = ''
+    
+    return {'id': page.get('id'), 'data': item_data}
+
 @log_function_call("Notion vocabulary fetch")
-def get_vocabulary_from_notion(api_key, database_id, count=10, selection_method='random', date_range_start=None, date_range_end=None):
+@track_duration('voca_notion_fetch_seconds')
+def get_vocabulary_from_notion(api_key, database_id, count=10, selection_method='random', date_range_start=None, date_range_end=None,
+                               service_id=None, include_ids=False, raise_errors=False):
     """
     Get vocabulary items from Notion database using specified selection method
     
+    The Notion query itself goes through the shared single-flight cache, so
+    services on the same database firing together cost one Notion call; the
+    selection below is applied locally per send.
+    
     Args:
         api_key: Notion API key
         database_id: Notion database ID
         count: Number of items to fetch
-        selection_method: 'random', 'latest', or 'date_range'
+        selection_method: 'random', 'latest', 'date_range' or 'spaced_repetition'
         date_range_start: Start date for date_range method (datetime.date object)
         date_range_end: End date for date_range method (datetime.date object)
+        service_id: When set, random picks skip items this service sent recently
+            and spaced_repetition uses the service's review state
+        include_ids: Return {'id': page id, 'data': item} entries instead of bare items
+        raise_errors: Raise VocabularyFetchError when Notion can't be read,
+            instead of returning [] as for an empty database
     """
     try:
         logger.info(f"Fetching {count} vocabulary items from Notion database {database_id} using {selection_method} method")
         
-        notion = Client(auth=api_key)
-        
         # Build query filters based on selection method
         # Page size limited by Notion up to 100
         # https://developers.notion.com/reference/intro#:~:text=Default%3A%20100-,Maximum%3A%20100,-The%20response%20may
+        # Always sort by created time descending: `latest` needs it, and sending the
+        # same query for every method lets random and latest services share one fetch
         query_params = {
-            'database_id': database_id,
-            'page_size': 100
+            'page_size': 100,
+            'sorts': [{'timestamp': 'created_time', 'direction': 'descending'}]
         }
         
-        # For latest selection, sort by created time descending
-        if selection_method == 'latest':
-            query_params['sorts'] = [{'timestamp': 'created_time', 'direction': 'descending'}]
-        
         # For date_range selection, filter by created date
         if selection_method == 'date_range' and (date_range_start or date_range_end):
             filters = []
@@ -164,10 +258,8 @@ def get_vocabulary_from_notion(api_key, database_id, count=10, selection_method=
             elif len(filters) == 1:
                 query_params['filter'] = filters[0]
         
-        # Get items from database
-        response = notion.databases.query(**query_params)
-        
-        items = response.get('results', [])
+        # Get items from database (shared with concurrent sends on the same database)
+        items = query_database_cached(api_key, database_id, query_params, project_vocabulary_page)
         
         if not items:
             logger.warning(f"No items found in Notion database {database_id}")
@@ -176,7 +268,14 @@ def get_vocabulary_from_notion(api_key, database_id, count=10, selection_method=
         logger.info(f"Found {len(items)} total items in database")
         
         # Select items based on method
-        if selection_method == 'random':
+        if selection_method == 'spaced_repetition' and service_id:
+            # Most overdue reviews first, then items never sent by this service
+            _seed_service_reviews(service_id, api_key, database_id, query_params, items)
+            selected_items = select_for_review(service_id, items, count)
+        elif selection_method in ('random', 'date_range') and service_id:
+            # Random pick that avoids this service's recently sent items
+            selected_items = select_unsent(service_id, items, count)
+        elif selection_method == 'random':
             # Randomly select items
             selected_items = random.sample(items, min(count, len(items)))
         elif selection_method == 'latest':
@@ -189,74 +288,37 @@ def get_vocabulary_from_notion(api_key, database_id, count=10, selection_method=
             # Default to random
             selected_items = random.sample(items, min(count, len(items)))
         
-        vocabulary_items = []
-        for item in selected_items:
-            properties = item.get('properties', {})
-            item_data = {}
-            
-            # Extract common vocabulary fields
-            for prop_name, prop_value in properties.items():
-                prop_type = prop_value.get('type')
-                
-                if prop_type == 'title':
-                    title = prop_value.get('title', [])
-                    # Concatenate all title segments to handle formatted text
-                    item_data[prop_name] = ''.join([segment.get('plain_text', '') for segment in title]) if title else ''
-                elif prop_type == 'rich_text':
-                    rich_text = prop_value.get('rich_text', [])
-                    # Concatenate all rich text segments to handle links, bold, italic, etc.
-                    item_data[prop_name] = ''.join([segment.get('plain_text', '') for segment in rich_text]) if rich_text else ''
-                elif prop_type == 'select':
-                    select = prop_value.get('select')
-                    item_data[prop_name] = select.get('name', '') if select else ''
-                elif prop_type == 'multi_select':
-                    multi_select = prop_value.get('multi_select', [])
-                    if not multi_select: continue
-                    item_data[prop_name] = [option.get('name', '') for option in multi_select]
-                elif prop_type == 'url':
-                    item_data[prop_name] = prop_value.get('url', '')
-                elif prop_type == 'email':
-                    item_data[prop_name] = prop_value.get('email', '')
-                elif prop_type == 'phone_number':
-                    item_data[prop_name] = prop_value.get('phone_number', '')
-                elif prop_type == 'number':
-                    item_data[prop_name] = prop_value.get('number', '')
-                elif prop_type == 'checkbox':
-                    item_data[prop_name] = prop_value.get('checkbox', False)
-                elif prop_type == 'date':
-                    date_obj = prop_value.get('date')
-                    if date_obj:
-                        item_data[prop_name] = date_obj.get('start', '')
-                    else:
-                        item_data[prop_name] = ''
-                elif prop_type == 'created_time':
-                    # Created time property - returns ISO 8601 datetime string
-                    item_data[prop_name] = prop_value.get('created_time', '')
-                elif prop_type == 'last_edited_time':
-                    # Last edited time property - returns ISO 8601 datetime string
-                    item_data[prop_name] = prop_value.get('last_edited_time', '')
-                elif prop_type == 'unique_id':
-                    # Unique ID property - returns a number or prefix-number combination
-                    unique_id = prop_value.get('unique_id', {})
-                    if unique_id:
-                        prefix = unique_id.get('prefix')
-                        number = unique_id.get('number')
-                        if prefix:
-                            item_data[prop_name] = f"{prefix}-{number}" if number else prefix
-                        else:
-                            item_data[prop_name] = str(number) if number else ''
-                    else:
-                        item_data[prop_name] = ''
-            
-            vocabulary_items.append(item_data)
+        vocabulary_items = selected_items if include_ids else [item['data'] for item in selected_items]
         
         logger.info(f"Successfully fetched {len(vocabulary_items)} vocabulary items")
         return vocabulary_items
         
     except Exception as e:
         logger.error(f"Error fetching vocabulary from Notion database {database_id}: {str(e)}")
+        if is_token_rejection(e):
+            # Later sends with this token fail fast instead of calling Notion again
+            record_token_rejection(api_key)
+        if raise_errors:
+            raise VocabularyFetchError(str(e)) from e
         return []
 
+def _seed_service_reviews(service_id, api_key, database_id, query_params, items):
+    """Add this send's items, and the next pages of the database, to the service's review rows"""
+    service = EmailService.query.get(service_id)
+
+    def fetch_page(cursor):
+        return query_database_page(api_key, database_id, query_params, project_vocabulary_page, cursor)
+
+    try:
+        seed_reviews(service, items, fetch_page, current_app.config.get('SPACED_REPETITION_SEED_PAGES', 5))
+    except Exception as e:
+        # The send goes ahead with the items seeded so far
+        logger.warning(f"Could not walk Notion database {database_id} for service {service_id}: {str(e)}")
+        if getattr(e, 'code', None) == APIErrorCode.ValidationError:
+            # Cursors don't last forever; start the walk again from the top
+            service.review_cursor = None
+
+
 def render_item_fields(
     item: dict[str, Any],
     word: str,
@@ -313,22 +375,20 @@ def render_item_fields(
     return fields_html
 
 
-@log_function_call("Email content creation")
-def create_email_content(
-    vocabulary_items: list[dict[str, Any]],
-    user_name: str,
-    database_url: str | None = None,
-    column_selection: ColumnSelection | None = None,
-    email_client: str | None = None,
-) -> str:
-    """Create HTML email content tailored to the user's preferred email client.
-
-    Apple Mail supports interactive <details>/<summary> flashcards, so words stay
-    collapsed until tapped. Gmail and Outlook strip those toggles, so the content
-    is rendered statically with the vocabulary word shown in bold.
+EMAIL_FOOTER_HTML = """
+            </div>
+            <div class="footer">
+                <p>Keep learning and expanding your vocabulary! 🚀</p>
+                <p>This email was sent by Notion Email Vocabulary Recall</p>
+            </div>
+        </div>
+    </body>
+    </html>
     """
-    email_client = normalize_email_client(email_client)
-    supports_toggles = email_client == 'apple_mail'
+
+
+def render_email_header(user_name: str, supports_toggles: bool) -> str:
+    """Render the document head, styles, greeting banner and usage tip."""
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -438,8 +498,50 @@ def create_email_content(
                 </div>
         """
 
-    html_content += f"""
-                <h2>Today's Vocabulary ({len(vocabulary_items)} words)</h2>
+    return html_content
+
+
+@log_function_call("Email content creation")
+@track_duration('voca_email_render_seconds')
+def create_email_content(
+    vocabulary_items: list[dict[str, Any]],
+    user_name: str,
+    database_url: str | None = None,
+    column_selection: ColumnSelection | None = None,
+    email_client: str | None = None,
+) -> str:
+    """Create HTML email content tailored to the user's preferred email client.
+
+    Apple Mail supports interactive <details>/<summary> flashcards, so words stay
+    collapsed until tapped. Gmail and Outlook strip those toggles, so the content
+    is rendered statically with the vocabulary word shown in bold.
+    """
+    email_client = normalize_email_client(email_client)
+    supports_toggles = email_client == 'apple_mail'
+    html_content = render_email_header(user_name, supports_toggles)
+
+    html_content += render_vocabulary_section(
+        vocabulary_items,
+        f"Today's Vocabulary ({len(vocabulary_items)} words)",
+        database_url,
+        column_selection,
+        supports_toggles,
+    )
+    html_content += EMAIL_FOOTER_HTML
+    
+    return html_content
+
+
+def render_vocabulary_section(
+    vocabulary_items: list[dict[str, Any]],
+    heading: str,
+    database_url: str | None,
+    column_selection: ColumnSelection | None,
+    supports_toggles: bool,
+) -> str:
+    """Render one heading + flashcard list + database link block of an email body."""
+    html_content = f"""
+                <h2>{heading}</h2>
     """
 
     for i, item in enumerate(vocabulary_items, 1):
@@ -499,17 +601,34 @@ def create_email_content(
                 </div>
         """
     
-    html_content += """
-            </div>
-            <div class="footer">
-                <p>Keep learning and expanding your vocabulary! 🚀</p>
-                <p>This email was sent by Notion Email Vocabulary Recall</p>
-            </div>
-        </div>
-    </body>
-    </html>
+    return html_content
+
+
+@log_function_call("Digest content creation")
+@track_duration('voca_email_render_seconds')
+def create_digest_email_content(
+    sections: list[dict[str, Any]],
+    user_name: str,
+    email_client: str | None = None,
+) -> str:
+    """Combine several services' vocabulary into one email.
+
+    Each section is {'title', 'vocabulary_items', 'database_url', 'column_selection'}
+    and is rendered exactly like the body of a single-service email.
     """
-    
+    email_client = normalize_email_client(email_client)
+    supports_toggles = email_client == 'apple_mail'
+    html_content = render_email_header(user_name, supports_toggles)
+    for section in sections:
+        items = section['vocabulary_items']
+        html_content += render_vocabulary_section(
+            items,
+            f"{section['title']} ({len(items)} words)",
+            section.get('database_url'),
+            section.get('column_selection'),
+            supports_toggles,
+        )
+    html_content += EMAIL_FOOTER_HTML
     return html_content
 
 @email_bp.route('/send-test', methods=['POST'])
@@ -579,11 +698,11 @@ def send_test_email():
             if not database.token_id:
                 return jsonify({'error': 'Database has no associated token'}), 400
             
-            token = NotionToken.query.get(database.token_id)
-            if not token or not token.is_active:
+            token = get_token_handle(database.token_id)
+            if not token:
                 return jsonify({'error': 'Token not found or inactive'}), 404
             
-            api_key = token.token
+            api_key = token.api_key
             database_id = database.database_id
             
         # Support both new (database_pk) and legacy (notion_api_key + database_id) methods
@@ -600,16 +719,12 @@ def send_test_email():
             if not database.token_id:
                 return jsonify({'error': 'Database has no associated token. Please update the database configuration.'}), 400
             
-            token = NotionToken.query.filter_by(
-                id=database.token_id,
-                user_id=current_user_id,
-                is_active=True
-            ).first()
+            token = get_token_handle(database.token_id, user_id=current_user_id)
             
             if not token:
                 return jsonify({'error': 'Token not found or inactive'}), 404
             
-            api_key = token.token
+            api_key = token.api_key
             database_id = database.database_id
         else:
             # Legacy method: use provided API key and database ID
@@ -637,12 +752,14 @@ def send_test_email():
         
         # Create email content
         html_content = create_email_content(vocabulary_items, user.first_name, database_url, column_selection=column_selection, email_client=email_client)
+        html_content, text_content, _ = prepare_email_body(html_content, email_client)
 
         # Send email
         success, error = send_email(
             user.email,
             "Test: Daily Vocabulary Recall",
             html_content,
+            text_content,
         )
         
         if not success:
@@ -667,6 +784,86 @@ def send_test_email():
         db.session.rollback()
         return jsonify({'error': 'Failed to send test email', 'details': str(e)}), 500
 
+@email_bp.route('/preview', methods=['POST'])
+@jwt_required()
+@log_api_call("Preview email")
+def preview_email():
+    """Render an email from a cached vocabulary sample without sending it
+    
+    Settings in the request (column_selection, email_client, vocabulary_count)
+    override those of service_id, so unsaved edits can be previewed. The same
+    newest items are shown every time; pass refresh to re-read them from Notion.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        user = User.query.get(current_user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        data: dict[str, Any] = request.get_json() or {}
+        database_pk: int | None = data.get('database_pk')
+        column_selection: ColumnSelection | None = data.get('column_selection')
+        email_client: str | None = data.get('email_client')
+        vocabulary_count = data.get('vocabulary_count')
+        subject = "Test: Daily Vocabulary Recall"
+        
+        if data.get('service_id'):
+            service = EmailService.query.filter_by(id=data['service_id'], user_id=current_user_id).first()
+            if not service:
+                return jsonify({'error': 'Email service not found'}), 404
+            database_pk = service.database_id
+            column_selection = column_selection if column_selection is not None else service.column_selection
+            email_client = email_client or service.email_client
+            vocabulary_count = vocabulary_count or service.vocabulary_count
+            subject = f"{service.service_name} - Vocabulary Recall"
+        
+        if not database_pk:
+            return jsonify({'error': 'Either service_id or database_pk is required'}), 400
+        if not column_selection:
+            return jsonify({'error': 'Select at least one column to preview'}), 400
+        
+        database = NotionDatabase.query.filter_by(id=database_pk, user_id=current_user_id).first()
+        if not database:
+            return jsonify({'error': 'Database not found'}), 404
+        token = get_token_handle(database.token_id, user_id=current_user_id) if database.token_id else None
+        if not token:
+            return jsonify({'error': 'Token not found or inactive'}), 404
+        
+        sample = get_database_sample(token.api_key, database.database_id, project_vocabulary_page,
+                                     refresh=bool(data.get('refresh')))
+        try:
+            vocabulary_count = max(1, int(vocabulary_count or 5))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'vocabulary_count must be a number'}), 400
+        vocabulary_items = [entry['data'] for entry in sample['items'][:vocabulary_count]]
+        if not vocabulary_items:
+            return jsonify({'error': 'No vocabulary items found in the database'}), 400
+        
+        start_time = time.perf_counter()
+        email_client = normalize_email_client(email_client)
+        html_content = create_email_content(vocabulary_items, user.first_name, _notion_database_url(database),
+                                            column_selection=column_selection, email_client=email_client)
+        if current_app.config.get('EMAIL_COMPACT_ENABLED', True):
+            html_content, _, _ = compact_email(html_content, email_client)
+        
+        return jsonify({
+            'html': html_content,
+            'subject': subject,
+            'email_client': email_client,
+            'vocabulary_count': len(vocabulary_items),
+            'html_bytes': len(html_content.encode('utf-8')),
+            'render_ms': _elapsed_ms(start_time),
+            'sample': {
+                'size': len(sample['items']),
+                'cached_at': datetime.utcfromtimestamp(sample['cached_at']).isoformat() + 'Z',
+                'from_cache': sample['from_cache'],
+            }
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Failed to render email preview for user {current_user_id}: {str(e)}")
+        return jsonify({'error': 'Failed to render email preview', 'details': str(e)}), 500
+
 @email_bp.route('/logs', methods=['GET'])
 @jwt_required()
 @log_api_call("Get email logs")
@@ -679,122 +876,372 @@ def get_email_logs():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         
+        # Logs are insert-only, so count and max id identify the list
+        etag = list_etag(row_version(EmailLog, EmailLog.user_id == current_user_id),
+                         params=(current_user_id, page, per_page))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
         logs = EmailLog.query.filter_by(user_id=current_user_id)\
             .order_by(EmailLog.sent_at.desc())\
             .paginate(page=page, per_page=per_page, error_out=False)
         
-        return jsonify({
+        return with_etag(jsonify({
             'logs': [log.to_dict() for log in logs.items],
             'total': logs.total,
             'pages': logs.pages,
             'current_page': page
-        }), 200
+        }), etag), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get email logs', 'details': str(e)}), 500
 
 
-@celery.task
-def send_email_service_task(service_id):
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _load_service_context(service_id):
+    """
+    Load and validate everything a scheduled send needs.
+
+    Returns:
+        (service, database, user, TokenHandle), or None if any of them is missing or
+        inactive. The token is None when Notion rejected it: that send fails
+        (and is retried) instead of being skipped.
+    """
+    # Get the email service configuration
+    service = EmailService.query.get(service_id)
+    if not service or not service.is_active:
+        logger.warning(f"Email service {service_id} not found or inactive")
+        return None
+    
+    # Get the associated database
+    database = NotionDatabase.query.get(service.database_id)
+    if not database or not database.is_active:
+        logger.warning(f"Database {service.database_id} not found or inactive")
+        return None
+    
+    # Get the user
+    user = User.query.get(database.user_id)
+    if not user or not user.is_active:
+        logger.warning(f"User {database.user_id} not found or inactive")
+        return None
+    
+    # Get the Notion API token
+    if not database.token_id:
+        logger.error(f"Database {database.id} has no associated token")
+        return None
+    
+    # Cached per worker, so repeated sends skip the lookup (and a known-bad token)
+    token, reason = lookup_token(database.token_id)
+    if not token and reason != REJECTED:
+        return None
+    
+    return service, database, user, token
+
+
+def _select_service_vocabulary(service, database, token):
     """
-    Celery task to send vocabulary email based on EmailService configuration.
-    This task is triggered by Celery Beat scheduler.
+    Fetch and select this service's vocabulary as [{'id', 'data'}] entries.
+
+    Raises:
+        VocabularyFetchError: the token was rejected or Notion could not be read
+    """
+    if token is None:
+        raise VocabularyFetchError('Notion token rejected by Notion')
+    return get_vocabulary_from_notion(
+        api_key=token.api_key,
+        database_id=database.database_id,
+        count=service.vocabulary_count,
+        selection_method=service.selection_method,
+        date_range_start=service.date_range_start,
+        date_range_end=service.date_range_end,
+        service_id=service.id,
+        include_ids=True,
+        raise_errors=True
+    )
+
+
+def _notion_database_url(database):
+    return f"https://www.notion.so/{database.database_id.replace('-', '')}"
+
+
+def _record_service_send(service, user, selected_entries, success, error, sent_at, scheduled_at, stage_timings, status=None):
+    """
+    Update send history and add the EmailLog for one service (the caller commits).
+    `status` overrides the 'sent'/'failed' derived from `success`, e.g. 'skipped'.
+    """
+    status = status or ('sent' if success else 'failed')
+    inc('voca_emails_total', frequency=service.frequency, status=status)
+    
+    if success:
+        # Update last_sent_at timestamp
+        service.last_sent_at = sent_at
+        record_sent_items(service.id, [entry['id'] for entry in selected_entries])
+        if service.selection_method == 'spaced_repetition':
+            record_reviews(service.id, selected_entries, now=sent_at)
+    
+    # Log the email together with its schedule and stage timings
+    scheduled_at = datetime.utcfromtimestamp(scheduled_at) if scheduled_at is not None else None
+    email_log = EmailLog(
+        user_id=user.id,
+        service_id=service.id,
+        scheduled_at=scheduled_at,
+        sent_at=sent_at,
+        lag_ms=EmailLog.compute_lag_ms(scheduled_at, sent_at),
+        stage_timings=stage_timings,
+        vocabulary_items=[entry['data'] for entry in selected_entries],
+        status=status,
+        error_message=error if not success else None
+    )
+    db.session.add(email_log)
+
+
+def _fetch_failed(service, user, error, scheduled_at, stage_timings, final):
+    """Outcome of a send whose vocabulary could not be read from Notion"""
+    if not final:
+        logger.warning(f"Could not read Notion for service {service.id}, will retry: {error}")
+        return 'retry', str(error)
+    logger.error(f"Could not read Notion for service {service.id}, giving up: {error}")
+    _record_service_send(service, user, [], False, str(error), datetime.utcnow(), scheduled_at, stage_timings)
+    return 'failed', str(error)
+
+
+def _record_empty(service, user, scheduled_at, stage_timings):
+    """Log a send skipped because the database returned no vocabulary"""
+    logger.warning(f"No vocabulary items found for service {service.id}")
+    _record_service_send(service, user, [], False, 'No vocabulary items found', datetime.utcnow(),
+                         scheduled_at, stage_timings, status='skipped')
+    return 'skipped', 'No vocabulary items found'
+
+
+def _queue_timings(scheduled_at, dispatched_at, started_at):
+    stage_timings = {}
+    if scheduled_at is not None and dispatched_at is not None:
+        stage_timings['dispatch_ms'] = round((dispatched_at - scheduled_at) * 1000, 2)
+    if dispatched_at is not None:
+        stage_timings['queue_ms'] = round((started_at - dispatched_at) * 1000, 2)
+    return stage_timings
+
+
+def deliver_service_email(service_id, scheduled_at=None, dispatched_at=None, message_id=None, final=True):
+    """
+    Select, render and send one service's vocabulary email (the caller commits).
     
     Args:
         service_id: ID of the EmailService record
+        scheduled_at: UTC epoch seconds the service was due (its ZSET score)
+        dispatched_at: UTC epoch seconds the send was handed to a worker
+        message_id: Message-ID header, stable across retries of the same delivery
+        final: whether a failed send is recorded (False leaves it to a later retry)
+    
+    Returns:
+        tuple: (outcome, error) where outcome is 'sent', 'failed', 'retry' or 'skipped'
+    """
+    task_start = time.perf_counter()
+    stage_timings = _queue_timings(scheduled_at, dispatched_at, time.time())
+    
+    context = _load_service_context(service_id)
+    if not context:
+        return 'skipped', 'Service, database, user or token not found or inactive'
+    service, database, user, token = context
+    
+    logger.info(f"Processing email service: {service.service_name} (ID: {service_id}) for user: {user.email}")
+    
+    # Get vocabulary from Notion based on selection method
+    stage_start = time.perf_counter()
+    try:
+        selected_entries = _select_service_vocabulary(service, database, token)
+    except VocabularyFetchError as e:
+        stage_timings['notion_ms'] = _elapsed_ms(stage_start)
+        return _fetch_failed(service, user, e, scheduled_at, stage_timings, final)
+    vocabulary_items = [entry['data'] for entry in selected_entries]
+    stage_timings['notion_ms'] = _elapsed_ms(stage_start)
+    
+    if not vocabulary_items:
+        return _record_empty(service, user, scheduled_at, stage_timings)
+    
+    logger.info(f"Retrieved {len(vocabulary_items)} vocabulary items for service {service_id}")
+    
+    # Create email content
+    stage_start = time.perf_counter()
+    html_content = create_email_content(
+        vocabulary_items,
+        user.first_name,
+        _notion_database_url(database),
+        column_selection=service.column_selection,
+        email_client=service.email_client
+    )
+    html_content, text_content, body_stats = prepare_email_body(html_content, service.email_client)
+    stage_timings['render_ms'] = _elapsed_ms(stage_start)
+    stage_timings.update(body_stats)
+    
+    # Send email
+    subject = f"{service.service_name} - Vocabulary Recall"
+    stage_start = time.perf_counter()
+    success, error = send_email(user.email, subject, html_content, text_content, message_id=message_id)
+    sent_at = datetime.utcnow()
+    stage_timings['smtp_ms'] = _elapsed_ms(stage_start)
+    stage_timings['total_ms'] = _elapsed_ms(task_start)
+    
+    if success:
+        logger.info(f"Successfully sent email for service {service_id} to {user.email}")
+    elif not final:
+        logger.warning(f"Failed to send email for service {service_id}, will retry: {error}")
+        return 'retry', error
+    else:
+        logger.error(f"Failed to send email for service {service_id}: {error}")
+    
+    _record_service_send(service, user, selected_entries, success, error, sent_at, scheduled_at, stage_timings)
+    return ('sent' if success else 'failed'), error
+
+
+def deliver_digest_email(user_id, services, dispatched_at=None, message_id=None, final=True):
+    """
+    Send one combined email for several services of a digest-mode user (the caller commits).
+    
+    Each service still selects its own vocabulary (the shared Notion query cache
+    means each database is fetched once) and gets its own EmailLog; rendering
+    and the SMTP transaction happen once for the whole digest.
+    
+    Args:
+        user_id: ID of the User the services belong to
+        services: list of [service_id, scheduled_at epoch seconds] pairs
+        dispatched_at: UTC epoch seconds the send was handed to a worker
+        message_id: Message-ID header, stable across retries of the same delivery
+        final: whether a failed send is recorded (False leaves it to a later retry)
+    
+    Returns:
+        dict: {service_id: (outcome, error)} with the outcomes of deliver_service_email
+    """
+    task_start = time.perf_counter()
+    started_at = time.time()
+    
+    outcomes = {}
+    prepared = []
+    for service_id, scheduled_at in services:
+        context = _load_service_context(service_id)
+        if not context:
+            outcomes[service_id] = ('skipped', 'Service, database, user or token not found or inactive')
+            continue
+        service, database, user, token = context
+        if user.id != user_id:
+            logger.warning(f"Service {service_id} does not belong to user {user_id}, skipping in digest")
+            outcomes[service_id] = ('skipped', f"Service does not belong to user {user_id}")
+            continue
+        
+        stage_timings = _queue_timings(scheduled_at, dispatched_at, started_at)
+        stage_start = time.perf_counter()
+        try:
+            selected_entries = _select_service_vocabulary(service, database, token)
+        except VocabularyFetchError as e:
+            stage_timings['notion_ms'] = _elapsed_ms(stage_start)
+            outcomes[service_id] = _fetch_failed(service, user, e, scheduled_at, stage_timings, final)
+            continue
+        stage_timings['notion_ms'] = _elapsed_ms(stage_start)
+        
+        if not selected_entries:
+            outcomes[service_id] = _record_empty(service, user, scheduled_at, stage_timings)
+            continue
+        prepared.append((service, database, scheduled_at, selected_entries, stage_timings))
+    
+    if not prepared:
+        logger.warning(f"Nothing to send in digest for user {user_id}")
+        return outcomes
+    
+    user = User.query.get(user_id)
+    logger.info(f"Sending digest of {len(prepared)} services to user: {user.email}")
+    
+    stage_start = time.perf_counter()
+    html_content = create_digest_email_content(
+        [{
+            'title': service.service_name,
+            'vocabulary_items': [entry['data'] for entry in selected_entries],
+            'database_url': _notion_database_url(database),
+            'column_selection': service.column_selection,
+        } for service, database, _, selected_entries, _ in prepared],
+        user.first_name,
+        email_client=prepared[0][0].email_client
+    )
+    html_content, text_content, body_stats = prepare_email_body(html_content, prepared[0][0].email_client)
+    render_ms = _elapsed_ms(stage_start)
+    
+    if len(prepared) == 1:
+        subject = f"{prepared[0][0].service_name} - Vocabulary Recall"
+    else:
+        subject = f"Your Vocabulary Digest ({len(prepared)} services) - Vocabulary Recall"
+    stage_start = time.perf_counter()
+    success, error = send_email(user.email, subject, html_content, text_content, message_id=message_id)
+    sent_at = datetime.utcnow()
+    smtp_ms = _elapsed_ms(stage_start)
+    total_ms = _elapsed_ms(task_start)
+    
+    if success:
+        logger.info(f"Successfully sent digest of {len(prepared)} services to {user.email}")
+    elif not final:
+        logger.warning(f"Failed to send digest for user {user_id}, will retry: {error}")
+        outcomes.update({service.id: ('retry', error) for service, *_ in prepared})
+        return outcomes
+    else:
+        logger.error(f"Failed to send digest for user {user_id}: {error}")
+    
+    for service, _, scheduled_at, selected_entries, stage_timings in prepared:
+        # Render and SMTP are shared by every service in the digest
+        stage_timings.update({
+            'render_ms': render_ms,
+            'smtp_ms': smtp_ms,
+            'total_ms': total_ms,
+            'digest_size': len(prepared),
+            **body_stats,
+        })
+        _record_service_send(service, user, selected_entries, success, error, sent_at, scheduled_at, stage_timings)
+        outcomes[service.id] = ('sent' if success else 'failed', error)
+    return outcomes
+
+
+@celery.task
+def send_email_service_task(service_id, scheduled_at=None, dispatched_at=None):
+    """
+    Celery task sending one service's email right away, outside the outbox.
+    
+    The scheduler delivers through the outbox (app/outbox.py); this task is
+    kept for manual sends and for tasks still queued from older releases.
     
     Returns:
         bool: True if email sent successfully, False otherwise
     """
     try:
         with current_app.app_context():
-            # Get the email service configuration
-            service = EmailService.query.get(service_id)
-            if not service or not service.is_active:
-                logger.warning(f"Email service {service_id} not found or inactive")
-                return False
-            
-            # Get the associated database
-            database = NotionDatabase.query.get(service.database_id)
-            if not database or not database.is_active:
-                logger.warning(f"Database {service.database_id} not found or inactive")
-                return False
-            
-            # Get the user
-            user = User.query.get(database.user_id)
-            if not user or not user.is_active:
-                logger.warning(f"User {database.user_id} not found or inactive")
-                return False
-            
-            logger.info(f"Processing email service: {service.service_name} (ID: {service_id}) for user: {user.email}")
-            
-            # Get the Notion API token
-            if not database.token_id:
-                logger.error(f"Database {database.id} has no associated token")
-                return False
-            
-            token = NotionToken.query.get(database.token_id)
-            if not token or not token.is_active:
-                logger.error(f"Token {database.token_id} not found or inactive")
-                return False
-            
-            # Get vocabulary from Notion based on selection method
-            vocabulary_items = get_vocabulary_from_notion(
-                api_key=token.token,
-                database_id=database.database_id,
-                count=service.vocabulary_count,
-                selection_method=service.selection_method,
-                date_range_start=service.date_range_start,
-                date_range_end=service.date_range_end
-            )
-            
-            if not vocabulary_items:
-                logger.warning(f"No vocabulary items found for service {service_id}")
-                return False
-            
-            logger.info(f"Retrieved {len(vocabulary_items)} vocabulary items for service {service_id}")
-            
-            # Create Notion database URL
-            database_url = f"https://www.notion.so/{database.database_id.replace('-', '')}"
-            
-            # Create email content
-            html_content = create_email_content(
-                vocabulary_items,
-                user.first_name,
-                database_url,
-                column_selection=service.column_selection,
-                email_client=service.email_client
-            )
-            
-            # Send email
-            subject = f"{service.service_name} - Vocabulary Recall"
-            success, error = send_email(user.email, subject, html_content)
-            
-            if success:
-                logger.info(f"Successfully sent email for service {service_id} to {user.email}")
-                # Update last_sent_at timestamp
-                service.last_sent_at = datetime.utcnow()
-                db.session.commit()
-            else:
-                logger.error(f"Failed to send email for service {service_id}: {error}")
-            
-            # Log the email
-            email_log = EmailLog(
-                user_id=user.id,
-                vocabulary_items=vocabulary_items,
-                status='sent' if success else 'failed',
-                error_message=error if not success else None
-            )
-            db.session.add(email_log)
+            outcome, _ = deliver_service_email(service_id, scheduled_at, dispatched_at)
             db.session.commit()
-            
-            return success
+            return outcome == 'sent'
             
     except Exception as e:
         logger.error(f"Error in send_email_service_task for service {service_id}: {e}", exc_info=True)
         return False
 
 
+@celery.task
+def send_digest_task(user_id, services, dispatched_at=None):
+    """
+    Celery task sending a digest right away, outside the outbox (see send_email_service_task).
+    
+    Returns:
+        bool: True if the digest was sent successfully, False otherwise
+    """
+    try:
+        with current_app.app_context():
+            outcomes = deliver_digest_email(user_id, services, dispatched_at)
+            db.session.commit()
+            return any(outcome == 'sent' for outcome, _ in outcomes.values())
+            
+    except Exception as e:
+        logger.error(f"Error in send_digest_task for user {user_id}: {e}", exc_info=True)
+        return False
+
+
 @celery.task
 def reload_email_schedules():
     """
@@ -808,30 +1255,9 @@ def reload_email_schedules():
             
             for service in services:
                 try:
-                    # Convert service time from local timezone to UTC
-                    # Service stores time in local timezone (e.g., Asia/Shanghai)
-                    # Celery Beat schedules in UTC, so we need to convert
-                    local_tz = pytz.timezone(service.timezone)
-                    utc_tz = pytz.UTC
-                    
-                    # Create a datetime object for today with the service time
-                    today = datetime.now(local_tz).date()
-                    local_datetime = local_tz.localize(datetime.combine(today, service.send_time))
-                    
-                    # Convert to UTC
-                    utc_datetime = local_datetime.astimezone(utc_tz)
-                    hour = utc_datetime.hour
-                    minute = utc_datetime.minute
-                    
-                    # Create cron schedule based on frequency
-                    if service.frequency == 'daily':
-                        schedule = crontab(hour=hour, minute=minute)
-                    elif service.frequency == 'weekly':
-                        schedule = crontab(hour=hour, minute=minute, day_of_week=1)
-                    elif service.frequency == 'monthly':
-                        schedule = crontab(hour=hour, minute=minute, day_of_month=1)
-                    else:
-                        continue
+                    # The service's compiled schedule (every-N-days included) is evaluated
+                    # in its own timezone, so no conversion of send_time to UTC is needed
+                    schedule = CronBeatSchedule(service.schedule(), service.timezone or 'UTC')
                     
                     # Add to beat schedule
                     task_name = f'email-service-{service.id}-{service.service_name}'
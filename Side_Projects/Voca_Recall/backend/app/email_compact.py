@@ -0,0 +1,197 @@
+"""
+Email body compaction: shrink rendered vocabulary emails before SMTP.
+
+Four passes, applied to the HTML produced by create_email_content:
+
+1. Class-based styles: for clients that honour a <style> block (Apple Mail,
+   Gmail), every inline style="" used more than once is hoisted into a
+   generated class, so a 50-word email carries each declaration once instead
+   of per field. This also keeps Gmail below its 102KB clipping threshold.
+2. Attribute deduplication: inline declarations are normalised and repeated
+   properties within one style collapse to the last one; for Outlook, which
+   keeps inline styles, this is all that is done to them.
+3. Whitespace minification: template indentation between tags and inside
+   the <style> block is removed; single spaces inside text are kept.
+4. A text/plain alternative derived from the HTML.
+"""
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+# Clients whose renderers apply classes from the <style> block reliably
+CLASS_STYLE_CLIENTS = ('apple_mail', 'gmail')
+
+# Gmail drops the whole <style> block beyond 16KB; stay inline past this
+MAX_STYLE_BLOCK_BYTES = 16 * 1024
+
+# Only hoist styles that repeat; one-off styles stay inline
+MIN_STYLE_REPEATS = 2
+
+TAG_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9-]*)(\s[^<>]*?)?(/?)>')
+STYLE_ATTR_PATTERN = re.compile(r'\sstyle\s*=\s*("([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+CLASS_ATTR_PATTERN = re.compile(r'\sclass\s*=\s*("([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+STYLE_BLOCK_PATTERN = re.compile(r'(<style[^>]*>)(.*?)(</style>)', re.IGNORECASE | re.DOTALL)
+# Whitespace between tags that contains a line break is template indentation
+INDENT_PATTERN = re.compile(r'>\s*\n\s*<')
+LEADING_INDENT_PATTERN = re.compile(r'\n\s+')
+
+
+def normalize_style(style):
+    """Canonical form of an inline style: trimmed, one declaration per property"""
+    declarations = {}
+    for declaration in style.split(';'):
+        if ':' not in declaration:
+            continue
+        prop, value = declaration.split(':', 1)
+        prop = prop.strip().lower()
+        value = ' '.join(value.split())
+        if prop and value:
+            # Later declarations win, as in the browser
+            declarations.pop(prop, None)
+            declarations[prop] = value
+    return ';'.join(f"{prop}:{value}" for prop, value in declarations.items())
+
+
+def _attr_value(match):
+    return match.group(2) if match.group(2) is not None else match.group(3)
+
+
+def _rewrite_styles(html, class_for_style):
+    """Normalise every inline style, replacing hoisted ones with their class"""
+
+    def rewrite_tag(match):
+        name, attrs, self_closing = match.group(1), match.group(2) or '', match.group(3)
+        style_match = STYLE_ATTR_PATTERN.search(attrs)
+        if not style_match:
+            return match.group(0)
+
+        style = normalize_style(_attr_value(style_match))
+        attrs = attrs[:style_match.start()] + attrs[style_match.end():]
+        hoisted = class_for_style.get(style)
+        if hoisted:
+            class_match = CLASS_ATTR_PATTERN.search(attrs)
+            if class_match:
+                classes = f"{_attr_value(class_match)} {hoisted}".strip()
+                attrs = f'{attrs[:class_match.start()]} class="{classes}"{attrs[class_match.end():]}'
+            else:
+                attrs = f'{attrs} class="{hoisted}"'
+        elif style:
+            attrs = f'{attrs} style="{style}"'
+        return f"<{name}{attrs}{self_closing}>"
+
+    return TAG_PATTERN.sub(rewrite_tag, html)
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = ' '.join(css.split())
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}')
+
+
+def minify_html(html):
+    """Drop indentation between tags and inside <style>; keeps spaces within text"""
+    html = STYLE_BLOCK_PATTERN.sub(lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), html)
+    html = INDENT_PATTERN.sub('><', html)
+    html = LEADING_INDENT_PATTERN.sub('\n', html)
+    return html.strip()
+
+
+def compact_html(html, email_client=None):
+    """Apply style hoisting (where supported), style dedup and minification"""
+    class_for_style = {}
+    if email_client in CLASS_STYLE_CLIENTS and '</style>' in html:
+        counts = {}
+        for match in TAG_PATTERN.finditer(html):
+            style_match = STYLE_ATTR_PATTERN.search(match.group(2) or '')
+            if style_match:
+                style = normalize_style(_attr_value(style_match))
+                counts[style] = counts.get(style, 0) + 1
+        repeated = [style for style, count in counts.items() if style and count >= MIN_STYLE_REPEATS]
+        class_for_style = {style: f"s{i}" for i, style in enumerate(repeated)}
+
+    rules = ''.join(f".{name}{{{style}}}" for style, name in class_for_style.items())
+    block = STYLE_BLOCK_PATTERN.search(html)
+    if block and len(minify_css(block.group(2) + rules).encode('utf-8')) > MAX_STYLE_BLOCK_BYTES:
+        class_for_style, rules = {}, ''
+
+    html = _rewrite_styles(html, class_for_style)
+
+    if rules:
+        # Appended last so the hoisted rules keep precedence over the template's class rules
+        html = html.replace('</style>', rules + '</style>', 1)
+
+    return minify_html(html)
+
+
+class _TextExtractor(HTMLParser):
+    """Collects readable text, turning block elements into line breaks"""
+
+    BLOCK_TAGS = {'p', 'div', 'h1', 'h2', 'h3', 'ul', 'ol', 'li', 'br', 'tr', 'details', 'summary'}
+    SKIP_TAGS = {'style', 'script', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+        self.link_href = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+            if tag == 'li':
+                self.parts.append('- ')
+        elif tag == 'a':
+            self.link_href = dict(attrs).get('href')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'a':
+            self.link_href = None
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        text = ' '.join(data.split())
+        if not text:
+            return
+        if self.link_href and self.link_href != text:
+            text = f"{text} ({self.link_href})"
+        if self.parts and not self.parts[-1].endswith(('\n', ' ')):
+            self.parts.append(' ')
+        self.parts.append(text)
+
+
+def html_to_text(html):
+    """Plain-text rendering of an email body for the text/plain alternative"""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = [line.strip() for line in ''.join(extractor.parts).split('\n')]
+    text = '\n'.join(lines)
+    # At most one blank line between blocks
+    return unescape(re.sub(r'\n{3,}', '\n\n', text)).strip() + '\n'
+
+
+def compact_email(html, email_client=None):
+    """
+    Compact an email body and derive its plain-text part.
+
+    Returns:
+        (compacted html, text, stats) where stats has 'html_bytes_before',
+        'html_bytes_after' and 'text_bytes'
+    """
+    compacted = compact_html(html, email_client)
+    text = html_to_text(compacted)
+    stats = {
+        'html_bytes_before': len(html.encode('utf-8')),
+        'html_bytes_after': len(compacted.encode('utf-8')),
+        'text_bytes': len(text.encode('utf-8')),
+    }
+    return compacted, text, stats
@@ -1,16 +1,140 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import User, EmailService, NotionDatabase, db
 from .logging_config import get_logger
 from .middleware import log_api_call
 from datetime import datetime
 import pytz
-from .email import reload_email_schedules
-from .redis_utils import add_to_schedule, remove_from_schedule
+from .email import reload_email_schedules, SELECTION_METHODS, EMAIL_CLIENTS
+from .redis_utils import add_to_schedule, remove_from_schedule, add_many_to_schedule
+from .recent_items import clear_sent_items
+from .cron import validate_cron_expression
+from .responses import row_version, list_etag, not_modified, with_etag
 
 email_service_bp = Blueprint('email_service', __name__)
 logger = get_logger(__name__)
 
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'custom', 'interval')
+MAX_INTERVAL_DAYS = 365
+DEFAULT_SEND_TIME = datetime.strptime('09:00', '%H:%M').time()
+
+
+def validate_schedule(frequency, cron_expression, interval_days=None):
+    """Return an error message for an invalid frequency / cron expression / interval, else None"""
+    if frequency not in FREQUENCIES:
+        return f"frequency must be one of: {', '.join(FREQUENCIES)}"
+    if frequency == 'custom':
+        try:
+            validate_cron_expression(cron_expression)
+        except ValueError as e:
+            return f"Invalid cron_expression: {str(e)}"
+    if frequency == 'interval':
+        if not isinstance(interval_days, int) or isinstance(interval_days, bool) \
+                or not 1 <= interval_days <= MAX_INTERVAL_DAYS:
+            return f"interval_days must be between 1 and {MAX_INTERVAL_DAYS}"
+    return None
+
+
+def parse_interval_anchor(value, timezone):
+    """
+    The interval anchor date from a payload value; today in `timezone` when empty.
+    
+    Returns:
+        (date, None) on success, (None, error message) otherwise
+    """
+    if value:
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date(), None
+        except (TypeError, ValueError):
+            return None, 'Invalid date format for interval_anchor. Expected YYYY-MM-DD'
+    try:
+        tz = pytz.timezone(timezone or 'UTC')
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.UTC
+    return datetime.now(tz).date(), None
+
+
+def build_service(data, user_id):
+    """
+    Validate a create payload and build an (unsaved) EmailService.
+    The caller checks that data['database_id'] belongs to user_id.
+    
+    Returns:
+        (service, None) on success, (None, error message) otherwise
+    """
+    # Parse send_time if provided
+    send_time = None
+    if data.get('send_time'):
+        try:
+            send_time = datetime.strptime(data['send_time'], '%H:%M').time()
+        except ValueError:
+            return None, 'Invalid time format. Expected HH:MM'
+    
+    # Parse date range if provided
+    date_range_start = None
+    date_range_end = None
+    if data.get('date_range_start'):
+        try:
+            date_range_start = datetime.strptime(data['date_range_start'], '%Y-%m-%d').date()
+        except ValueError:
+            return None, 'Invalid date format for date_range_start. Expected YYYY-MM-DD'
+    
+    if data.get('date_range_end'):
+        try:
+            date_range_end = datetime.strptime(data['date_range_end'], '%Y-%m-%d').date()
+        except ValueError:
+            return None, 'Invalid date format for date_range_end. Expected YYYY-MM-DD'
+    
+    # Validate vocabulary_count
+    vocabulary_count = data.get('vocabulary_count', 10)
+    if not isinstance(vocabulary_count, int) or vocabulary_count < 1 or vocabulary_count > 50:
+        return None, 'vocabulary_count must be between 1 and 50'
+    
+    # Validate selection_method
+    selection_method = data.get('selection_method', 'random')
+    if selection_method not in SELECTION_METHODS:
+        return None, f"selection_method must be one of: {', '.join(SELECTION_METHODS)}"
+
+    # Validate frequency (custom requires a cron expression, interval a day count)
+    frequency = data.get('frequency', 'daily')
+    cron_expression = data.get('cron_expression') or None
+    interval_days = data.get('interval_days') if frequency == 'interval' else None
+    schedule_error = validate_schedule(frequency, cron_expression, interval_days)
+    if schedule_error:
+        return None, schedule_error
+    interval_anchor = None
+    if frequency == 'interval':
+        interval_anchor, anchor_error = parse_interval_anchor(data.get('interval_anchor'), data.get('timezone', 'UTC'))
+        if anchor_error:
+            return None, anchor_error
+
+    # Validate email_client
+    email_client = data.get('email_client', 'apple_mail')
+    if email_client not in EMAIL_CLIENTS:
+        return None, f"email_client must be one of: {', '.join(EMAIL_CLIENTS)}"
+
+    service = EmailService(
+        user_id=user_id,
+        database_id=data['database_id'],
+        service_name=data['service_name'],
+        description=data.get('description'),
+        send_time=send_time or DEFAULT_SEND_TIME,
+        timezone=data.get('timezone', 'UTC'),
+        frequency=frequency,
+        cron_expression=cron_expression,
+        interval_days=interval_days,
+        interval_anchor=interval_anchor,
+        vocabulary_count=vocabulary_count,
+        selection_method=selection_method,
+        email_client=email_client,
+        date_range_start=date_range_start,
+        date_range_end=date_range_end,
+        is_active=data.get('is_active', True),
+        column_selection=data.get('column_selection', [])
+    )
+    service.status = 'PENDING'
+    return service, None
+
 
 @email_service_bp.route('', methods=['GET'])
 @jwt_required()
@@ -21,22 +145,33 @@ def get_email_services():
         current_user_id = int(get_jwt_identity())
         logger.info(f"Fetching email services for user {current_user_id}")
         
+        # The list embeds database names, so their versions count too
+        etag = list_etag(
+            row_version(EmailService, EmailService.user_id == current_user_id),
+            row_version(NotionDatabase, NotionDatabase.user_id == current_user_id),
+            params=(current_user_id,)
+        )
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
         services = EmailService.query.filter_by(user_id=current_user_id).all()
+        databases = {database.id: database for database in NotionDatabase.query.filter_by(user_id=current_user_id)}
         
         # Enrich with database info
         service_list = []
         for service in services:
             service_dict = service.to_dict()
-            database = NotionDatabase.query.get(service.database_id)
+            database = databases.get(service.database_id)
             if database:
                 service_dict['database_name'] = database.database_name
                 service_dict['database_url'] = database.database_url
             service_list.append(service_dict)
         
-        return jsonify({
+        return with_etag(jsonify({
             'services': service_list,
             'total': len(service_list)
-        }), 200
+        }), etag), 200
         
     except Exception as e:
         logger.error(f"Failed to get email services for user {current_user_id}: {str(e)}")
@@ -95,66 +230,12 @@ def create_email_service():
         if not database:
             return jsonify({'error': 'Database not found or not authorized'}), 404
         
-        # Parse send_time if provided
-        send_time = None
-        if data.get('send_time'):
-            try:
-                send_time = datetime.strptime(data['send_time'], '%H:%M').time()
-            except ValueError:
-                return jsonify({'error': 'Invalid time format. Expected HH:MM'}), 400
-        
-        # Parse date range if provided
-        date_range_start = None
-        date_range_end = None
-        if data.get('date_range_start'):
-            try:
-                date_range_start = datetime.strptime(data['date_range_start'], '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for date_range_start. Expected YYYY-MM-DD'}), 400
-        
-        if data.get('date_range_end'):
-            try:
-                date_range_end = datetime.strptime(data['date_range_end'], '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for date_range_end. Expected YYYY-MM-DD'}), 400
-        
-        # Validate vocabulary_count
-        vocabulary_count = data.get('vocabulary_count', 10)
-        if not isinstance(vocabulary_count, int) or vocabulary_count < 1 or vocabulary_count > 50:
-            return jsonify({'error': 'vocabulary_count must be between 1 and 50'}), 400
-        
-        # Validate selection_method
-        selection_method = data.get('selection_method', 'random')
-        if selection_method not in ['random', 'latest', 'date_range']:
-            return jsonify({'error': 'selection_method must be one of: random, latest, date_range'}), 400
-
-        # Validate email_client
-        from .email import EMAIL_CLIENTS
-        email_client = data.get('email_client', 'apple_mail')
-        if email_client not in EMAIL_CLIENTS:
-            return jsonify({'error': f"email_client must be one of: {', '.join(EMAIL_CLIENTS)}"}), 400
-
-        # Create email service
-        service = EmailService(
-            user_id=current_user_id,
-            database_id=data['database_id'],
-            service_name=data['service_name'],
-            description=data.get('description'),
-            send_time=send_time,
-            timezone=data.get('timezone', 'UTC'),
-            frequency=data.get('frequency', 'daily'),
-            vocabulary_count=vocabulary_count,
-            selection_method=selection_method,
-            email_client=email_client,
-            date_range_start=date_range_start,
-            date_range_end=date_range_end,
-            is_active=data.get('is_active', True),
-            column_selection=data.get('column_selection', [])
-        )
+        service, error = build_service(data, current_user_id)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Calculate initial run time
         service.next_run_at = service.calculate_next_run(datetime.utcnow())
-        service.status = 'PENDING'
         
         db.session.add(service)
         db.session.commit()
@@ -179,6 +260,105 @@ def create_email_service():
         return jsonify({'error': 'Failed to create email service', 'details': str(e)}), 500
 
 
+@email_service_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+@log_api_call("Bulk create email services")
+def bulk_create_email_services():
+    """
+    Create many email services in one transaction.
+    
+    Body: {"services": [<create payload>, ...]}. Admins may set "user_id" on a
+    row to provision services for another user. Valid rows are inserted
+    together and registered with one pipelined ZADD; invalid rows are reported
+    in "errors" by their index and don't block the others.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        rows = data.get('services')
+        
+        max_rows = current_app.config.get('BULK_SERVICE_MAX_ROWS', 1000)
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'error': 'services must be a non-empty list'}), 400
+        if len(rows) > max_rows:
+            return jsonify({'error': f'At most {max_rows} services per request'}), 400
+        
+        caller = User.query.get(current_user_id)
+        is_admin = caller is not None and caller.role == 'admin'
+        
+        # One query for every database referenced, instead of one per row
+        database_ids = {row.get('database_id') for row in rows if isinstance(row, dict)}
+        database_owners = dict(
+            db.session.query(NotionDatabase.id, NotionDatabase.user_id)
+            .filter(NotionDatabase.id.in_([i for i in database_ids if isinstance(i, int)]))
+        )
+        
+        services, created_rows, errors = [], [], []
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({'index': index, 'error': 'Each service must be an object'})
+                continue
+            if not row.get('database_id'):
+                errors.append({'index': index, 'error': 'database_id is required'})
+                continue
+            if not row.get('service_name'):
+                errors.append({'index': index, 'error': 'service_name is required'})
+                continue
+            
+            owner_id = row.get('user_id', current_user_id) if is_admin else current_user_id
+            if database_owners.get(row['database_id']) != owner_id:
+                errors.append({'index': index, 'error': 'Database not found or not authorized'})
+                continue
+            
+            service, error = build_service(row, owner_id)
+            if error:
+                errors.append({'index': index, 'error': error})
+                continue
+            services.append(service)
+            created_rows.append(index)
+        
+        if not services:
+            return jsonify({'error': 'No valid services to create', 'errors': errors}), 400
+        
+        for service, next_run in zip(services, EmailService.calculate_next_runs(services, datetime.utcnow())):
+            service.next_run_at = next_run
+        
+        db.session.add_all(services)
+        db.session.flush()
+        # Read ids and run times before commit expires the objects (which would reload each row)
+        created = [
+            {'index': index, 'id': service.id, 'next_run_at': service.next_run_at, 'is_active': service.is_active}
+            for index, service in zip(created_rows, services)
+        ]
+        db.session.commit()
+        
+        # Register the whole batch in one round trip
+        try:
+            add_many_to_schedule({
+                entry['id']: entry['next_run_at'].replace(tzinfo=pytz.UTC).timestamp()
+                for entry in created
+                if entry['is_active']
+            })
+        except Exception as e:
+            logger.error(f"Failed to add {len(created)} bulk-created services to Redis schedule: {e}")
+        
+        logger.info(f"Bulk created {len(created)} email services for user {current_user_id} ({len(errors)} rejected)")
+        
+        return jsonify({
+            'message': f'Created {len(created)} email services',
+            'created': [
+                {'index': entry['index'], 'id': entry['id'], 'next_run_at': entry['next_run_at'].isoformat() + 'Z'}
+                for entry in created
+            ],
+            'errors': errors
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to bulk create email services: {str(e)}")
+        return jsonify({'error': 'Failed to bulk create email services', 'details': str(e)}), 500
+
+
 @email_service_bp.route('/<int:service_id>', methods=['PUT'])
 @jwt_required()
 @log_api_call("Update email service")
@@ -209,8 +389,25 @@ def update_email_service(service_id):
         if 'timezone' in data:
             service.timezone = data['timezone']
         
-        if 'frequency' in data:
-            service.frequency = data['frequency']
+        if any(key in data for key in ['frequency', 'cron_expression', 'interval_days', 'interval_anchor']):
+            frequency = data.get('frequency', service.frequency)
+            cron_expression = data.get('cron_expression', service.cron_expression) or None
+            interval_days = data.get('interval_days', service.interval_days) if frequency == 'interval' else None
+            schedule_error = validate_schedule(frequency, cron_expression, interval_days)
+            if schedule_error:
+                return jsonify({'error': schedule_error}), 400
+            interval_anchor = None
+            if frequency == 'interval':
+                if data.get('interval_anchor') or not service.interval_anchor:
+                    interval_anchor, anchor_error = parse_interval_anchor(data.get('interval_anchor'), service.timezone)
+                    if anchor_error:
+                        return jsonify({'error': anchor_error}), 400
+                else:
+                    interval_anchor = service.interval_anchor
+            service.frequency = frequency
+            service.cron_expression = cron_expression
+            service.interval_days = interval_days
+            service.interval_anchor = interval_anchor
         
         if 'vocabulary_count' in data:
             vocab_count = int(data['vocabulary_count'])
@@ -219,12 +416,11 @@ def update_email_service(service_id):
             service.vocabulary_count = vocab_count
         
         if 'selection_method' in data:
-            if data['selection_method'] not in ['random', 'latest', 'date_range']:
-                return jsonify({'error': 'selection_method must be one of: random, latest, date_range'}), 400
+            if data['selection_method'] not in SELECTION_METHODS:
+                return jsonify({'error': f"selection_method must be one of: {', '.join(SELECTION_METHODS)}"}), 400
             service.selection_method = data['selection_method']
 
         if 'email_client' in data:
-            from .email import EMAIL_CLIENTS
             if data['email_client'] not in EMAIL_CLIENTS:
                 return jsonify({'error': f"email_client must be one of: {', '.join(EMAIL_CLIENTS)}"}), 400
             service.email_client = data['email_client']
@@ -251,7 +447,8 @@ def update_email_service(service_id):
             service.is_active = bool(data['is_active'])
             
         # Recalculate next_run_at if scheduling parameters changed
-        if any(key in data for key in ['send_time', 'timezone', 'frequency', 'is_active']):
+        if any(key in data for key in ['send_time', 'timezone', 'frequency', 'cron_expression',
+                                       'interval_days', 'interval_anchor', 'is_active']):
             # If reactivating, or changing schedule, update next_run_at
             # We calculate from NOW, because if service was inactive or time changed, we want the *next* logical run.
             service.next_run_at = service.calculate_next_run(datetime.utcnow())
@@ -310,6 +507,7 @@ def delete_email_service(service_id):
             remove_from_schedule(service_id)
         except Exception as e:
             logger.error(f"Failed to remove service {service_id} from Redis schedule: {e}")
+        clear_sent_items(service_id)
         
         logger.info(f"Deleted email service {service_id} for user {current_user_id}")
         
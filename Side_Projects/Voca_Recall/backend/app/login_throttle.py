@@ -0,0 +1,77 @@
+"""
+Redis-backed login throttling.
+
+Failed logins are counted per client IP and per account in fixed windows of
+LOGIN_THROTTLE_WINDOW_SECONDS (keys `login:fail:ip:{ip}` and
+`login:fail:account:{email hash}`). Once either counter reaches its limit,
+further attempts are rejected before any bcrypt work is done, until the
+window expires. A successful login clears the account counter. If Redis is
+unavailable logins are not throttled.
+"""
+import hashlib
+from flask import current_app
+from .logging_config import get_logger
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+IP_KEY_PREFIX = 'login:fail:ip:'
+ACCOUNT_KEY_PREFIX = 'login:fail:account:'
+
+
+def _account_key(email):
+    # Hashed so Redis doesn't hold a list of email addresses
+    digest = hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()[:32]
+    return f"{ACCOUNT_KEY_PREFIX}{digest}"
+
+
+def _limits(ip, email):
+    config = current_app.config
+    return (
+        (f"{IP_KEY_PREFIX}{ip}", config.get('LOGIN_MAX_FAILURES_PER_IP', 20)),
+        (_account_key(email), config.get('LOGIN_MAX_FAILURES_PER_ACCOUNT', 5)),
+    )
+
+
+def login_retry_after(ip, email):
+    """
+    Seconds until this IP/account may try again, or None if not throttled.
+    """
+    try:
+        limits = _limits(ip, email)
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for key, _ in limits:
+            pipeline.get(key)
+            pipeline.ttl(key)
+        results = pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Login throttle check failed, allowing attempt: {str(e)}")
+        return None
+
+    retry_after = None
+    for (_, limit), failures, ttl in zip(limits, results[0::2], results[1::2]):
+        if failures is not None and int(failures) >= limit:
+            wait = ttl if ttl and ttl > 0 else current_app.config.get('LOGIN_THROTTLE_WINDOW_SECONDS', 900)
+            retry_after = max(retry_after or 0, wait)
+    return retry_after
+
+
+def record_login_failure(ip, email):
+    """Count a failed attempt against both the IP and the account"""
+    window = current_app.config.get('LOGIN_THROTTLE_WINDOW_SECONDS', 900)
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for key, _ in _limits(ip, email):
+            # The window starts at the first failure; INCR keeps the TTL
+            pipeline.set(key, 0, ex=window, nx=True)
+            pipeline.incr(key)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record login failure: {str(e)}")
+
+
+def clear_login_failures(email):
+    try:
+        get_redis_client().delete(_account_key(email))
+    except Exception as e:
+        logger.warning(f"Failed to clear login failures: {str(e)}")
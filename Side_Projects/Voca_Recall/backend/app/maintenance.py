@@ -0,0 +1,169 @@
+"""
+Periodic garbage collection of expired and orphaned rows.
+
+Each cleanup selects at most MAINTENANCE_BATCH_SIZE primary keys through an
+index, deletes exactly those rows and commits, pausing between batches. Locks
+are therefore held only for one short batch and other writers are never
+blocked behind a table-wide DELETE. A run stops after MAINTENANCE_MAX_BATCHES
+per cleanup; whatever is left is picked up by the next run.
+
+The scheduler enqueues run_maintenance_task every MAINTENANCE_INTERVAL_SECONDS;
+a Redis lock keeps two runs from overlapping.
+"""
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from . import celery
+from .models import User, PasswordResetToken, NotionToken, NotionDatabase, EmailService, EmailLog, EmailOutbox, VocabularyReview, db
+from .logging_config import get_logger
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+MAINTENANCE_LOCK_KEY = 'maintenance:lock'
+
+
+def delete_in_batches(model, criteria):
+    """
+    Delete rows of `model` matching `criteria` in bounded, separately committed batches.
+
+    Returns:
+        int: number of rows deleted
+    """
+    batch_size = current_app.config.get('MAINTENANCE_BATCH_SIZE', 500)
+    max_batches = current_app.config.get('MAINTENANCE_MAX_BATCHES', 100)
+    pause = current_app.config.get('MAINTENANCE_BATCH_PAUSE_SECONDS', 0.1)
+
+    deleted = 0
+    for _ in range(max_batches):
+        ids = [row_id for (row_id,) in db.session.query(model.id).filter(*criteria).limit(batch_size)]
+        if not ids:
+            break
+        db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+
+def _missing_id_pages(column, parent_column):
+    """
+    Values of an indexed FK column whose parent row no longer exists, a page at a time.
+
+    Walks the FK index in keyset pages of MAINTENANCE_BATCH_SIZE distinct values
+    (WHERE column > :last ORDER BY column LIMIT :batch) and keeps the values of
+    each page that have no parent row (NOT EXISTS), so neither the values nor
+    an IN list ever grow with the table.
+
+    Yields:
+        non-empty lists of orphaned values
+    """
+    batch_size = current_app.config.get('MAINTENANCE_BATCH_SIZE', 500)
+    parent = db.session.query(parent_column).filter(parent_column == column).exists()
+    last = None
+    while True:
+        query = db.session.query(column).filter(column.isnot(None))
+        if last is not None:
+            query = query.filter(column > last)
+        page = [value for (value,) in query.distinct().order_by(column).limit(batch_size)]
+        if not page:
+            return
+        missing = [value for (value,) in db.session.query(column)
+                   .filter(column >= page[0], column <= page[-1], ~parent).distinct()]
+        if missing:
+            yield missing
+        if len(page) < batch_size:
+            return
+        last = page[-1]
+
+
+def purge_expired_reset_tokens(now):
+    # Used tokens are also past expires_at within the hour, so one range scan covers both
+    return delete_in_batches(PasswordResetToken, [PasswordResetToken.expires_at < now])
+
+
+def purge_inactive_notion_tokens(now):
+    """Tokens deactivated long enough ago and no longer linked to any database"""
+    cutoff = now - timedelta(days=current_app.config.get('NOTION_TOKEN_INACTIVE_RETENTION_DAYS', 30))
+    linked = db.session.query(NotionDatabase.id).filter(NotionDatabase.token_id == NotionToken.id).exists()
+    return delete_in_batches(NotionToken, [
+        NotionToken.is_active.is_(False),
+        NotionToken.updated_at < cutoff,
+        ~linked,
+    ])
+
+
+def purge_orphaned_email_logs(now):
+    deleted = 0
+    for missing_users in _missing_id_pages(EmailLog.user_id, User.id):
+        deleted += delete_in_batches(EmailLog, [EmailLog.user_id.in_(missing_users)])
+
+    retention_days = current_app.config.get('EMAIL_LOG_RETENTION_DAYS', 0)
+    if retention_days:
+        deleted += delete_in_batches(EmailLog, [EmailLog.sent_at < now - timedelta(days=retention_days)])
+    return deleted
+
+
+def purge_orphaned_reviews(now):
+    # ON DELETE CASCADE covers MySQL; SQLite doesn't enforce foreign keys by default
+    deleted = 0
+    for missing_services in _missing_id_pages(VocabularyReview.service_id, EmailService.id):
+        deleted += delete_in_batches(VocabularyReview, [VocabularyReview.service_id.in_(missing_services)])
+    return deleted
+
+
+def purge_finished_outbox(now):
+    """Delivered, failed and cancelled outbox rows past OUTBOX_RETENTION_DAYS"""
+    cutoff = now - timedelta(days=current_app.config.get('OUTBOX_RETENTION_DAYS', 7))
+    return delete_in_batches(EmailOutbox, [
+        EmailOutbox.updated_at < cutoff,
+        EmailOutbox.status.in_(('sent', 'failed', 'cancelled')),
+    ])
+
+
+CLEANUPS = (
+    ('password_reset_tokens', purge_expired_reset_tokens),
+    ('notion_tokens', purge_inactive_notion_tokens),
+    ('email_logs', purge_orphaned_email_logs),
+    ('vocabulary_reviews', purge_orphaned_reviews),
+    ('email_outbox', purge_finished_outbox),
+)
+
+
+def run_maintenance(now=None):
+    """
+    Run every cleanup once.
+
+    Returns:
+        dict: rows deleted per table
+    """
+    now = now or datetime.utcnow()
+    results = {}
+    for table, cleanup in CLEANUPS:
+        try:
+            results[table] = cleanup(now)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Maintenance cleanup of {table} failed: {str(e)}", exc_info=True)
+            results[table] = None
+    return results
+
+
+@celery.task
+def run_maintenance_task():
+    """Celery task running one maintenance pass, skipped if another is in progress"""
+    with current_app.app_context():
+        client = get_redis_client()
+        lock_timeout = current_app.config.get('MAINTENANCE_INTERVAL_SECONDS', 3600)
+        if not client.set(MAINTENANCE_LOCK_KEY, '1', nx=True, ex=lock_timeout):
+            logger.info("Maintenance already running, skipping")
+            return None
+        try:
+            start_time = time.time()
+            results = run_maintenance()
+            logger.info(f"Maintenance removed {results} in {(time.time() - start_time) * 1000:.2f}ms")
+            return results
+        finally:
+            client.delete(MAINTENANCE_LOCK_KEY)
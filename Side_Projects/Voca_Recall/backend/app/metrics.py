@@ -0,0 +1,310 @@
+"""
+Prometheus metrics shared by the web app, Celery workers and the scheduler.
+
+gunicorn and Celery prefork run many processes, so observations are aggregated
+in Redis. inc/observe only add to a per-process buffer; a daemon thread writes
+it to Redis every METRICS_FLUSH_INTERVAL_SECONDS in one pipelined round trip,
+so hot paths never wait on Redis.
+
+The Redis totals are already global, so they are served by exactly one scrape
+target (METRICS_EXPORTER): the web app at GET /metrics, or the scheduler (a
+single process) on METRICS_PORT. Scraping them from every process would make
+a Prometheus sum() count each event once per target.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import Blueprint, Response, current_app, request
+from .logging_config import get_logger
+from .redis_utils import get_redis_client, SCHEDULE_KEY
+
+metrics_bp = Blueprint('metrics', __name__)
+logger = get_logger(__name__)
+
+METRICS_KEY_PREFIX = 'metrics:'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HISTOGRAMS = {
+    'voca_notion_fetch_seconds': 'Time spent fetching vocabulary items from Notion',
+    'voca_email_render_seconds': 'Time spent rendering vocabulary email HTML',
+    'voca_smtp_send_seconds': 'Time spent in the SMTP transaction',
+    'voca_http_request_seconds': 'Flask request handling time',
+}
+
+COUNTERS = {
+    'voca_emails_total': 'Scheduled vocabulary emails processed, by frequency and status',
+    'voca_notion_query_cache_total': 'Notion query cache lookups, by result (hit, coalesced, miss, timeout)',
+    'voca_email_bytes_total': 'Email HTML body bytes, before (raw) and after (compact) compaction',
+    'voca_rate_limited_total': 'API requests rejected by the rate limiter, by bucket',
+    'voca_outbox_deliveries_total': 'Outbox delivery attempts, by outcome (sent, failed, retry, skipped)',
+    'voca_smtp_sends_total': 'SMTP delivery attempts, by pool account and outcome (sent, throttled, auth, recipient, failed)',
+    'voca_notion_token_cache_total': 'Notion token cache lookups, by result (hit, negative, miss)',
+    'voca_notion_token_rejections_total': 'Notion tokens rejected as unauthorized during a send',
+}
+
+
+def _enabled():
+    try:
+        return current_app.config.get('METRICS_ENABLED', True)
+    except RuntimeError:
+        return False  # outside an app context
+
+
+# (Redis hash key, field) -> increment not yet written to Redis
+_pending = {}
+_pending_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _reset_after_fork():
+    """A forked child starts with an empty buffer and no flusher"""
+    global _pending, _pending_lock, _flusher_pid
+    _pending = {}
+    _pending_lock = threading.Lock()
+    _flusher_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def flush_metrics():
+    """Write this process's buffered increments to Redis (needs an app context; never raises)"""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for (key, field), amount in pending.items():
+            if isinstance(amount, float):
+                pipeline.hincrbyfloat(key, field, amount)
+            else:
+                pipeline.hincrby(key, field, amount)
+        pipeline.execute()
+    except Exception as e:
+        # Keep them for the next flush; the buffer is bounded by the number of series
+        with _pending_lock:
+            for key_field, amount in pending.items():
+                _pending[key_field] = _pending.get(key_field, 0) + amount
+        logger.debug(f"Failed to flush metrics: {str(e)}")
+
+
+def _flush_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            flush_metrics()
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _pending_lock:
+        if _flusher_pid == pid:
+            return
+        _flusher_pid = pid
+    app = current_app._get_current_object()
+    interval = app.config.get('METRICS_FLUSH_INTERVAL_SECONDS', 5)
+    threading.Thread(target=_flush_loop, args=(app, interval), name='metrics-flush', daemon=True).start()
+
+    def flush_at_exit():
+        with app.app_context():
+            flush_metrics()
+    atexit.register(flush_at_exit)
+
+
+def _record(*increments):
+    """Add (key, field, amount) increments to this process's buffer"""
+    _ensure_flusher()
+    with _pending_lock:
+        for key, field, amount in increments:
+            _pending[key, field] = _pending.get((key, field), 0) + amount
+
+
+def _labels_field(labels):
+    return json.dumps(labels, sort_keys=True, separators=(',', ':'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def observe(name, seconds, **labels):
+    """Record one observation of a histogram (never raises)"""
+    if not _enabled():
+        return
+    try:
+        field = _labels_field(labels)
+        bucket = next((le for le in DEFAULT_BUCKETS if seconds <= le), '+Inf')
+        key = f"{METRICS_KEY_PREFIX}h:{name}"
+        _record(
+            (key, f"{field}|{bucket}", 1),
+            (key, f"{field}|count", 1),
+            (key, f"{field}|sum", float(seconds)),
+        )
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {str(e)}")
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter (never raises)"""
+    if not _enabled():
+        return
+    try:
+        _record((f"{METRICS_KEY_PREFIX}c:{name}", _labels_field(labels), amount))
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {str(e)}")
+
+
+def track_duration(name, **labels):
+    """Decorator recording the wrapped function's wall time into a histogram"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.time() - start_time, **labels)
+        return wrapper
+    return decorator
+
+
+def _render_histogram(lines, name, raw):
+    series = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        labels_json, suffix = field.rsplit('|', 1)
+        series.setdefault(labels_json, {})[suffix] = value
+
+    lines.append(f"# HELP {name} {HISTOGRAMS[name]}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels_json in sorted(series):
+        values = series[labels_json]
+        labels = json.loads(labels_json)
+        cumulative = 0
+        for le in DEFAULT_BUCKETS:
+            cumulative += int(values.get(str(le), 0))
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': str(le)})} {cumulative}")
+        count = int(values.get('count', 0))
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {float(values.get('sum', 0))}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+
+def _schedule_gauges(client, now):
+    pipeline = client.pipeline(transaction=False)
+    pipeline.zcard(SCHEDULE_KEY)
+    pipeline.zcount(SCHEDULE_KEY, '-inf', now)
+    pipeline.zrange(SCHEDULE_KEY, 0, 0, withscores=True)
+    size, overdue, oldest = pipeline.execute()
+    oldest_age = max(0.0, now - oldest[0][1]) if oldest and overdue else 0.0
+    return [
+        ('voca_schedule_size', 'Services in the email_schedule ZSET', size),
+        ('voca_schedule_overdue', 'Scheduled services whose fire time has passed', overdue),
+        ('voca_schedule_oldest_overdue_seconds', 'Age of the oldest overdue schedule entry', round(oldest_age, 3)),
+    ]
+
+
+def render_metrics():
+    """Render all metrics in Prometheus text exposition format"""
+    client = get_redis_client()
+    lines = []
+
+    pipeline = client.pipeline(transaction=False)
+    for name in HISTOGRAMS:
+        pipeline.hgetall(f"{METRICS_KEY_PREFIX}h:{name}")
+    for name in COUNTERS:
+        pipeline.hgetall(f"{METRICS_KEY_PREFIX}c:{name}")
+    results = pipeline.execute()
+
+    for name, raw in zip(HISTOGRAMS, results[:len(HISTOGRAMS)]):
+        _render_histogram(lines, name, raw)
+
+    for name, raw in zip(COUNTERS, results[len(HISTOGRAMS):]):
+        lines.append(f"# HELP {name} {COUNTERS[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for field in sorted(raw):
+            labels = json.loads(field)
+            lines.append(f"{name}{_format_labels(labels)} {int(raw[field])}")
+
+    for name, help_text, value in _schedule_gauges(client, time.time()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(auth_header):
+    token = current_app.config.get('METRICS_AUTH_TOKEN')
+    return not token or auth_header == f"Bearer {token}"
+
+
+def is_exporter(role):
+    """Whether this process role ('web' or 'scheduler') serves the aggregated metrics"""
+    return current_app.config.get('METRICS_EXPORTER', 'web') == role
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (only when the web app is the METRICS_EXPORTER)"""
+    if not is_exporter('web'):
+        return Response('Not found\n', status=404, mimetype='text/plain')
+    if not _authorized(request.headers.get('Authorization')):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    try:
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logger.error(f"Failed to render metrics: {str(e)}")
+        return Response(f"# metrics unavailable: {str(e)}\n", status=503, mimetype='text/plain')
+
+
+def start_metrics_server(app, port):
+    """Serve /metrics from a daemon thread (for the scheduler)"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            with app.app_context():
+                if not _authorized(self.headers.get('Authorization')):
+                    self.send_error(401)
+                    return
+                try:
+                    body, status = render_metrics().encode('utf-8'), 200
+                except Exception as e:
+                    body, status = f"# metrics unavailable: {str(e)}\n".encode('utf-8'), 503
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('0.0.0.0', int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics exporter listening on port {port}")
+    return server
@@ -8,6 +8,7 @@ from functools import wraps
 import time
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
 from .logging_config import get_logger, log_request_info, log_response_info
+from .metrics import observe
 from .models import User
 
 logger = get_logger(__name__)
@@ -42,6 +43,13 @@ def log_requests(app):
         if hasattr(g, 'start_time') and hasattr(g, 'request_id'):
             response_time = (time.time() - g.start_time) * 1000
             log_response_info(logger, g.request_id, response.status_code, response_time)
+            observe(
+                'voca_http_request_seconds',
+                response_time / 1000,
+                method=request.method,
+                endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                status=str(response.status_code)
+            )
         
         return response
     
@@ -2,7 +2,11 @@ from datetime import datetime, timedelta
 import secrets
 import pytz
 from sqlalchemy.ext.mutable import MutableDict, MutableList
-from . import db, bcrypt
+from sqlalchemy.orm import validates
+from . import db
+from .passwords import hash_password, verify_password, needs_rehash
+from .cron import compile_cron
+from .cron_batch import next_fire_batch
 
 class User(db.Model):
     """User model"""
@@ -13,10 +17,15 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
+    # Lowercase copies for indexed prefix search in the admin console (kept in sync by normalize_search_fields)
+    email_lower = db.Column(db.String(120), index=True)
+    first_name_lower = db.Column(db.String(50), index=True)
+    last_name_lower = db.Column(db.String(50), index=True)
     role = db.Column(db.String(20), default='user', nullable=False)  # user, developer, admin
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    digest_mode = db.Column(db.Boolean, default=False)  # One combined email for services firing within DIGEST_WINDOW_SECONDS
     
     # Relationships
     databases = db.relationship('NotionDatabase', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -25,13 +34,23 @@ class User(db.Model):
     email_services = db.relationship('EmailService', backref='user', lazy=True, cascade='all, delete-orphan')
     password_reset_tokens = db.relationship('PasswordResetToken', backref='user', lazy=True, cascade='all, delete-orphan')
     
+    @validates('email', 'first_name', 'last_name')
+    def normalize_search_fields(self, key, value):
+        """Keep the lowercase search columns in step with email and names"""
+        setattr(self, f"{key}_lower", value.strip().lower() if value else value)
+        return value
+    
     def set_password(self, password):
-        """Hash and set password"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Hash and set password (on the bounded bcrypt pool)"""
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        """Check password hash"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Check password hash (on the bounded bcrypt pool)"""
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True when the stored hash uses a different BCRYPT_LOG_ROUNDS than configured"""
+        return needs_rehash(self.password_hash)
     
     def to_dict(self):
         """Convert to dictionary"""
@@ -42,15 +61,16 @@ class User(db.Model):
             'last_name': self.last_name,
             'role': self.role,
             'created_at': self.created_at.isoformat() + 'Z',
-            'is_active': self.is_active
+            'is_active': self.is_active,
+            'digest_mode': bool(self.digest_mode)
         }
 
     def generate_password_reset_token(self):
         """Generate a password reset token"""
-        # Invalidate any existing tokens
-        existing_tokens = PasswordResetToken.query.filter_by(user_id=self.id, is_used=False).all()
-        for token in existing_tokens:
-            token.is_used = True
+        # Invalidate any existing tokens (one UPDATE, no rows loaded)
+        PasswordResetToken.query.filter_by(user_id=self.id, is_used=False).update(
+            {PasswordResetToken.is_used: True}, synchronize_session=False
+        )
         
         # Create new token
         reset_token = PasswordResetToken(
@@ -84,7 +104,7 @@ class PasswordResetToken(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     token = db.Column(db.String(255), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Range-scanned by maintenance
     is_used = db.Column(db.Boolean, default=False)
     used_at = db.Column(db.DateTime, nullable=True)
     
@@ -108,6 +128,10 @@ class PasswordResetToken(db.Model):
 class NotionToken(db.Model):
     """Notion API token model for storing user tokens"""
     __tablename__ = 'notion_tokens'
+    __table_args__ = (
+        # Maintenance looks up long-inactive tokens
+        db.Index('ix_notion_tokens_active_updated', 'is_active', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -178,11 +202,14 @@ class EmailService(db.Model):
     # Email scheduling settings
     send_time = db.Column(db.Time, default=datetime.strptime('09:00', '%H:%M').time())
     timezone = db.Column(db.String(50), default='UTC')
-    frequency = db.Column(db.String(20), default='daily')  # daily, weekly, custom
+    frequency = db.Column(db.String(20), default='daily')  # daily, weekly, monthly, custom, interval
+    cron_expression = db.Column(db.String(100), nullable=True)  # For frequency='custom', e.g. "30 7 * * 1-5"
+    interval_days = db.Column(db.Integer, nullable=True)  # For frequency='interval': every N days at send_time
+    interval_anchor = db.Column(db.Date, nullable=True)  # A day (service timezone) the interval fires on
     
     # Vocabulary settings
     vocabulary_count = db.Column(db.Integer, default=10)
-    selection_method = db.Column(db.String(20), default='random')  # random, latest, date_range
+    selection_method = db.Column(db.String(20), default='random')  # random, latest, date_range, spaced_repetition
 
     # Preferred email client - controls how the email body is formatted.
     # apple_mail supports interactive <details> toggles; gmail/outlook do not,
@@ -206,6 +233,36 @@ class EmailService(db.Model):
     # column selection settings (e.g. which columns to include in the email)
     column_selection = db.Column(MutableList.as_mutable(db.JSON), default=list)
     
+    # Spaced-repetition seeding: Notion cursor of the next page to copy into vocabulary_reviews,
+    # and whether the whole database has been copied once
+    review_cursor = db.Column(db.String(100), nullable=True)
+    review_seeded = db.Column(db.Boolean, default=False)
+    
+    # Spaced-repetition state; rows are removed by the database's ON DELETE CASCADE
+    reviews = db.relationship('VocabularyReview', backref='service', lazy='dynamic', passive_deletes=True)
+    
+    def cron_spec(self):
+        """
+        The service schedule as a cron expression in its own timezone.
+        daily/weekly/monthly fire at send_time every day, on Mondays and on the
+        1st respectively; custom uses cron_expression as is. interval is daily
+        at send_time, narrowed by schedule() to every interval_days days.
+        """
+        if self.frequency == 'custom' and self.cron_expression:
+            return self.cron_expression
+        minute, hour = self.send_time.minute, self.send_time.hour
+        if self.frequency == 'weekly':
+            return f"{minute} {hour} * * 1"
+        if self.frequency == 'monthly':
+            return f"{minute} {hour} 1 * *"
+        return f"{minute} {hour} * * *"
+
+    def schedule(self):
+        """The compiled schedule (raises ValueError for an invalid cron_expression)"""
+        if self.frequency == 'interval' and self.interval_days:
+            return compile_cron(self.cron_spec(), self.interval_days, self.interval_anchor)
+        return compile_cron(self.cron_spec())
+
     def calculate_next_run(self, from_time=None):
         """
         Calculate next run time in UTC based on schedule.
@@ -214,52 +271,44 @@ class EmailService(db.Model):
         if not from_time:
             from_time = datetime.utcnow()
             
-        # Ensure from_time is aware (UTC) for usage with pytz, or handle naive consistently
-        if from_time.tzinfo is None:
-            from_time = pytz.utc.localize(from_time)
-            
         try:
             tz = pytz.timezone(self.timezone)
         except pytz.UnknownTimeZoneError:
             tz = pytz.UTC
-            
-        # Convert reference time to service local time
-        now_local = from_time.astimezone(tz)
-        
-        # Base candidate: same date as now_local, but with configured time
-        target_local = now_local.replace(
-            hour=self.send_time.hour, 
-            minute=self.send_time.minute, 
-            second=0, 
-            microsecond=0
-        )
         
-        if self.frequency == 'daily':
-            if target_local <= now_local:
-                target_local += timedelta(days=1)
-                
-        elif self.frequency == 'weekly':
-            # Default: Monday (0)
-            target_weekday = 0 
-            current_weekday = target_local.weekday()
-            days_ahead = (target_weekday - current_weekday) % 7
-            target_local += timedelta(days=days_ahead)
-            
-            if target_local <= now_local:
-                target_local += timedelta(weeks=1)
-                
-        elif self.frequency == 'monthly':
-            # Default: 1st of month
-            target_local = target_local.replace(day=1)
-            if target_local <= now_local:
-                # Next month
-                if target_local.month == 12:
-                    target_local = target_local.replace(year=target_local.year + 1, month=1)
-                else:
-                    target_local = target_local.replace(month=target_local.month + 1)
+        try:
+            schedule = self.schedule()
+        except ValueError:
+            # Expressions are validated on save; never let one bad row stop rescheduling
+            schedule = compile_cron(f"{self.send_time.minute} {self.send_time.hour} * * *")
         
-        # Convert back to UTC and make naive
-        return target_local.astimezone(pytz.utc).replace(tzinfo=None)
+        return schedule.next_fire(from_time, tz)
+
+    @staticmethod
+    def calculate_next_runs(services, from_time=None):
+        """
+        calculate_next_run for many services in one vectorised pass (see cron_batch).
+
+        Args:
+            services: EmailService rows
+            from_time: one reference time for all services, or one per service;
+                a datetime, UTC epoch seconds, or an array of either (see next_fire_batch)
+
+        Returns:
+            list of naive UTC datetimes, aligned with `services`
+        """
+        if not services:
+            return []
+        next_runs = next_fire_batch(
+            [service.send_time for service in services],
+            [service.timezone for service in services],
+            [service.frequency for service in services],
+            datetime.utcnow() if from_time is None else from_time,
+            [service.cron_expression for service in services],
+            [service.interval_days for service in services],
+            [service.interval_anchor for service in services],
+        )
+        return next_runs.tolist()
 
     def to_dict(self):
         """Convert to dictionary"""
@@ -271,6 +320,9 @@ class EmailService(db.Model):
             'send_time': self.send_time.strftime('%H:%M'),
             'timezone': self.timezone,
             'frequency': self.frequency,
+            'cron_expression': self.cron_expression,
+            'interval_days': self.interval_days,
+            'interval_anchor': self.interval_anchor.isoformat() if self.interval_anchor else None,
             'vocabulary_count': self.vocabulary_count,
             'selection_method': self.selection_method,
             'email_client': self.email_client,
@@ -307,22 +359,110 @@ class EmailSettings(db.Model):
             'is_active': self.is_active
         }
 
+class VocabularyReview(db.Model):
+    """Spaced-repetition state of one Notion page for one email service"""
+    __tablename__ = 'vocabulary_reviews'
+    __table_args__ = (
+        db.UniqueConstraint('service_id', 'item_id', name='uq_vocabulary_reviews_service_item'),
+        # Selection is a range scan over this index: WHERE service_id = ? AND due_at <= ? ORDER BY due_at
+        db.Index('ix_vocabulary_reviews_service_due', 'service_id', 'due_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('email_services.id', ondelete='CASCADE'), nullable=False)
+    item_id = db.Column(db.String(64), nullable=False)  # Notion page id
+    item_data = db.Column(db.JSON)  # Last seen projection of the page, so due items need no Notion lookup
+    ease = db.Column(db.Float, default=2.5, nullable=False)
+    interval_days = db.Column(db.Float, default=0, nullable=False)
+    repetitions = db.Column(db.Integer, default=0, nullable=False)  # 0: seeded from Notion, never sent
+    due_at = db.Column(db.DateTime, nullable=False)  # UNSEEN_DUE_AT (spaced_repetition) until first sent
+    last_reviewed_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'item_id': self.item_id,
+            'ease': self.ease,
+            'interval_days': self.interval_days,
+            'repetitions': self.repetitions,
+            'due_at': self.due_at.isoformat() + 'Z' if self.due_at else None,
+            'last_reviewed_at': self.last_reviewed_at.isoformat() + 'Z' if self.last_reviewed_at else None
+        }
+
+class EmailOutbox(db.Model):
+    """Pending delivery of one scheduled email; (service_id, scheduled_at) is its idempotency key"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.UniqueConstraint('service_id', 'scheduled_at', name='uq_email_outbox_service_scheduled'),
+        # The relay scans WHERE status = ? AND available_at <= ? ORDER BY available_at
+        db.Index('ix_email_outbox_status_available', 'status', 'available_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('email_services.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    scheduled_at = db.Column(db.DateTime, nullable=False)  # next_run_at the scheduler fired for (UTC)
+    digest_key = db.Column(db.String(64), nullable=True)  # Rows sharing a key go out as one digest email
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, queued, sending, sent, failed, cancelled
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Not relayed before this (retry backoff)
+    claim_token = db.Column(db.String(32), nullable=True)  # Set by the worker batch that owns the row
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # queued/sending rows past this are relayed again
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'service_id': self.service_id,
+            'scheduled_at': self.scheduled_at.isoformat() + 'Z' if self.scheduled_at else None,
+            'digest_key': self.digest_key,
+            'status': self.status,
+            'attempts': self.attempts,
+            'available_at': self.available_at.isoformat() + 'Z' if self.available_at else None,
+            'delivered_at': self.delivered_at.isoformat() + 'Z' if self.delivered_at else None,
+            'last_error': self.last_error
+        }
+
 class EmailLog(db.Model):
     """Email log model for tracking sent emails"""
     __tablename__ = 'email_logs'
+    __table_args__ = (
+        # Covers the delivery SLO report: range on scheduled_at, aggregates over status and lag_ms
+        db.Index('ix_email_logs_slo', 'scheduled_at', 'status', 'lag_ms'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('email_services.id', ondelete='SET NULL'), nullable=True, index=True)
+    scheduled_at = db.Column(db.DateTime, nullable=True, index=True)  # next_run_at the scheduler fired for (UTC)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    lag_ms = db.Column(db.Integer, nullable=True)  # sent_at - scheduled_at, stored so the SLO report aggregates in SQL
+    stage_timings = db.Column(db.JSON, nullable=True)  # {'dispatch_ms', 'queue_ms', 'notion_ms', 'render_ms', 'smtp_ms', 'total_ms'}
     vocabulary_items = db.Column(db.JSON)  # Store the vocabulary items sent
-    status = db.Column(db.String(20), default='sent')  # sent, failed
+    status = db.Column(db.String(20), default='sent')  # sent, failed, skipped
     error_message = db.Column(db.Text, nullable=True)
     
+    @staticmethod
+    def compute_lag_ms(scheduled_at, sent_at):
+        """Delay in ms between the scheduled fire time and the SMTP hand-off, or None"""
+        if not scheduled_at or not sent_at:
+            return None
+        return round((sent_at - scheduled_at).total_seconds() * 1000)
+    
     def to_dict(self):
         """Convert to dictionary"""
         return {
             'id': self.id,
+            'service_id': self.service_id,
+            'scheduled_at': self.scheduled_at.isoformat() + 'Z' if self.scheduled_at else None,
             'sent_at': self.sent_at.isoformat() + 'Z' if self.sent_at else None,
+            'lag_ms': self.lag_ms,
+            'stage_timings': self.stage_timings,
             'vocabulary_items': self.vocabulary_items,
             'status': self.status,
             'error_message': self.error_message
@@ -0,0 +1,317 @@
+"""
+Redis-backed caches for Notion API metadata and query results.
+
+Database schemas (title + property names/types) are keyed by the Notion
+database id and shared by every user and worker. Because a cached schema says
+nothing about whether a *given* token may read the database, a separate access
+marker is stored per (token fingerprint, database id); both must be present for
+a cache hit.
+
+The schema entry follows Notion without extra calls: every `databases.retrieve`
+response is stored over it, and every query response is checked against it.
+Query responses don't carry the database's last_edited_time, but each page
+lists all of the database's properties, so a page whose property names or
+types differ from the cached schema drops the entry.
+
+Query results are cached for a few seconds only, behind a single-flight lock:
+when several services on the same database fire together, one worker queries
+Notion and the others wait for its result instead of repeating the call.
+
+Email previews render from a longer-lived sample of a database's newest pages,
+kept per (token fingerprint, database id) until the user asks for a refresh.
+"""
+import hashlib
+import json
+import secrets
+import time
+from flask import current_app
+from .notion_utils import get_notion_client
+from .logging_config import get_logger
+from .redis_utils import get_redis_client
+from .metrics import inc
+
+logger = get_logger(__name__)
+
+SCHEMA_KEY_PREFIX = 'notion:schema:'
+ACCESS_KEY_PREFIX = 'notion:access:'
+QUERY_KEY_PREFIX = 'notion:query:'
+SAMPLE_KEY_PREFIX = 'notion:sample:'
+QUERY_POLL_INTERVAL = 0.05
+
+
+def token_fingerprint(api_key):
+    """Stable, non-reversible identifier for a Notion token"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def _schema_key(database_id):
+    return f"{SCHEMA_KEY_PREFIX}{database_id}"
+
+
+def _access_key(api_key, database_id):
+    return f"{ACCESS_KEY_PREFIX}{token_fingerprint(api_key)}:{database_id}"
+
+
+def _sample_key(api_key, database_id):
+    return f"{SAMPLE_KEY_PREFIX}{token_fingerprint(api_key)}:{database_id}"
+
+
+def _schema_ttl():
+    return current_app.config.get('NOTION_SCHEMA_CACHE_TTL', 3600)
+
+
+def schema_from_database(database):
+    """Reduce a `databases.retrieve` response to the fields we cache"""
+    title_segments = database.get('title') or []
+    title = ''.join(segment.get('plain_text', '') for segment in title_segments)
+    return {
+        'title': title or 'Untitled Database',
+        'properties': [
+            {'name': name, 'type': prop.get('type')}
+            for name, prop in (database.get('properties') or {}).items()
+        ],
+        'last_edited_time': database.get('last_edited_time'),
+        'cached_at': time.time(),
+    }
+
+
+def store_database_schema(database_id, database, api_key=None):
+    """
+    Cache the schema of a freshly retrieved Notion database.
+
+    Any code path that already holds a `databases.retrieve` response should call
+    this so the cache follows Notion's `last_edited_time` without an extra call.
+    """
+    schema = schema_from_database(database)
+    ttl = _schema_ttl()
+    try:
+        client = get_redis_client()
+        cached_raw = client.get(_schema_key(database_id))
+        pipeline = client.pipeline(transaction=False)
+        if cached_raw:
+            cached = json.loads(cached_raw)
+            if cached.get('last_edited_time') != schema['last_edited_time'] and api_key:
+                # The entry is replaced below; a preview sample rendered with the old properties goes too
+                logger.info(f"Notion database {database_id} edited since {cached.get('last_edited_time')}, refreshing cache")
+                pipeline.delete(_sample_key(api_key, database_id))
+        pipeline.setex(_schema_key(database_id), ttl, json.dumps(schema))
+        if api_key:
+            pipeline.setex(_access_key(api_key, database_id), ttl, 1)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to cache schema for Notion database {database_id}: {str(e)}")
+    return schema
+
+
+def _schema_signature(properties):
+    return sorted((prop['name'], prop['type']) for prop in properties)
+
+
+def check_schema_against_query(database_id, response):
+    """Drop the cached schema if the pages of a `databases.query` response show different properties"""
+    results = response.get('results') or []
+    if not results or 'properties' not in results[0]:
+        return
+    seen = [{'name': name, 'type': prop.get('type')} for name, prop in results[0]['properties'].items()]
+    try:
+        client = get_redis_client()
+        cached_raw = client.get(_schema_key(database_id))
+        if cached_raw and _schema_signature(json.loads(cached_raw)['properties']) != _schema_signature(seen):
+            logger.info(f"Notion database {database_id} properties changed, dropping cached schema")
+            client.delete(_schema_key(database_id))
+    except Exception as e:
+        logger.warning(f"Could not check cached schema of Notion database {database_id}: {str(e)}")
+
+
+def get_cached_database_schema(api_key, database_id):
+    """Return the cached schema if this token is known to have access, else None"""
+    try:
+        schema_raw, has_access = get_redis_client().mget(
+            [_schema_key(database_id), _access_key(api_key, database_id)]
+        )
+    except Exception as e:
+        logger.warning(f"Schema cache unavailable for Notion database {database_id}: {str(e)}")
+        return None
+
+    if not schema_raw or not has_access:
+        return None
+    return json.loads(schema_raw)
+
+
+def get_database_schema(api_key, database_id, refresh=False):
+    """
+    Get the title and properties of a Notion database, served from Redis when possible.
+
+    Args:
+        api_key: Notion API key used for the lookup (and for the access check)
+        database_id: Notion database ID
+        refresh: Bypass the cache and re-read the schema from Notion
+
+    Returns:
+        dict with 'title', 'properties' ([{name, type}]), 'last_edited_time',
+        'cached_at' and 'from_cache'
+    """
+    if not refresh:
+        cached = get_cached_database_schema(api_key, database_id)
+        if cached:
+            cached['from_cache'] = True
+            return cached
+
+    notion = get_notion_client(api_key)
+    database = notion.databases.retrieve(database_id)
+    schema = store_database_schema(database_id, database, api_key)
+    schema['from_cache'] = False
+    return schema
+
+
+def invalidate_database_schema(database_id):
+    """Drop the cached schema for a Notion database"""
+    try:
+        get_redis_client().delete(_schema_key(database_id))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate schema cache for Notion database {database_id}: {str(e)}")
+
+
+def _query_key(api_key, database_id, query, projection):
+    # The token fingerprint is part of the key so a result is only ever served
+    # to callers holding the token that fetched it
+    digest = hashlib.sha256(json.dumps(
+        [token_fingerprint(api_key), database_id, query, projection],
+        sort_keys=True, default=str,
+    ).encode('utf-8')).hexdigest()[:32]
+    return f"{QUERY_KEY_PREFIX}{database_id}:{digest}"
+
+
+def _release_lock(client, lock_key, lock_token):
+    try:
+        if client.get(lock_key) == lock_token.encode('utf-8'):
+            client.delete(lock_key)
+    except Exception as e:
+        logger.warning(f"Failed to release Notion query lock {lock_key}: {str(e)}")
+
+
+def query_database_cached(api_key, database_id, query, project, projection=None):
+    """
+    Query a Notion database once per TTL window, shared across workers.
+
+    Args:
+        api_key: Notion API key
+        database_id: Notion database ID
+        query: extra `databases.query` arguments (filter, sorts, page_size)
+        project: function applied to each result page; its (JSON-serialisable)
+            output is what gets cached
+        projection: name of the projection, part of the cache key
+            (defaults to project.__name__)
+
+    Returns:
+        list of projected pages, in Notion's result order
+    """
+    projection = projection or project.__name__
+
+    def fetch():
+        response = get_notion_client(api_key).databases.query(database_id=database_id, **query)
+        check_schema_against_query(database_id, response)
+        return [project(page) for page in response.get('results', [])]
+
+    ttl = current_app.config.get('NOTION_QUERY_CACHE_TTL', 30)
+    if ttl <= 0:
+        return fetch()
+
+    lock_timeout = current_app.config.get('NOTION_QUERY_LOCK_TIMEOUT', 15)
+    key = _query_key(api_key, database_id, query, projection)
+    lock_key = f"{key}:lock"
+    lock_token = secrets.token_hex(8)
+
+    try:
+        client = get_redis_client()
+        deadline = time.time() + lock_timeout
+        waited = False
+        while True:
+            cached = client.get(key)
+            if cached is not None:
+                inc('voca_notion_query_cache_total', result='coalesced' if waited else 'hit')
+                return json.loads(cached)
+            if client.set(lock_key, lock_token, nx=True, px=int(lock_timeout * 1000)):
+                break
+            if time.time() >= deadline:
+                # The lock holder is stuck; don't let this send wait any longer
+                logger.warning(f"Timed out waiting for in-flight Notion query on {database_id}, querying directly")
+                inc('voca_notion_query_cache_total', result='timeout')
+                return fetch()
+            waited = True
+            time.sleep(QUERY_POLL_INTERVAL)
+    except Exception as e:
+        logger.warning(f"Notion query cache unavailable for {database_id}: {str(e)}")
+        return fetch()
+
+    inc('voca_notion_query_cache_total', result='miss')
+    try:
+        items = fetch()
+        try:
+            client.setex(key, ttl, json.dumps(items))
+        except Exception as e:
+            logger.warning(f"Failed to cache Notion query for {database_id}: {str(e)}")
+        return items
+    finally:
+        _release_lock(client, lock_key, lock_token)
+
+
+def query_database_page(api_key, database_id, query, project, start_cursor=None):
+    """
+    One page of a Notion database query, uncached (for walking a whole database).
+
+    Returns:
+        (projected pages, cursor of the next page or None after the last page)
+    """
+    if start_cursor:
+        query = dict(query, start_cursor=start_cursor)
+    response = get_notion_client(api_key).databases.query(database_id=database_id, **query)
+    check_schema_against_query(database_id, response)
+    next_cursor = response.get('next_cursor') if response.get('has_more') else None
+    return [project(page) for page in response.get('results', [])], next_cursor
+
+
+def get_database_sample(api_key, database_id, project, refresh=False):
+    """
+    A cached sample of a Notion database's newest pages, for rendering previews.
+
+    Args:
+        api_key: Notion API key
+        database_id: Notion database ID
+        project: function applied to each result page before caching
+        refresh: Re-query Notion, unless the sample is younger than
+            PREVIEW_SAMPLE_MIN_REFRESH_SECONDS
+
+    Returns:
+        dict with 'items' (projected pages, newest first), 'cached_at' and 'from_cache'
+    """
+    key = _sample_key(api_key, database_id)
+    cached = None
+    try:
+        client = get_redis_client()
+        cached_raw = client.get(key)
+        if cached_raw:
+            cached = json.loads(cached_raw)
+    except Exception as e:
+        client = None
+        logger.warning(f"Preview sample cache unavailable for {database_id}: {str(e)}")
+
+    min_age = current_app.config.get('PREVIEW_SAMPLE_MIN_REFRESH_SECONDS', 10)
+    if cached and (not refresh or time.time() - cached['cached_at'] < min_age):
+        cached['from_cache'] = True
+        return cached
+
+    response = get_notion_client(api_key).databases.query(
+        database_id=database_id,
+        page_size=current_app.config.get('PREVIEW_SAMPLE_SIZE', 20),
+        sorts=[{'timestamp': 'created_time', 'direction': 'descending'}],
+    )
+    check_schema_against_query(database_id, response)
+    sample = {'items': [project(page) for page in response.get('results', [])], 'cached_at': time.time()}
+    if client is not None:
+        try:
+            client.setex(key, current_app.config.get('PREVIEW_SAMPLE_TTL', 86400), json.dumps(sample))
+        except Exception as e:
+            logger.warning(f"Failed to cache preview sample for {database_id}: {str(e)}")
+    sample['from_cache'] = False
+    return sample
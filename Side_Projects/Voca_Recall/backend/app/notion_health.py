@@ -0,0 +1,78 @@
+"""
+Concurrent Notion health checks for many databases.
+
+A database is healthy when Notion lets its token both retrieve it (schema)
+and query it (content). check_databases starts both calls for every
+database at once on a bounded thread pool (NOTION_HEALTH_CHECK_CONCURRENCY).
+Databases sharing a token share one Notion client, and so one HTTP
+connection pool. Results are yielded as each database's calls complete, so
+a whole account takes about as long as its slowest call rather than the sum.
+
+The worker threads only make HTTP calls. Anything that needs the app
+(schema cache, Redis, logging the rejection of a token) happens in the
+caller's thread as results are consumed.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from notion_client import APIResponseError
+
+CHECKS = ('retrieve', 'query')
+
+
+def _timed(call):
+    """(result, exception, elapsed ms) of call(); never raises"""
+    start = time.perf_counter()
+    try:
+        result, error = call(), None
+    except Exception as e:
+        result, error = None, e
+    return result, error, round((time.perf_counter() - start) * 1000, 2)
+
+
+def _calls(client, database_id):
+    return {
+        'retrieve': lambda: client.databases.retrieve(database_id=database_id),
+        'query': lambda: client.databases.query(database_id=database_id, page_size=1),
+    }
+
+
+def check_databases(targets, max_workers):
+    """
+    Retrieve and query every target database concurrently.
+
+    Args:
+        targets: list of (key, Notion client, Notion database id); `key` is
+            handed back with the outcome
+        max_workers: upper bound on Notion calls in flight
+
+    Yields:
+        (key, {'retrieve': (response, error, ms), 'query': (response, error, ms)})
+        for each database, in completion order
+    """
+    if not targets:
+        return
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets) * len(CHECKS))),
+                              thread_name_prefix='notion-health')
+    try:
+        futures = {}
+        for index, (_, client, database_id) in enumerate(targets):
+            for check, call in _calls(client, database_id).items():
+                futures[pool.submit(_timed, call)] = (index, check)
+
+        outcomes = {}
+        for future in as_completed(futures):
+            index, check = futures[future]
+            outcome = outcomes.setdefault(index, {})
+            outcome[check] = future.result()
+            if len(outcome) == len(CHECKS):
+                yield targets[index][0], outcomes.pop(index)
+    finally:
+        # The client may stop reading mid-stream; don't start calls nobody will see
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def error_code(error):
+    """Notion's error code for an API error ('unauthorized', 'object_not_found', ...), else None"""
+    if isinstance(error, APIResponseError):
+        return getattr(error.code, 'value', error.code)
+    return None
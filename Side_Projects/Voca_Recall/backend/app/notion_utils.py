@@ -0,0 +1,10 @@
+from flask import current_app
+from notion_client import Client
+
+
+def get_notion_client(api_key):
+    """Create a Notion API client honouring NOTION_API_BASE_URL (e.g. a local stand-in for load tests)"""
+    return Client(
+        auth=api_key,
+        base_url=current_app.config.get('NOTION_API_BASE_URL', 'https://api.notion.com'),
+    )
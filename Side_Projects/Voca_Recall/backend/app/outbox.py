@@ -0,0 +1,233 @@
+"""
+Transactional outbox for scheduled emails.
+
+The scheduler adds one email_outbox row per due service in the same
+transaction that advances the service's next_run_at. Rows are keyed by
+(service_id, scheduled_at), so replaying a tick after a crash or a lost ZADD
+inserts nothing new. Delivery is then driven from the table:
+
+- relay_outbox() (scheduler loop) takes up to OUTBOX_RELAY_LIMIT rows that
+  are due, or whose queued/sending lease ran out, marks them queued and
+  enqueues deliver_outbox_batch in batches of OUTBOX_BATCH_SIZE, keeping
+  digest groups together.
+- deliver_outbox_batch claims its rows with one conditional UPDATE, so a
+  duplicated or retried Celery task finds nothing left to claim. Each row (or
+  digest) is sent and its outbox status is committed together with its
+  EmailLog.
+- A failed send goes back to pending with exponential backoff until
+  OUTBOX_MAX_ATTEMPTS; only the final outcome is logged.
+
+The remaining window is a worker dying after the SMTP server accepted a
+message but before the commit. The lease then expires and the row is sent
+again with the same Message-ID, so the mailbox can recognise the duplicate.
+"""
+import calendar
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, insert, or_
+from . import celery
+from .email import deliver_digest_email, deliver_service_email
+from .logging_config import get_logger
+from .metrics import inc
+from .models import EmailOutbox, db
+
+logger = get_logger(__name__)
+
+FINISHED_STATUSES = ('sent', 'failed', 'cancelled')
+OUTCOME_STATUSES = {'sent': 'sent', 'failed': 'failed', 'skipped': 'cancelled'}
+
+
+def _epoch(value):
+    return calendar.timegm(value.utctimetuple())
+
+
+def _relayable(now):
+    """Rows due for (re)delivery: pending and past their backoff, or holding an expired lease"""
+    return or_(
+        and_(EmailOutbox.status == 'pending', EmailOutbox.available_at <= now),
+        and_(EmailOutbox.status.in_(('queued', 'sending')), EmailOutbox.lease_expires_at < now),
+    )
+
+
+def enqueue_deliveries(claimed, services, digests):
+    """
+    Add outbox rows for the claimed services to the current transaction (the caller commits).
+
+    Args:
+        claimed: {service_id: scheduled epoch seconds}
+        services: {service_id: EmailService}
+        digests: {user_id: [[service_id, scheduled epoch seconds], ...]}
+
+    Returns:
+        int: number of rows offered (rows already in the outbox are ignored)
+    """
+    digest_keys = {}
+    for user_id, entries in digests.items():
+        if len(entries) > 1:
+            key = f"{user_id}:{int(min(scheduled_ts for _, scheduled_ts in entries))}"
+            digest_keys.update((service_id, key) for service_id, _ in entries)
+
+    now = datetime.utcnow()
+    rows = [{
+        'service_id': service_id,
+        'user_id': services[service_id].user_id,
+        'scheduled_at': datetime.utcfromtimestamp(round(scheduled_ts)),
+        'digest_key': digest_keys.get(service_id),
+        'status': 'pending',
+        'attempts': 0,
+        'available_at': now,
+        'created_at': now,
+        'updated_at': now,
+    } for service_id, scheduled_ts in claimed.items()
+        if service_id in services and services[service_id].is_active]
+    if rows:
+        statement = insert(EmailOutbox).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+        db.session.execute(statement, rows)
+    return len(rows)
+
+
+def _batches(rows, batch_size):
+    """Split (id, digest_key) rows into id batches without splitting a digest"""
+    groups = {}
+    for row_id, digest_key in rows:
+        groups.setdefault(digest_key or f"#{row_id}", []).append(row_id)
+    batches, current = [], []
+    for group in groups.values():
+        if current and len(current) + len(group) > batch_size:
+            batches.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def relay_outbox(now=None):
+    """
+    Hand due outbox rows to the workers.
+
+    Returns:
+        int: number of rows enqueued
+    """
+    now = now or datetime.utcnow()
+    config = current_app.config
+    rows = db.session.query(EmailOutbox.id, EmailOutbox.digest_key) \
+        .filter(_relayable(now)) \
+        .order_by(EmailOutbox.available_at) \
+        .limit(config.get('OUTBOX_RELAY_LIMIT', 2000)) \
+        .all()
+    if not rows:
+        return 0
+
+    ids = [row_id for row_id, _ in rows]
+    db.session.query(EmailOutbox).filter(EmailOutbox.id.in_(ids), _relayable(now)).update({
+        EmailOutbox.status: 'queued',
+        EmailOutbox.dispatched_at: now,
+        EmailOutbox.lease_expires_at: now + timedelta(seconds=config.get('OUTBOX_LEASE_SECONDS', 900)),
+    }, synchronize_session=False)
+    db.session.commit()
+
+    # A lost message is harmless: its rows are relayed again once the lease expires
+    dispatched_at = _epoch(now)
+    for batch in _batches(rows, config.get('OUTBOX_BATCH_SIZE', 25)):
+        deliver_outbox_batch.delay(batch, dispatched_at)
+    logger.info(f"Relayed {len(ids)} outbox rows")
+    return len(ids)
+
+
+def _message_id(rows):
+    key = f"digest.{rows[0].digest_key.replace(':', '.')}" if rows[0].digest_key \
+        else f"{rows[0].service_id}.{_epoch(rows[0].scheduled_at)}"
+    return f"<outbox.{key}@voca-recall>"
+
+
+def _deliver_group(rows, dispatched_at):
+    """Send one outbox row, or one digest group, and commit the outcome"""
+    max_attempts = current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5)
+    final = max(row.attempts for row in rows) >= max_attempts
+    try:
+        if rows[0].digest_key:
+            outcomes = deliver_digest_email(
+                rows[0].user_id,
+                [[row.service_id, _epoch(row.scheduled_at)] for row in rows],
+                dispatched_at, message_id=_message_id(rows), final=final
+            )
+        else:
+            outcomes = {rows[0].service_id: deliver_service_email(
+                rows[0].service_id, _epoch(rows[0].scheduled_at), dispatched_at,
+                message_id=_message_id(rows), final=final
+            )}
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Outbox delivery of {[row.id for row in rows]} failed: {str(e)}", exc_info=True)
+        outcomes = {row.service_id: ('failed' if final else 'retry', str(e)) for row in rows}
+
+    now = datetime.utcnow()
+    backoff = current_app.config.get('OUTBOX_RETRY_BACKOFF_SECONDS', 60)
+    for row in rows:
+        outcome, error = outcomes.get(row.service_id, ('skipped', None))
+        if outcome == 'retry':
+            row.status = 'pending'
+            row.available_at = now + timedelta(seconds=backoff * 2 ** (row.attempts - 1))
+            row.claim_token = None
+            row.lease_expires_at = None
+        else:
+            row.status = OUTCOME_STATUSES[outcome]
+            if outcome == 'sent':
+                row.delivered_at = now
+        row.last_error = error
+        inc('voca_outbox_deliveries_total', outcome=outcome)
+    db.session.commit()
+    return sum(1 for outcome, _ in outcomes.values() if outcome == 'sent')
+
+
+@celery.task
+def deliver_outbox_batch(outbox_ids, dispatched_at=None):
+    """
+    Celery task claiming and sending a batch of outbox rows.
+
+    Args:
+        outbox_ids: EmailOutbox ids enqueued together by relay_outbox
+        dispatched_at: UTC epoch seconds the relay enqueued the batch
+
+    Returns:
+        int: number of services whose email was sent
+    """
+    with current_app.app_context():
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        claimable = or_(
+            EmailOutbox.status.in_(('pending', 'queued')),
+            and_(EmailOutbox.status == 'sending', EmailOutbox.lease_expires_at < now),
+        )
+        claimed = db.session.query(EmailOutbox).filter(
+            EmailOutbox.id.in_(outbox_ids), EmailOutbox.available_at <= now, claimable
+        ).update({
+            EmailOutbox.status: 'sending',
+            EmailOutbox.claim_token: token,
+            EmailOutbox.lease_expires_at: now + timedelta(seconds=current_app.config.get('OUTBOX_LEASE_SECONDS', 900)),
+            EmailOutbox.attempts: EmailOutbox.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            logger.info(f"Outbox rows {outbox_ids} already claimed, nothing to send")
+            return 0
+
+        groups = {}
+        for row in EmailOutbox.query.filter_by(claim_token=token, status='sending').order_by(EmailOutbox.id):
+            groups.setdefault(row.digest_key or f"#{row.id}", []).append(row)
+        return sum(_deliver_group(rows, dispatched_at) for rows in groups.values())
+
+
+def outbox_summary(now=None):
+    """Row counts per status and the age of the oldest due row, for the admin API"""
+    now = now or datetime.utcnow()
+    counts = dict(db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id)).group_by(EmailOutbox.status))
+    oldest = db.session.query(db.func.min(EmailOutbox.available_at)).filter(_relayable(now)).scalar()
+    if isinstance(oldest, str):  # SQLite may hand back aggregates of DATETIME as text
+        oldest = datetime.fromisoformat(oldest)
+    return {
+        'counts': counts,
+        'oldest_due_seconds': round((now - oldest).total_seconds(), 1) if oldest else None,
+    }
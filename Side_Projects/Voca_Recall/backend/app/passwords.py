@@ -0,0 +1,90 @@
+"""
+Password hashing off the request thread.
+
+bcrypt is deliberately slow (~250ms at cost 12) but releases the GIL, so it
+runs on a small per-process thread pool: with gthread gunicorn workers other
+requests keep being served while logins hash. The pool is bounded twice: at
+most PASSWORD_HASH_WORKERS hashes run at once, and at most
+PASSWORD_HASH_QUEUE_SIZE more may wait. Beyond that PasswordHasherBusy is
+raised so a login burst is turned away instead of queueing up every thread.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from . import bcrypt
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Same lazy per-process pattern as the Redis pool: gunicorn forks after import
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full"""
+
+
+def _reset_executor_after_fork():
+    global _executor, _executor_pid, _slots, _executor_lock
+    _executor = None
+    _executor_pid = None
+    _slots = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                workers = current_app.config.get('PASSWORD_HASH_WORKERS', 2)
+                queue_size = current_app.config.get('PASSWORD_HASH_QUEUE_SIZE', 8)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+                _slots = threading.BoundedSemaphore(workers + queue_size)
+                _executor_pid = pid
+    return _executor, _slots
+
+
+def _run(func, *args):
+    """Run func on the hashing pool and wait for its result"""
+    executor, slots = _get_executor()
+    if not slots.acquire(timeout=current_app.config.get('PASSWORD_HASH_WAIT_SECONDS', 2)):
+        raise PasswordHasherBusy("Too many password hashes in progress")
+    try:
+        future = executor.submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    """bcrypt hash at the configured BCRYPT_LOG_ROUNDS work factor"""
+    return _run(bcrypt.generate_password_hash, password).decode('utf-8')
+
+
+def verify_password(password_hash, password):
+    return _run(bcrypt.check_password_hash, password_hash, password)
+
+
+def hash_rounds(password_hash):
+    """Work factor encoded in a bcrypt hash ($2b$12$...), or None if unrecognised"""
+    parts = (password_hash or '').split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def needs_rehash(password_hash):
+    """True when the hash was made with a different work factor than configured"""
+    return hash_rounds(password_hash) != current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
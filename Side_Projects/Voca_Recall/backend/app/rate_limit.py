@@ -0,0 +1,203 @@
+"""
+Redis sliding-window rate limiting for /api routes.
+
+Every request is counted in a bucket keyed by the caller: the JWT user when
+there is one, otherwise the client IP. Ordinary routes share the `default`
+bucket. Routes that call Notion or SMTP have their own buckets, so a burst of
+test sends can't use up a user's budget for the rest of the app. Those buckets
+also have a global cap shared by all users, protecting the Notion/SMTP quotas.
+
+Each bucket is a ZSET `ratelimit:{bucket}:{who}` of request timestamps. One
+Lua script trims entries older than the window, checks every applicable key
+and records the request only if all of them have room, so a check costs one
+Redis round trip. When Redis is unavailable requests are let through.
+
+Limits are strings like "30/minute". Per-route buckets come from
+RATE_LIMIT_ROUTES and per-role multipliers from RATE_LIMIT_ROLE_MULTIPLIERS.
+"""
+import math
+import time
+import uuid
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from .logging_config import get_logger
+from .metrics import inc
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+RATE_LIMIT_KEY_PREFIX = 'ratelimit:'
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Endpoints doing live Notion or SMTP work, by bucket
+EXPENSIVE_ENDPOINTS = {
+    'email.send_test_email': 'send_test',
+    'database.test_database_connection': 'notion',
+    'database.check_databases_health': 'notion',
+    'database.get_database_properties': 'notion',
+    'database.add_database': 'notion',
+    'tokens.create_token': 'notion',
+    'email_service.bulk_create_email_services': 'bulk',
+}
+
+# KEYS: bucket keys. ARGV: now_ms, member, then limit and window_ms per key.
+# Returns {allowed, count_1, reset_ms_1, count_2, reset_ms_2, ...}
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local allowed = 1
+local result = {}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[1 + 2 * i])
+    local window = tonumber(ARGV[2 + 2 * i])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    local reset = window
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        reset = tonumber(oldest[2]) + window - now
+    end
+    if count >= limit then
+        allowed = 0
+    end
+    result[2 * i] = count
+    result[2 * i + 1] = reset
+end
+if allowed == 1 then
+    for i, key in ipairs(KEYS) do
+        redis.call('ZADD', key, now, ARGV[2])
+        redis.call('PEXPIRE', key, ARGV[2 + 2 * i])
+    end
+end
+result[1] = allowed
+return result
+"""
+
+_script = None
+
+
+def parse_limit(spec):
+    """'30/minute' -> (30, 60); also accepts '30/5minute' style multiples"""
+    count, _, period = spec.strip().partition('/')
+    multiple = ''.join(ch for ch in period if ch.isdigit())
+    unit = period[len(multiple):].strip().rstrip('s')
+    if not count.isdigit() or unit not in PERIODS:
+        raise ValueError(f"Invalid rate limit '{spec}'")
+    return int(count), PERIODS[unit] * int(multiple or 1)
+
+
+def _parse_pairs(spec):
+    """'a=1,b=2' -> {'a': '1', 'b': '2'}"""
+    pairs = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            key, value = part.split('=', 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def _bucket_for(endpoint):
+    """(bucket name, per-caller limit, global limit or None) for an endpoint"""
+    config = current_app.config
+    route_limits = _parse_pairs(config.get('RATE_LIMIT_ROUTES'))
+    if endpoint in route_limits:
+        return endpoint, route_limits[endpoint], None
+    bucket = EXPENSIVE_ENDPOINTS.get(endpoint)
+    if bucket:
+        buckets = config.get('RATE_LIMIT_BUCKETS', {})
+        global_limits = config.get('RATE_LIMIT_GLOBAL_BUCKETS', {})
+        return bucket, buckets.get(bucket, config['RATE_LIMIT_DEFAULT']), global_limits.get(bucket)
+    return 'default', config['RATE_LIMIT_DEFAULT'], None
+
+
+def _caller():
+    """('u:<id>' or 'ip:<addr>', role)"""
+    try:
+        verify_jwt_in_request(optional=True)
+        claims = get_jwt()
+        if claims.get('sub') is not None:
+            return f"u:{claims['sub']}", claims.get('role')
+    except Exception:
+        pass  # Missing/expired token: limit by IP; the view will reject it anyway
+    return f"ip:{request.remote_addr}", None
+
+
+def check_rate_limit(bucket, who, limit, global_limit=None, multiplier=1):
+    """
+    Count one request against `bucket` for `who` (and the bucket's global cap).
+
+    Returns:
+        dict with 'allowed', 'limit', 'remaining', 'reset' (seconds), or None if Redis failed
+    """
+    global _script
+    count_limit, window = parse_limit(limit)
+    count_limit = max(1, int(count_limit * multiplier))
+    keys = [f"{RATE_LIMIT_KEY_PREFIX}{bucket}:{who}"]
+    args = [count_limit, window * 1000]
+    if global_limit:
+        global_count, global_window = parse_limit(global_limit)
+        keys.append(f"{RATE_LIMIT_KEY_PREFIX}{bucket}:global")
+        args += [global_count, global_window * 1000]
+
+    now_ms = int(time.time() * 1000)
+    try:
+        if _script is None:
+            _script = get_redis_client().register_script(SLIDING_WINDOW_SCRIPT)
+        result = _script(keys=keys, args=[now_ms, f"{now_ms}-{uuid.uuid4().hex[:8]}"] + args,
+                         client=get_redis_client())
+    except Exception as e:
+        logger.warning(f"Rate limit check failed, allowing request: {str(e)}")
+        return None
+
+    allowed = bool(result[0])
+    count, reset_ms = int(result[1]), int(result[2])
+    # When only the global cap is exhausted, report when it frees up
+    if not allowed and global_limit and count < count_limit:
+        reset_ms = int(result[4])
+    return {
+        'allowed': allowed,
+        'limit': count_limit,
+        'remaining': max(0, count_limit - count - (1 if allowed else 0)),
+        'reset': max(1, math.ceil(reset_ms / 1000)),
+    }
+
+
+def init_rate_limiting(app):
+    """Register the limiter on every /api request"""
+
+    @app.before_request
+    def enforce_rate_limit():
+        if not app.config.get('RATE_LIMIT_ENABLED', True):
+            return None
+        if request.method == 'OPTIONS' or not request.path.startswith('/api/') or request.endpoint is None:
+            return None
+
+        bucket, limit, global_limit = _bucket_for(request.endpoint)
+        who, role = _caller()
+        multipliers = _parse_pairs(app.config.get('RATE_LIMIT_ROLE_MULTIPLIERS'))
+        multiplier = float(multipliers.get(role, 1)) if role else 1
+
+        state = check_rate_limit(bucket, who, limit, global_limit, multiplier)
+        if state is None:
+            return None
+        g.rate_limit = state
+        if state['allowed']:
+            return None
+
+        inc('voca_rate_limited_total', bucket=bucket)
+        logger.warning(f"Rate limit exceeded on {request.endpoint} (bucket {bucket}) by {who}")
+        response = jsonify({
+            'error': 'Rate limit exceeded, please slow down',
+            'retry_after': state['reset']
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(state['reset'])
+        return response
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        state = g.get('rate_limit')
+        if state:
+            response.headers['X-RateLimit-Limit'] = str(state['limit'])
+            response.headers['X-RateLimit-Remaining'] = str(state['remaining'])
+            response.headers['X-RateLimit-Reset'] = str(state['reset'])
+        return response
@@ -0,0 +1,95 @@
+"""
+Per-service index of recently sent Notion pages.
+
+Each service has a Redis ZSET `recent:service:{id}` of page id -> sent time,
+trimmed to RECENT_ITEMS_WINDOW_DAYS and RECENT_ITEMS_MAX. Random selection
+draws a candidate pool a few times larger than the requested count and looks
+only those candidates up, so selection costs O(count) regardless of how long
+the service has been sending.
+"""
+import random
+import time
+from flask import current_app
+from .logging_config import get_logger
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+RECENT_KEY_PREFIX = 'recent:service:'
+# Candidates drawn per requested item before falling back to least-recently-sent ones
+CANDIDATE_FACTOR = 4
+
+
+def _recent_key(service_id):
+    return f"{RECENT_KEY_PREFIX}{service_id}"
+
+
+def _window_seconds():
+    return current_app.config.get('RECENT_ITEMS_WINDOW_DAYS', 7) * 86400
+
+
+def select_unsent(service_id, items, count):
+    """
+    Randomly pick `count` items, skipping ones this service sent recently.
+
+    Args:
+        service_id: EmailService id
+        items: list of {'id': page id, 'data': ...} entries
+        count: number of items wanted
+
+    Returns:
+        list of entries; recently sent items only fill the gap (oldest first)
+        when there are not enough fresh candidates
+    """
+    count = min(count, len(items))
+    candidates = random.sample(items, min(len(items), count * CANDIDATE_FACTOR))
+
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for item in candidates:
+            pipeline.zscore(_recent_key(service_id), item['id'])
+        scores = pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Recent-items index unavailable for service {service_id}: {str(e)}")
+        return candidates[:count]
+
+    cutoff = time.time() - _window_seconds()
+    fresh, repeated = [], []
+    for item, score in zip(candidates, scores):
+        if score is None or score < cutoff:
+            fresh.append(item)
+        else:
+            repeated.append((score, item))
+
+    if len(fresh) < count:
+        logger.info(f"Service {service_id}: {len(fresh)}/{count} unsent candidates, reusing least recently sent items")
+        repeated.sort(key=lambda pair: pair[0])
+        fresh.extend(item for _, item in repeated[:count - len(fresh)])
+    return fresh[:count]
+
+
+def record_sent_items(service_id, item_ids):
+    """Add sent page ids to the service's index and trim it (never raises)"""
+    item_ids = [item_id for item_id in item_ids if item_id]
+    if not item_ids:
+        return
+    now = time.time()
+    window = _window_seconds()
+    key = _recent_key(service_id)
+    try:
+        pipeline = get_redis_client().pipeline(transaction=False)
+        pipeline.zadd(key, {item_id: now for item_id in item_ids})
+        pipeline.zremrangebyscore(key, '-inf', now - window)
+        pipeline.zremrangebyrank(key, 0, -current_app.config.get('RECENT_ITEMS_MAX', 1000) - 1)
+        pipeline.expire(key, int(window))
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record sent items for service {service_id}: {str(e)}")
+
+
+def clear_sent_items(service_id):
+    """Forget a service's send history (e.g. when the service is deleted)"""
+    try:
+        get_redis_client().delete(_recent_key(service_id))
+    except Exception as e:
+        logger.warning(f"Failed to clear sent items for service {service_id}: {str(e)}")
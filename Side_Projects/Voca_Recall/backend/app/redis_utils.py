@@ -1,11 +1,79 @@
 from flask import current_app
+import os
+import threading
 import redis
 import time
 
 SCHEDULE_KEY = 'email_schedule'
 
+# Process-wide connection pool. Gunicorn and Celery prefork both fork after the
+# app is imported, so the pool is created lazily on first use and dropped in the
+# child after a fork; every worker process ends up with exactly one pool.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _reset_pool_after_fork():
+    """Forget the parent's pool in a freshly forked child"""
+    global _pool, _pool_pid, _pool_lock
+    _pool = None
+    _pool_pid = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def get_redis_pool():
+    """Return the connection pool for the current process, creating it on first use"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # Blocking: a thread finding every connection busy waits up to
+                # REDIS_POOL_TIMEOUT for one instead of failing on the spot
+                _pool = redis.BlockingConnectionPool.from_url(
+                    current_app.config['REDIS_URL'],
+                    max_connections=current_app.config.get('REDIS_MAX_CONNECTIONS'),
+                    timeout=current_app.config.get('REDIS_POOL_TIMEOUT'),
+                    socket_timeout=current_app.config.get('REDIS_SOCKET_TIMEOUT'),
+                    health_check_interval=30,
+                )
+                _pool_pid = pid
+    return _pool
+
+
 def get_redis_client():
-    return redis.from_url(current_app.config['REDIS_URL'])
+    return redis.Redis(connection_pool=get_redis_pool())
+
+
+def get_pool_stats():
+    """Utilisation snapshot of this process's connection pool"""
+    pool = _pool if _pool_pid == os.getpid() else None
+    if pool is None:
+        return {
+            'pid': os.getpid(),
+            'initialized': False,
+        }
+
+    # The blocking pool's queue holds idle connections plus None for slots never connected
+    created = len(pool._connections)
+    available = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+    in_use = created - available
+    max_connections = pool.max_connections
+    return {
+        'pid': os.getpid(),
+        'initialized': True,
+        'max_connections': max_connections,
+        'created_connections': created,
+        'in_use_connections': in_use,
+        'available_connections': available,
+        'utilization': round(in_use / max_connections, 4) if max_connections else None,
+    }
+
 
 def add_to_schedule(service_id, timestamp):
     """Add a service to the schedule ZSET"""
@@ -17,3 +85,44 @@ def remove_from_schedule(service_id):
     """Remove a service from the schedule ZSET"""
     client = get_redis_client()
     client.zrem(SCHEDULE_KEY, str(service_id))
+
+
+def update_schedule(add=None, remove=None, client=None):
+    """
+    Apply many schedule changes in one round trip.
+
+    Args:
+        add: Mapping of service_id -> UTC timestamp to (re)schedule
+        remove: Iterable of service_ids to drop from the schedule
+        client: Optional Redis client (defaults to the pooled client)
+    """
+    add = add or {}
+    remove = [str(service_id) for service_id in (remove or [])]
+    if not add and not remove:
+        return
+
+    client = client or get_redis_client()
+    pipeline = client.pipeline(transaction=False)
+    if remove:
+        pipeline.zrem(SCHEDULE_KEY, *remove)
+    if add:
+        pipeline.zadd(SCHEDULE_KEY, {str(service_id): float(ts) for service_id, ts in add.items()})
+    pipeline.execute()
+
+
+def add_many_to_schedule(entries):
+    """Add or reschedule several services with a single pipelined ZADD"""
+    update_schedule(add=entries)
+
+
+def remove_many_from_schedule(service_ids):
+    """Remove several services from the schedule with a single ZREM"""
+    update_schedule(remove=service_ids)
+
+
+def measure_latency(client=None):
+    """Round-trip PING latency to Redis in milliseconds"""
+    client = client or get_redis_client()
+    start_time = time.time()
+    client.ping()
+    return (time.time() - start_time) * 1000
@@ -0,0 +1,109 @@
+"""
+Cheaper API responses: orjson serialization, gzip and conditional GETs.
+
+- OrjsonProvider replaces Flask's JSON provider. Datetimes and other types
+  orjson doesn't handle natively still go through Flask's default(), so
+  payloads are unchanged.
+- init_compression gzips JSON and text bodies of at least
+  COMPRESS_MIN_BYTES when the client accepts gzip.
+- List endpoints derive a weak ETag from row versions (count, max id, max
+  updated_at) of the tables they render. The ETag is checked before any rows
+  are loaded, so an unchanged list costs one aggregate query per table and
+  returns 304 with no body. Rows touched within ETAG_SETTLE_SECONDS get no
+  ETag, since DATETIME columns only keep whole seconds and two edits in the
+  same second would share a version.
+"""
+import gzip
+import hashlib
+from datetime import datetime, timedelta
+import orjson
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+from .models import db
+
+# Bump when the to_dict() output of a listed model changes, so clients don't
+# revalidate an old payload shape against an unchanged row version
+RESPONSE_FORMAT_VERSION = 1
+ETAG_SETTLE_SECONDS = 2
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_compression(app):
+    """gzip large JSON/text responses for clients that accept it"""
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return response
+        if (response.status_code < 200 or response.status_code >= 300 or response.direct_passthrough
+                or response.is_streamed or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'gzip' not in request.accept_encodings:
+            return response
+        body = response.get_data()
+        if len(body) < app.config.get('COMPRESS_MIN_BYTES', 1024):
+            return response
+        response.set_data(gzip.compress(body, compresslevel=app.config.get('COMPRESS_LEVEL', 5)))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+def row_version(model, *criteria):
+    """(count, max id, max updated_at) of the rows of `model` matching `criteria`"""
+    columns = [db.func.count(model.id), db.func.max(model.id)]
+    if hasattr(model, 'updated_at'):
+        columns.append(db.func.max(model.updated_at))
+    return tuple(db.session.query(*columns).filter(*criteria).one())
+
+
+def list_etag(*versions, params=()):
+    """
+    Weak ETag for a list built from `versions` (row_version results) and request `params`.
+
+    Returns:
+        str, or None when a row changed too recently to tell versions apart
+    """
+    settled_before = datetime.utcnow() - timedelta(seconds=ETAG_SETTLE_SECONDS)
+    for version in versions:
+        latest = version[2] if len(version) > 2 else None
+        if isinstance(latest, str):  # SQLite may hand back aggregates of DATETIME as text
+            latest = datetime.fromisoformat(latest)
+        if latest is not None and latest > settled_before:
+            return None
+    digest = hashlib.sha1(repr((RESPONSE_FORMAT_VERSION, versions, params)).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def not_modified(etag):
+    """304 response if the client already has `etag`, else None"""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        return with_etag(response, etag)
+    return None
+
+
+def with_etag(response, etag):
+    """Attach the ETag; the response must be revalidated before reuse"""
+    if etag:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
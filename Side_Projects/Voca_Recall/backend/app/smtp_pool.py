@@ -0,0 +1,350 @@
+"""
+Pool of SMTP sender accounts with per-account quotas, routing and failover.
+
+Accounts come from SMTP_ACCOUNTS, a JSON list of objects:
+
+    {"name": "gmail-1", "host": "smtp.gmail.com", "port": 587, "user": "...",
+     "password": "...", "from": "...", "use_tls": true, "weight": 1,
+     "rate_per_minute": 20, "daily_cap": 500}
+
+Only host, user and password are required. Without SMTP_ACCOUNTS the pool is
+the single SMTP_HOST / SMTP_USER account, limited by SMTP_RATE_PER_MINUTE and
+SMTP_DAILY_CAP (0 = no limit).
+
+Sends per account are counted in Redis per minute and per UTC day
+(`smtp:acct:{name}:min:{minute}` / `:day:{yyyymmdd}`). A Lua script checks
+both caps and the account's cooldown and reserves a slot in one step, so
+workers never overshoot a quota between them. Candidates are ordered by
+SMTP_ROUTING (accounts at a cap are skipped either way):
+- least_loaded: fewest messages sent today per unit of weight first. It
+  tracks real usage, so traffic shifts to the others while one account cools
+  down, then evens out again.
+- weighted: weighted round-robin over a shared counter.
+
+Throttling replies (4xx, or 5xx naming a quota/rate limit), connection
+failures and authentication failures put the account on cooldown, and the
+message moves on to the next account. A rejected recipient fails the message
+without touching the account. A connection lost or timed out while the
+message is being handed over is ambiguous: the server may already have
+accepted it, so there is no failover and the send is left to the outbox's
+retry, which reuses the Message-ID. Whenever a message is not sent, the
+slot reserved for it is given back. Outcomes are kept per account in
+`smtp:health:{name}` for the admin API. If Redis is down, accounts are tried
+in order without quota checks.
+"""
+import json
+import smtplib
+import time
+from datetime import datetime
+from .logging_config import get_logger
+from .metrics import inc
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+ACCOUNT_KEY_PREFIX = 'smtp:acct:'
+HEALTH_KEY_PREFIX = 'smtp:health:'
+ROUND_ROBIN_KEY = 'smtp:rr'
+# Reply text that marks a 5xx as a sending limit rather than a bad message
+QUOTA_MARKERS = ('quota', 'rate limit', 'too many', 'limit exceeded', '5.4.5', '4.7.0')
+
+# KEYS: minute counter, day counter, cooldown. ARGV: rate_per_minute, daily_cap (0 = none).
+# Returns 1 when a slot was reserved, -1 cooling down, -2 minute cap, -3 daily cap.
+RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then return -1 end
+local rate = tonumber(ARGV[1])
+local cap = tonumber(ARGV[2])
+if rate > 0 and tonumber(redis.call('GET', KEYS[1]) or '0') >= rate then return -2 end
+if cap > 0 and tonumber(redis.call('GET', KEYS[2]) or '0') >= cap then return -3 end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], 172800)
+return 1
+"""
+RESERVE_REJECTIONS = {-1: 'cooling down', -2: 'per-minute cap reached', -3: 'daily cap reached'}
+
+
+class SMTPDeliveryUnknown(smtplib.SMTPException):
+    """The connection failed while the message was being handed over; it may have been delivered"""
+
+_reserve_script = None
+_accounts_cache = (None, None)
+
+
+def load_accounts(config):
+    """
+    SMTP accounts configured for the pool.
+
+    Returns:
+        list of dicts with name, host, port, user, password, from_address,
+        use_tls, weight, rate_per_minute and daily_cap
+    """
+    global _accounts_cache
+    raw = config.get('SMTP_ACCOUNTS')
+    if raw and _accounts_cache[0] == raw:
+        return _accounts_cache[1]
+
+    if raw:
+        entries = json.loads(raw)
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("SMTP_ACCOUNTS must be a non-empty JSON list")
+    else:
+        if not config.get('SMTP_USER') or not config.get('SMTP_PASSWORD'):
+            return []
+        entries = [{
+            'name': 'default',
+            'host': config.get('SMTP_HOST'),
+            'port': config.get('SMTP_PORT', 587),
+            'user': config.get('SMTP_USER'),
+            'password': config.get('SMTP_PASSWORD'),
+            'use_tls': config.get('SMTP_USE_TLS', True),
+            'rate_per_minute': config.get('SMTP_RATE_PER_MINUTE', 0),
+            'daily_cap': config.get('SMTP_DAILY_CAP', 0),
+        }]
+
+    accounts = []
+    for index, entry in enumerate(entries):
+        missing = [field for field in ('host', 'user', 'password') if not entry.get(field)]
+        if missing:
+            raise ValueError(f"SMTP account #{index + 1} is missing {', '.join(missing)}")
+        accounts.append({
+            'name': str(entry.get('name') or entry['user']),
+            'host': entry['host'],
+            'port': int(entry.get('port', 587)),
+            'user': str(entry['user']),
+            'password': str(entry['password']),
+            'from_address': str(entry.get('from') or entry['user']),
+            'use_tls': bool(entry.get('use_tls', True)),
+            'weight': max(1, int(entry.get('weight', 1))),
+            'rate_per_minute': int(entry.get('rate_per_minute', 0)),
+            'daily_cap': int(entry.get('daily_cap', 0)),
+        })
+    if raw:
+        _accounts_cache = (raw, accounts)
+    return accounts
+
+
+def _usage_keys(account, now=None):
+    now = now or time.time()
+    prefix = f"{ACCOUNT_KEY_PREFIX}{account['name']}"
+    return (
+        f"{prefix}:min:{int(now // 60)}",
+        f"{prefix}:day:{datetime.utcfromtimestamp(now).strftime('%Y%m%d')}",
+        f"{prefix}:cooldown",
+    )
+
+
+def account_usage(client, accounts):
+    """[(sent this minute, sent today, cooldown seconds left or None)] per account, one round trip"""
+    pipeline = client.pipeline(transaction=False)
+    for account in accounts:
+        minute_key, day_key, cooldown_key = _usage_keys(account)
+        pipeline.get(minute_key)
+        pipeline.get(day_key)
+        pipeline.ttl(cooldown_key)
+    results = pipeline.execute()
+    return [
+        (int(minute or 0), int(day or 0), ttl if ttl and ttl > 0 else None)
+        for minute, day, ttl in zip(results[0::3], results[1::3], results[2::3])
+    ]
+
+
+def order_accounts(client, accounts, strategy):
+    """Accounts in the order they should be tried for the next message"""
+    if len(accounts) <= 1:
+        return list(accounts)
+    if strategy == 'weighted':
+        total = sum(account['weight'] for account in accounts)
+        position = (client.incr(ROUND_ROBIN_KEY) - 1) % total
+        for index, account in enumerate(accounts):
+            position -= account['weight']
+            if position < 0:
+                return accounts[index:] + accounts[:index]
+        return list(accounts)
+    usage = account_usage(client, accounts)
+    ranked = sorted(zip(accounts, usage), key=lambda pair: (
+        pair[1][2] is not None,  # accounts cooling down last
+        pair[1][1] / pair[0]['weight'],
+    ))
+    return [account for account, _ in ranked]
+
+
+def _reserve(client, account, keys):
+    global _reserve_script
+    if _reserve_script is None:
+        _reserve_script = client.register_script(RESERVE_SCRIPT)
+    return _reserve_script(keys=list(keys), args=[account['rate_per_minute'], account['daily_cap']], client=client)
+
+
+def _release(client, account, keys):
+    """Give back a slot reserved for a message that was not sent"""
+    minute_key, day_key, _ = keys
+    try:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.decr(minute_key)
+        pipeline.decr(day_key)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to release SMTP slot of {account['name']}: {str(e)}")
+
+
+def classify_smtp_error(error):
+    """
+    'recipient', 'auth', 'throttled', 'retry' (outcome unknown, don't fail
+    over) or 'failed' (any other permanent rejection)
+    """
+    if isinstance(error, SMTPDeliveryUnknown):
+        return 'retry'
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return 'recipient'
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return 'auth'
+    if isinstance(error, smtplib.SMTPResponseException):
+        message = error.smtp_error.decode('utf-8', 'replace') if isinstance(error.smtp_error, bytes) else str(error.smtp_error)
+        if 400 <= error.smtp_code < 500 or any(marker in message.lower() for marker in QUOTA_MARKERS):
+            return 'throttled'
+        return 'failed'
+    # Connection refused/dropped, timeouts, TLS failures before the message was
+    # handed over: the account's server is unreachable
+    return 'throttled'
+
+
+def _record_outcome(client, account, error=None, kind=None, cooldown=0):
+    """Update the account's health hash (and cooldown) after a delivery attempt"""
+    key = f"{HEALTH_KEY_PREFIX}{account['name']}"
+    now = datetime.utcnow().isoformat() + 'Z'
+    try:
+        pipeline = client.pipeline(transaction=False)
+        if error is None:
+            pipeline.hset(key, mapping={'last_success_at': now, 'consecutive_failures': 0})
+            pipeline.hincrby(key, 'sent_total', 1)
+        else:
+            pipeline.hset(key, mapping={'last_failure_at': now, 'last_error': str(error)[:500], 'last_error_kind': kind})
+            pipeline.hincrby(key, 'failed_total', 1)
+            pipeline.hincrby(key, 'consecutive_failures', 1)
+            if cooldown:
+                pipeline.set(_usage_keys(account)[2], kind, ex=cooldown)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record SMTP health for {account['name']}: {str(e)}")
+
+
+def _deliver(account, msg, timeout):
+    """Send msg through account; raises SMTPDeliveryUnknown if the connection fails mid-transaction"""
+    del msg['From']
+    msg['From'] = account['from_address']
+    server = smtplib.SMTP(account['host'], account['port'], timeout=timeout)
+    try:
+        if account['use_tls']:
+            server.starttls()
+        server.login(account['user'], account['password'])
+        try:
+            server.send_message(msg)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server answered with a rejection: nothing was delivered
+            raise
+        except OSError as e:
+            raise SMTPDeliveryUnknown(str(e)) from e
+    finally:
+        # The message is out (or definitely refused); a failed QUIT changes nothing
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+def send_message(msg, config):
+    """
+    Deliver `msg` through the first pool account with capacity, failing over on throttling.
+
+    Returns:
+        tuple: (success, error message or None, name of the account used or None)
+    """
+    accounts = load_accounts(config)
+    if not accounts:
+        return False, "SMTP credentials not configured", None
+
+    timeout = config.get('SMTP_TIMEOUT_SECONDS', 30)
+    try:
+        client = get_redis_client()
+        candidates = order_accounts(client, accounts, config.get('SMTP_ROUTING', 'least_loaded'))
+    except Exception as e:
+        logger.warning(f"SMTP quota tracking unavailable, trying accounts in order: {str(e)}")
+        client, candidates = None, list(accounts)
+
+    skipped = []
+    for account in candidates:
+        keys = _usage_keys(account)
+        reserved = None
+        if client is not None:
+            try:
+                reserved = _reserve(client, account, keys)
+            except Exception as e:
+                logger.warning(f"SMTP quota check failed for {account['name']}, sending anyway: {str(e)}")
+            if reserved is not None and reserved != 1:
+                skipped.append(f"{account['name']}: {RESERVE_REJECTIONS.get(reserved, 'unavailable')}")
+                continue
+
+        try:
+            _deliver(account, msg, timeout)
+        except Exception as e:
+            kind = classify_smtp_error(e)
+            inc('voca_smtp_sends_total', account=account['name'], status=kind)
+            if reserved == 1:
+                _release(client, account, keys)
+            if kind == 'retry':
+                # It may have been delivered; another account could send a duplicate
+                logger.warning(f"SMTP account {account['name']} lost the connection mid-send, leaving it to retry: {str(e)}")
+                if client is not None:
+                    _record_outcome(client, account, e, kind)
+                return False, f"Delivery outcome unknown: {str(e)}", account['name']
+            if kind in ('recipient', 'failed'):
+                # The message itself was refused; another account won't do better
+                if client is not None:
+                    _record_outcome(client, account, e, kind)
+                return False, str(e), account['name']
+            cooldown = config.get('SMTP_AUTH_COOLDOWN_SECONDS', 3600) if kind == 'auth' \
+                else config.get('SMTP_THROTTLE_COOLDOWN_SECONDS', 300)
+            logger.warning(f"SMTP account {account['name']} {kind} ({str(e)}), cooling down {cooldown}s and failing over")
+            if client is not None:
+                _record_outcome(client, account, e, kind, cooldown)
+            skipped.append(f"{account['name']}: {str(e)}")
+            continue
+
+        inc('voca_smtp_sends_total', account=account['name'], status='sent')
+        if client is not None:
+            _record_outcome(client, account)
+        return True, None, account['name']
+
+    return False, f"No SMTP account could send ({'; '.join(skipped)})", None
+
+
+def pool_status(config):
+    """Per-account configuration (without secrets), usage and health for the admin API"""
+    accounts = load_accounts(config)
+    client = get_redis_client()
+    usage = account_usage(client, accounts)
+    pipeline = client.pipeline(transaction=False)
+    for account in accounts:
+        pipeline.hgetall(f"{HEALTH_KEY_PREFIX}{account['name']}")
+    healths = pipeline.execute()
+
+    status = []
+    for account, (minute_used, day_used, cooldown), health in zip(accounts, usage, healths):
+        status.append({
+            'name': account['name'],
+            'host': account['host'],
+            'from_address': account['from_address'],
+            'weight': account['weight'],
+            'rate_per_minute': account['rate_per_minute'],
+            'daily_cap': account['daily_cap'],
+            'sent_this_minute': minute_used,
+            'sent_today': day_used,
+            'cooldown_seconds': cooldown,
+            'health': {
+                (field.decode() if isinstance(field, bytes) else field): (value.decode() if isinstance(value, bytes) else value)
+                for field, value in health.items()
+            },
+        })
+    return status
@@ -93,7 +93,7 @@ def validate_smtp_credentials(smtp_host, smtp_port, smtp_user, smtp_password, us
 
 def validate_smtp_from_config(app_config):
     """
-    Validate SMTP credentials from Flask app config.
+    Validate the credentials of every SMTP account in the sender pool.
     
     Args:
         app_config: Flask application config object
@@ -101,21 +101,35 @@ def validate_smtp_from_config(app_config):
     Returns:
         tuple: (success: bool, error_message: str or None)
     """
-    smtp_host = app_config.get('SMTP_HOST')
-    smtp_port = app_config.get('SMTP_PORT')
-    smtp_user = app_config.get('SMTP_USER')
-    smtp_password = app_config.get('SMTP_PASSWORD')
-    use_tls = app_config.get('SMTP_USE_TLS', True)
+    from .smtp_pool import load_accounts
     
-    if not smtp_host or not smtp_port:
-        error_msg = "SMTP_HOST and SMTP_PORT must be configured"
+    try:
+        accounts = load_accounts(app_config)
+    except (ValueError, TypeError) as e:
+        error_msg = f"Invalid SMTP_ACCOUNTS: {str(e)}"
         logger.error(f"SMTP validation failed: {error_msg}")
         return False, error_msg
     
-    return validate_smtp_credentials(
-        smtp_host=smtp_host,
-        smtp_port=int(smtp_port),
-        smtp_user=smtp_user,
-        smtp_password=smtp_password,
-        use_tls=use_tls
-    )
+    if not accounts:
+        return validate_smtp_credentials(
+            smtp_host=app_config.get('SMTP_HOST'),
+            smtp_port=int(app_config.get('SMTP_PORT') or 0),
+            smtp_user=None,
+            smtp_password=None
+        )
+    
+    errors = []
+    for account in accounts:
+        success, error = validate_smtp_credentials(
+            smtp_host=account['host'],
+            smtp_port=account['port'],
+            smtp_user=account['user'],
+            smtp_password=account['password'],
+            use_tls=account['use_tls']
+        )
+        if not success:
+            errors.append(f"{account['name']}: {error}" if len(accounts) > 1 else error)
+    
+    if errors:
+        return False, '; '.join(errors)
+    return True, None
@@ -0,0 +1,180 @@
+"""
+Spaced-repetition selection for email services.
+
+Every page of the service's Notion database gets a `VocabularyReview` row
+holding SM-2 style state (ease, interval, due date) plus the last seen
+projection of the page. seed_reviews copies the database in a few Notion
+pages per send, resuming from a cursor stored on the service, until the
+whole database has been walked; after that each send only adds the newest
+pages. Rows never sent have due_at = UNSEEN_DUE_AT.
+
+Selection is index range scans over (service_id, due_at): the N most
+overdue items, then unseen items in the order they were seeded, then the
+items coming due soonest. None of it depends on the size of the Notion
+database. An email carries no recall grade, so each send counts as a
+successful review.
+"""
+from datetime import datetime, timedelta
+from .models import VocabularyReview, db
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_EASE = 2.5
+# Intervals (days) for the first two successful reviews; afterwards interval *= ease
+FIRST_INTERVALS = (1, 3)
+# due_at of seeded pages not sent yet: after every real due date, and one index key to scan
+UNSEEN_DUE_AT = datetime(9999, 12, 31)
+
+
+def next_interval(repetitions, interval_days, ease):
+    """Interval in days after one more successful review"""
+    if repetitions < len(FIRST_INTERVALS):
+        return FIRST_INTERVALS[repetitions]
+    return round(interval_days * ease, 2)
+
+
+def _add_unseen(service_id, items):
+    """Insert unseen review rows for the items this service has no row for; returns how many"""
+    by_id = {item['id']: item for item in items if item.get('id')}
+    if not by_id:
+        return 0
+    known = {
+        item_id for (item_id,) in db.session.query(VocabularyReview.item_id)
+        .filter(VocabularyReview.service_id == service_id, VocabularyReview.item_id.in_(list(by_id)))
+    }
+    inserts = [{
+        'service_id': service_id,
+        'item_id': item_id,
+        'item_data': item['data'],
+        'ease': DEFAULT_EASE,
+        'interval_days': 0,
+        'repetitions': 0,
+        'due_at': UNSEEN_DUE_AT,
+    } for item_id, item in by_id.items() if item_id not in known]
+    if inserts:
+        db.session.bulk_insert_mappings(VocabularyReview, inserts)
+    return len(inserts)
+
+
+def seed_reviews(service, items, fetch_page, max_pages):
+    """
+    Copy the service's Notion database into its review rows, a few pages per send.
+
+    Args:
+        service: EmailService being sent; its review_cursor / review_seeded
+            record how far the walk got
+        items: this send's fetch (the newest pages), always added
+        fetch_page: function(cursor) -> (items, next cursor or None) returning
+            one page of the database, starting from the top for cursor None
+        max_pages: Notion pages to walk in this call
+
+    The caller commits. If fetch_page raises, the pages copied so far stay
+    added and the walk resumes from the last stored cursor next time.
+    """
+    added = _add_unseen(service.id, items)
+    pages = 0
+    while not service.review_seeded and pages < max_pages:
+        entries, cursor = fetch_page(service.review_cursor)
+        pages += 1
+        added += _add_unseen(service.id, entries)
+        service.review_cursor = cursor
+        if cursor is None:
+            service.review_seeded = True
+    if added:
+        logger.info(f"Seeded {added} new items for spaced repetition of service {service.id} ({pages} pages walked)")
+    return added
+
+
+def select_for_review(service_id, items, count, now=None):
+    """
+    Pick up to `count` items for a spaced-repetition send.
+
+    Args:
+        service_id: EmailService id
+        items: freshly fetched [{'id': page id, 'data': ...}] entries, used to
+            refresh the stored copy of selected items (seed them first)
+        count: number of items wanted
+        now: naive UTC datetime (defaults to utcnow)
+
+    Returns:
+        list of {'id', 'data'} entries: overdue items first, then unseen items,
+        then the ones coming due soonest
+    """
+    now = now or datetime.utcnow()
+    fetched = {item['id']: item for item in items}
+
+    def entry(review):
+        # Prefer the fresh copy of the page when it was part of this fetch
+        return fetched.get(review.item_id) or {'id': review.item_id, 'data': review.item_data or {}}
+
+    def reviews(*criteria, limit):
+        return VocabularyReview.query\
+            .filter(VocabularyReview.service_id == service_id, *criteria)\
+            .order_by(VocabularyReview.due_at, VocabularyReview.id)\
+            .limit(limit)\
+            .all()
+
+    due = reviews(VocabularyReview.due_at <= now, limit=count)
+    selected = [entry(review) for review in due]
+
+    if len(selected) < count:
+        unseen = reviews(VocabularyReview.due_at == UNSEEN_DUE_AT, limit=count - len(selected))
+        selected.extend(entry(review) for review in unseen)
+
+    if len(selected) < count:
+        upcoming = reviews(VocabularyReview.due_at > now, VocabularyReview.due_at < UNSEEN_DUE_AT,
+                           limit=count - len(selected))
+        selected.extend(entry(review) for review in upcoming)
+
+    logger.info(f"Spaced repetition for service {service_id}: {len(due)} due, {len(selected)} selected")
+    return selected
+
+
+def record_reviews(service_id, entries, now=None):
+    """
+    Advance the review state of every sent entry in bulk.
+
+    Existing rows are read with one IN query and written back with one bulk
+    UPDATE; first-time items are bulk inserted. The caller commits.
+    """
+    if not entries:
+        return
+    now = now or datetime.utcnow()
+    by_id = {entry['id']: entry for entry in entries if entry.get('id')}
+
+    existing = {
+        review.item_id: review for review in VocabularyReview.query
+        .filter(VocabularyReview.service_id == service_id, VocabularyReview.item_id.in_(list(by_id)))
+    }
+
+    updates, inserts = [], []
+    for item_id, entry in by_id.items():
+        review = existing.get(item_id)
+        if review:
+            interval = next_interval(review.repetitions, review.interval_days, review.ease)
+            updates.append({
+                'id': review.id,
+                'item_data': entry['data'],
+                'interval_days': interval,
+                'repetitions': review.repetitions + 1,
+                'due_at': now + timedelta(days=interval),
+                'last_reviewed_at': now,
+            })
+        else:
+            interval = next_interval(0, 0, DEFAULT_EASE)
+            inserts.append({
+                'service_id': service_id,
+                'item_id': item_id,
+                'item_data': entry['data'],
+                'ease': DEFAULT_EASE,
+                'interval_days': interval,
+                'repetitions': 1,
+                'due_at': now + timedelta(days=interval),
+                'last_reviewed_at': now,
+            })
+
+    if updates:
+        db.session.bulk_update_mappings(VocabularyReview, updates)
+    if inserts:
+        db.session.bulk_insert_mappings(VocabularyReview, inserts)
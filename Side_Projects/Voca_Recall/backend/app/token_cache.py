@@ -0,0 +1,257 @@
+"""
+Per-process cache of usable Notion tokens.
+
+Scheduled sends look up their database's token on every run. get_token_handle
+keeps a bounded LRU of TokenHandle entries per worker process: the token
+checked to exist and be active, its stored value turned into the API key
+(where decryption belongs once tokens are encrypted at rest), and its
+fingerprint. The DB lookup and any decrypt happen once per token per process,
+not once per send. An entry expires once unused for
+NOTION_TOKEN_CACHE_IDLE_SECONDS, and in any case after
+NOTION_TOKEN_CACHE_MAX_AGE_SECONDS.
+
+Failures are cached too:
+- A missing or inactive token is cached as such for
+  NOTION_TOKEN_NEGATIVE_TTL_SECONDS.
+- A token Notion rejects as unauthorized is marked in Redis by fingerprint
+  (record_token_rejection) for the same time, so every worker skips it
+  instead of asking Notion again on each send.
+
+Token edits, deactivation and deletion call invalidate_token after
+committing. That publishes the token id on a Redis channel, and a listener
+thread in each process drops its entry. If the listener loses Redis, it
+empties the cache when it reconnects, because invalidations may have been
+missed in between.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import redis
+from flask import current_app
+from notion_client import APIErrorCode, APIResponseError
+from .logging_config import get_logger
+from .metrics import inc
+from .models import NotionToken
+from .notion_cache import token_fingerprint
+from .redis_utils import get_redis_client
+
+logger = get_logger(__name__)
+
+INVALIDATE_CHANNEL = 'notion:tokens:invalidate'
+REJECTED_KEY_PREFIX = 'notion:token:rejected:'
+INACTIVE = 'not found or inactive'
+REJECTED = 'rejected by Notion'
+LISTENER_RETRY_SECONDS = 5
+
+TokenHandle = namedtuple('TokenHandle', ['id', 'user_id', 'api_key', 'fingerprint'])
+
+# token id -> (TokenHandle or None, reason, loaded_at, last_used_at)
+_entries = OrderedDict()
+_lock = threading.Lock()
+_listener_pid = None
+# Bumped on every invalidation, so a load that raced one isn't cached
+_generation = 0
+
+
+def _reset_after_fork():
+    """Start a forked child with an empty cache and no listener"""
+    global _entries, _lock, _listener_pid, _generation
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    _listener_pid = None
+    _generation = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def token_api_key(token):
+    """The Notion API key held by a NotionToken row (where it would be decrypted)"""
+    return token.token
+
+
+def _rejected_key(fingerprint):
+    return f"{REJECTED_KEY_PREFIX}{fingerprint}"
+
+
+def _drop(token_id=None, fingerprint=None):
+    global _generation
+    with _lock:
+        _generation += 1
+        if token_id is not None:
+            _entries.pop(token_id, None)
+        if fingerprint is not None:
+            for key in [key for key, entry in _entries.items() if entry[0] and entry[0].fingerprint == fingerprint]:
+                del _entries[key]
+
+
+def _clear():
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()
+
+
+def _apply_message(data):
+    """Handle an invalidation message: 'id:<token id>' or 'fp:<fingerprint>'"""
+    data = data.decode() if isinstance(data, bytes) else str(data)
+    kind, _, value = data.partition(':')
+    if kind == 'id' and value.isdigit():
+        _drop(token_id=int(value))
+    elif kind == 'fp':
+        _drop(fingerprint=value)
+
+
+def _listen(redis_url):
+    """Listener thread body: apply invalidations until the process exits"""
+    while True:
+        try:
+            # Own connection without a read timeout: the subscription sits idle most of the time
+            client = redis.Redis.from_url(redis_url, health_check_interval=30)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Anything cached before (re)subscribing may have missed an invalidation
+            _clear()
+            while True:
+                message = pubsub.get_message(timeout=30)
+                if message and message['type'] == 'message':
+                    _apply_message(message['data'])
+        except Exception as e:
+            logger.warning(f"Notion token invalidation listener disconnected: {str(e)}")
+            time.sleep(LISTENER_RETRY_SECONDS)
+
+
+def _ensure_listener():
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    threading.Thread(
+        target=_listen, args=(current_app.config['REDIS_URL'],),
+        name='notion-token-invalidation', daemon=True
+    ).start()
+
+
+def _is_rejected(fingerprint):
+    try:
+        return bool(get_redis_client().exists(_rejected_key(fingerprint)))
+    except Exception as e:
+        logger.warning(f"Could not check Notion token rejection marker: {str(e)}")
+        return False
+
+
+def _load(token_id):
+    """(TokenHandle or None, reason) straight from the database"""
+    token = NotionToken.query.get(token_id)
+    if not token or not token.is_active:
+        return None, INACTIVE
+    api_key = token_api_key(token)
+    fingerprint = token_fingerprint(api_key)
+    if _is_rejected(fingerprint):
+        return None, REJECTED
+    return TokenHandle(token.id, token.user_id, api_key, fingerprint), None
+
+
+def _fresh(entry, now, config):
+    handle, _, loaded_at, last_used_at = entry
+    if handle is None:
+        return now - loaded_at < config.get('NOTION_TOKEN_NEGATIVE_TTL_SECONDS', 300)
+    return (now - last_used_at < config.get('NOTION_TOKEN_CACHE_IDLE_SECONDS', 900)
+            and now - loaded_at < config.get('NOTION_TOKEN_CACHE_MAX_AGE_SECONDS', 3600))
+
+
+def get_token_handle(token_id, user_id=None):
+    """
+    The usable Notion token with this id, from the per-process cache.
+
+    Args:
+        token_id: NotionToken id
+        user_id: when set, only a token owned by this user is returned
+
+    Returns:
+        TokenHandle, or None if the token is missing, inactive or rejected by Notion
+    """
+    return lookup_token(token_id, user_id)[0]
+
+
+def lookup_token(token_id, user_id=None):
+    """
+    get_token_handle, with the reason a token is unusable.
+
+    Returns:
+        (TokenHandle, None), or (None, INACTIVE or REJECTED)
+    """
+    config = current_app.config
+    size = config.get('NOTION_TOKEN_CACHE_SIZE', 1024)
+    if size <= 0:
+        handle, reason = _load(token_id)
+    else:
+        _ensure_listener()
+        now = time.time()
+        with _lock:
+            entry = _entries.get(token_id)
+            hit = entry is not None and _fresh(entry, now, config)
+            if hit:
+                _entries[token_id] = entry[:3] + (now,)
+                _entries.move_to_end(token_id)
+            generation = _generation
+        if hit:
+            handle, reason = entry[0], entry[1]
+            inc('voca_notion_token_cache_total', result='hit' if handle else 'negative')
+        else:
+            inc('voca_notion_token_cache_total', result='miss')
+            handle, reason = _load(token_id)
+            with _lock:
+                if generation == _generation:
+                    _entries[token_id] = (handle, reason, now, now)
+                    _entries.move_to_end(token_id)
+                    while len(_entries) > size:
+                        _entries.popitem(last=False)
+
+    if handle is None:
+        logger.warning(f"Notion token {token_id} unusable: {reason}")
+        return None, reason
+    if user_id is not None and handle.user_id != user_id:
+        return None, INACTIVE
+    return handle, None
+
+
+def invalidate_token(token_id):
+    """Drop a token from every worker's cache; call after committing a change to it"""
+    _drop(token_id=token_id)
+    try:
+        get_redis_client().publish(INVALIDATE_CHANNEL, f"id:{token_id}")
+    except Exception as e:
+        logger.warning(f"Failed to publish invalidation of Notion token {token_id}: {str(e)}")
+
+
+def is_token_rejection(error):
+    """Whether a Notion API error means the token itself is no longer valid"""
+    return isinstance(error, APIResponseError) and error.code == APIErrorCode.Unauthorized
+
+
+def record_token_rejection(api_key):
+    """Remember that Notion rejected this token, in every worker, for NOTION_TOKEN_NEGATIVE_TTL_SECONDS"""
+    fingerprint = token_fingerprint(api_key)
+    _drop(fingerprint=fingerprint)
+    inc('voca_notion_token_rejections_total')
+    try:
+        client = get_redis_client()
+        client.setex(_rejected_key(fingerprint), current_app.config.get('NOTION_TOKEN_NEGATIVE_TTL_SECONDS', 300), 1)
+        client.publish(INVALIDATE_CHANNEL, f"fp:{fingerprint}")
+    except Exception as e:
+        logger.warning(f"Failed to record Notion token rejection: {str(e)}")
+
+
+def clear_token_rejection(api_key):
+    """Forget a rejection, e.g. after the user re-validated the token"""
+    try:
+        get_redis_client().delete(_rejected_key(token_fingerprint(api_key)))
+    except Exception as e:
+        logger.warning(f"Failed to clear Notion token rejection: {str(e)}")
@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from notion_client import Client
+from .notion_utils import get_notion_client
 from .models import NotionToken, NotionDatabase, db
+from .token_cache import clear_token_rejection, invalidate_token
 from .logging_config import get_logger
+from .responses import row_version, list_etag, not_modified, with_etag
 from .middleware import log_api_call
 
 tokens_bp = Blueprint('tokens', __name__)
@@ -17,11 +19,23 @@ def get_tokens():
     try:
         current_user_id = int(get_jwt_identity())
         
-        tokens = NotionToken.query.filter_by(user_id=current_user_id).order_by(NotionToken.created_at.desc()).all()
+        # database_count comes from the databases table
+        etag = list_etag(
+            row_version(NotionToken, NotionToken.user_id == current_user_id),
+            row_version(NotionDatabase, NotionDatabase.user_id == current_user_id),
+            params=(current_user_id,)
+        )
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        return jsonify({
+        tokens = NotionToken.query.filter_by(user_id=current_user_id)\
+            .options(db.selectinload(NotionToken.databases))\
+            .order_by(NotionToken.created_at.desc()).all()
+        
+        return with_etag(jsonify({
             'tokens': [token.to_dict() for token in tokens]
-        }), 200
+        }), etag), 200
         
     except Exception as e:
         logger.error(f"Failed to fetch tokens: {str(e)}")
@@ -67,7 +81,7 @@ def create_token():
         
         # Validate token by trying to authenticate with Notion API
         try:
-            notion = Client(auth=token_value)
+            notion = get_notion_client(token_value)
             # Try to list databases to verify the token works
             notion.search(filter={"property": "object", "value": "database"}, page_size=1)
             logger.info("Token validated successfully with Notion API")
@@ -126,10 +140,11 @@ def update_token(token_id):
             
             # Validate new token
             try:
-                notion = Client(auth=new_token_value)
+                notion = get_notion_client(new_token_value)
                 notion.search(filter={"property": "object", "value": "database"}, page_size=1)
                 logger.info("New token value validated successfully")
                 token.token = new_token_value
+                clear_token_rejection(new_token_value)
             except Exception as e:
                 logger.error(f"Invalid Notion token: {str(e)}")
                 return jsonify({'error': 'Invalid Notion API token. Please check and try again.'}), 400
@@ -139,6 +154,7 @@ def update_token(token_id):
             token.is_active = bool(data['is_active'])
         
         db.session.commit()
+        invalidate_token(token_id)
         
         logger.info(f"Updated token {token_id} for user {current_user_id}")
         
@@ -180,6 +196,7 @@ def delete_token(token_id):
         
         db.session.delete(token)
         db.session.commit()
+        invalidate_token(token_id)
         
         logger.info(f"Deleted token {token_id} for user {current_user_id}")
         
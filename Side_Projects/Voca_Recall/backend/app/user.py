@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import User, EmailSettings, db
 from .logging_config import get_logger
 from .middleware import log_api_call
+from .db_routing import use_primary_db
 from datetime import datetime
 
 user_bp = Blueprint('user', __name__)
@@ -56,6 +57,9 @@ def update_profile():
             user.first_name = data['first_name']
         if data.get('last_name'):
             user.last_name = data['last_name']
+        if 'digest_mode' in data:
+            # Combine services that fire close together into one email
+            user.digest_mode = bool(data['digest_mode'])
         
         db.session.commit()
         
@@ -73,6 +77,7 @@ def update_profile():
 @user_bp.route('/email-settings', methods=['GET'])
 @jwt_required()
 @log_api_call("Get email settings")
+@use_primary_db
 def get_email_settings():
     """Get user's email settings
     
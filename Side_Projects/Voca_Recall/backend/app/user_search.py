@@ -0,0 +1,152 @@
+"""
+Indexed user search for the admin console.
+
+Two index-backed stages, so no query scans the users table:
+
+1. Prefix: range scans on the lowercase shadow columns (email_lower,
+   first_name_lower, last_name_lower), each with its own B-tree index.
+2. Substring: a full-text index over email and names. MySQL uses a FULLTEXT
+   index with the ngram parser; SQLite uses an FTS5 table with the trigram
+   tokenizer, kept in sync by triggers. Both match any fragment of
+   USER_SEARCH_MIN_SUBSTRING characters or more.
+
+Results are ranked: exact email, then email prefix, then name prefix, then
+full-text matches by relevance. At most USER_SEARCH_MAX_RESULTS ids are
+collected; callers page through that ranked list. Relevance is computed over
+at most USER_SEARCH_RANK_WINDOW full-text hits, so a fragment shared by most
+users ("@gmail") costs the same as a rare one.
+"""
+from flask import current_app
+from sqlalchemy import text
+from .models import User, db
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+FTS_TABLE = 'users_fts'
+FULLTEXT_INDEX = 'ft_users_search'
+# Sorts after any character that can appear in an email or a name
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+SQLITE_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "email, first_name, last_name, content='users', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, email, first_name, last_name) "
+    "VALUES (new.id, new.email, new.first_name, new.last_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email, first_name, last_name) "
+    "VALUES ('delete', old.id, old.email, old.first_name, old.last_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF email, first_name, last_name ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email, first_name, last_name) "
+    "VALUES ('delete', old.id, old.email, old.first_name, old.last_name); "
+    f"INSERT INTO {FTS_TABLE}(rowid, email, first_name, last_name) "
+    "VALUES (new.id, new.email, new.first_name, new.last_name); END",
+)
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def ensure_search_index():
+    """Create the full-text index if missing (idempotent; run at startup and by migrate_db)"""
+    dialect = _dialect()
+    with db.engine.begin() as conn:
+        if dialect == 'sqlite':
+            existed = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': FTS_TABLE}).first()
+            for ddl in SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            if not existed:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                logger.info(f"Created {FTS_TABLE} full-text index")
+        elif dialect == 'mysql':
+            exists = conn.execute(text(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'users' AND index_name = :name LIMIT 1"
+            ), {'name': FULLTEXT_INDEX}).first()
+            if not exists:
+                conn.execute(text(
+                    f"ALTER TABLE users ADD FULLTEXT INDEX {FULLTEXT_INDEX} "
+                    "(email, first_name, last_name) WITH PARSER ngram"
+                ))
+                logger.info(f"Created {FULLTEXT_INDEX} full-text index")
+
+
+def _prefix_filter(column, term):
+    # A range instead of LIKE 'term%' so every backend can use the index
+    return db.and_(column >= term, column < term + PREFIX_UPPER_BOUND)
+
+
+def _fulltext_ids(term, exclude, limit):
+    """Ids of users whose email or name contains `term`, most relevant first"""
+    phrase = '"' + term.replace('"', '""') + '"'
+    params = {
+        'phrase': phrase,
+        'limit': limit + len(exclude),
+        'window': current_app.config.get('USER_SEARCH_RANK_WINDOW', 1000),
+    }
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        rows = db.session.execute(text(
+            f"SELECT rowid FROM (SELECT rowid, bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :phrase LIMIT :window) AS hits ORDER BY score LIMIT :limit"
+        ), params)
+    elif dialect == 'mysql':
+        rows = db.session.execute(text(
+            "SELECT id FROM (SELECT id, MATCH(email, first_name, last_name) AGAINST (:phrase IN BOOLEAN MODE) AS score "
+            "FROM users WHERE MATCH(email, first_name, last_name) AGAINST (:phrase IN BOOLEAN MODE) LIMIT :window) AS hits "
+            "ORDER BY score DESC LIMIT :limit"
+        ), params)
+    else:
+        pattern = f"%{term}%"
+        rows = db.session.query(User.id).filter(db.or_(
+            User.email_lower.like(pattern), User.first_name_lower.like(pattern), User.last_name_lower.like(pattern)
+        )).limit(limit + len(exclude))
+    return [row_id for (row_id,) in rows if row_id not in exclude][:limit]
+
+
+def ranked_user_ids(search, limit=None):
+    """
+    Ranked ids of users matching `search` by email or name.
+
+    Returns:
+        list of user ids, best match first, at most `limit` (default USER_SEARCH_MAX_RESULTS)
+    """
+    term = ' '.join(search.split()).lower()
+    if not term:
+        return []
+    limit = limit or current_app.config.get('USER_SEARCH_MAX_RESULTS', 200)
+
+    ranked, seen = [], set()
+
+    def take(ids):
+        for user_id in ids:
+            if user_id not in seen and len(ranked) < limit:
+                seen.add(user_id)
+                ranked.append(user_id)
+
+    stages = (
+        User.email_lower == term,
+        _prefix_filter(User.email_lower, term),
+        db.or_(_prefix_filter(User.first_name_lower, term), _prefix_filter(User.last_name_lower, term)),
+    )
+    for criterion in stages:
+        if len(ranked) >= limit:
+            break
+        take(user_id for (user_id,) in db.session.query(User.id).filter(criterion).limit(limit))
+
+    if len(ranked) < limit and len(term) >= current_app.config.get('USER_SEARCH_MIN_SUBSTRING', 3):
+        take(_fulltext_ids(term, seen, limit - len(ranked)))
+
+    return ranked
+
+
+def load_users(user_ids):
+    """User rows for `user_ids`, in the same order"""
+    if not user_ids:
+        return []
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids))}
+    return [users[user_id] for user_id in user_ids if user_id in users]
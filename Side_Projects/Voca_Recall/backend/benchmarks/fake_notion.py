@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Notion API used by the load-test harness.
+
+Serves synthetic vocabulary databases of configurable size for every database
+id it is asked about, so no network access or real Notion workspace is needed.
+Point the app at it with NOTION_API_BASE_URL=http://127.0.0.1:<port>.
+
+Usage:
+    python -m benchmarks.fake_notion --port 8765 --items 500 --latency-ms 80
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATABASE_PATH = re.compile(r'^/v1/databases/([^/]+)$')
+QUERY_PATH = re.compile(r'^/v1/databases/([^/]+)/query$')
+
+PROPERTIES = {
+    'Word': {'id': 'title', 'type': 'title', 'title': {}},
+    'Meaning': {'id': 'mean', 'type': 'rich_text', 'rich_text': {}},
+    'Sentence': {'id': 'sent', 'type': 'rich_text', 'rich_text': {}},
+    'Tags': {'id': 'tags', 'type': 'multi_select', 'multi_select': {}},
+}
+
+BASE_TIME = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _text(value):
+    return [{'type': 'text', 'plain_text': value, 'text': {'content': value}}]
+
+
+def make_page(database_id, index):
+    """Build one synthetic vocabulary page; content is deterministic per index"""
+    word = f"word{index}"
+    created = (BASE_TIME - timedelta(minutes=index)).isoformat().replace('+00:00', 'Z')
+    return {
+        'object': 'page',
+        'id': f"{database_id[:8]}-{index:012d}",
+        'created_time': created,
+        'last_edited_time': created,
+        'properties': {
+            'Word': {'id': 'title', 'type': 'title', 'title': _text(word)},
+            'Meaning': {'id': 'mean', 'type': 'rich_text', 'rich_text': _text(f"Synthetic meaning of {word}, long enough to look like a real definition.")},
+            'Sentence': {'id': 'sent', 'type': 'rich_text', 'rich_text': _text(f"The {word} appeared twice.\\nEveryone remembered the {word}.")},
+            'Tags': {'id': 'tags', 'type': 'multi_select', 'multi_select': [{'name': 'bench'}, {'name': f"group{index % 7}"}]},
+        },
+    }
+
+
+class FakeNotionStats:
+    """Thread-safe request counters exposed at GET /_stats"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.handler_ms = {}
+
+    def record(self, route, elapsed_ms):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.handler_ms[route] = self.handler_ms.get(route, 0.0) + elapsed_ms
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'handler_ms': {k: round(v, 2) for k, v in self.handler_ms.items()},
+            }
+
+
+def make_handler(items, latency_ms, stats):
+    class FakeNotionHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass  # keep benchmark output readable
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if not length:
+                return {}
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _simulate_latency(self):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+
+        def do_GET(self):
+            start_time = time.time()
+            if self.path == '/_stats':
+                self._send_json(200, stats.snapshot())
+                return
+
+            match = DATABASE_PATH.match(self.path)
+            if not match:
+                self._send_json(404, {'object': 'error', 'status': 404, 'code': 'object_not_found', 'message': 'Not found'})
+                return
+
+            self._simulate_latency()
+            self._send_json(200, {
+                'object': 'database',
+                'id': match.group(1),
+                'title': _text('Benchmark Vocabulary'),
+                'properties': PROPERTIES,
+                'last_edited_time': BASE_TIME.isoformat().replace('+00:00', 'Z'),
+            })
+            stats.record('databases.retrieve', (time.time() - start_time) * 1000)
+
+        def do_POST(self):
+            start_time = time.time()
+            body = self._read_json()
+
+            if self.path == '/v1/search':
+                self._simulate_latency()
+                self._send_json(200, {'object': 'list', 'results': [], 'has_more': False, 'next_cursor': None})
+                stats.record('search', (time.time() - start_time) * 1000)
+                return
+
+            match = QUERY_PATH.match(self.path)
+            if not match:
+                self._send_json(404, {'object': 'error', 'status': 404, 'code': 'object_not_found', 'message': 'Not found'})
+                return
+
+            database_id = match.group(1)
+            page_size = min(int(body.get('page_size') or 100), 100)
+            start = int(body.get('start_cursor') or 0)
+            end = min(start + page_size, items)
+
+            self._simulate_latency()
+            self._send_json(200, {
+                'object': 'list',
+                'results': [make_page(database_id, i) for i in range(start, end)],
+                'has_more': end < items,
+                'next_cursor': str(end) if end < items else None,
+            })
+            stats.record('databases.query', (time.time() - start_time) * 1000)
+
+    return FakeNotionHandler
+
+
+def start_fake_notion(port=0, items=200, latency_ms=0):
+    """Start the server on a daemon thread; returns (server, stats). Port 0 picks a free port."""
+    stats = FakeNotionStats()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(items, latency_ms, stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local fake Notion API for load tests')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--items', type=int, default=200, help='Pages per synthetic database')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Artificial delay per API call')
+    args = parser.parse_args()
+
+    server, _ = start_fake_notion(args.port, args.items, args.latency_ms)
+    print(f"Fake Notion API listening on http://127.0.0.1:{server.server_address[1]} ({args.items} items per database)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+End-to-end delivery load test.
+
+Starts the fake Notion API and the SMTP sink in-process, seeds N users/services
+into a dedicated database, then runs the real `scheduler.py` and a Celery
+worker as subprocesses until every seeded email has reached the sink. Nothing
+leaves the machine; only a local Redis is required.
+
+Usage:
+    python -m benchmarks.run_load_test --users 200 --concurrency 8 \\
+        --redis-url redis://localhost:6379/15 --notion-latency-ms 80
+
+Reports emails/min, dispatch lag percentiles (SMTP receive time minus the
+scheduled next_run_at) and per-stage timings parsed from the worker log.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.fake_notion import start_fake_notion
+from benchmarks.smtp_sink import start_smtp_sink
+
+# "Completed <stage> in 12.34ms" lines from log_function_call (DEBUG level, hence
+# the worker runs with --loglevel=debug)
+STAGE_PATTERN = re.compile(r'Completed (.+?) in ([\d.]+)ms')
+SUBJECT_SUFFIX = ' - Vocabulary Recall'
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        'count': len(values),
+        'p50': rounded(percentile(values, 50)),
+        'p95': rounded(percentile(values, 95)),
+        'p99': rounded(percentile(values, 99)),
+        'max': rounded(max(values) if values else None),
+    }
+
+
+class LogCollector:
+    """Tee a subprocess' output to a file while collecting per-stage timings"""
+
+    def __init__(self, process, log_path):
+        self.stages = {}
+        self.thread = threading.Thread(target=self._run, args=(process, log_path), daemon=True)
+        self.thread.start()
+
+    def _run(self, process, log_path):
+        with open(log_path, 'w') as log_file:
+            for line in process.stdout:
+                log_file.write(line)
+                match = STAGE_PATTERN.search(line)
+                if match:
+                    self.stages.setdefault(match.group(1), []).append(float(match.group(2)))
+
+
+def build_env(args, notion_port, smtp_port, database_url):
+    env = dict(os.environ)
+    env.update({
+        'FLASK_ENV': 'development',  # DEBUG logging, needed for per-stage timings
+        'DATABASE_URL': database_url,
+        'REDIS_URL': args.redis_url,
+        'NOTION_API_BASE_URL': f"http://127.0.0.1:{notion_port}",
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_USER': 'bench-sender@example.com',
+        'SMTP_PASSWORD': 'bench-sender-password',
+        'SMTP_USE_TLS': 'false',
+        'PYTHONUNBUFFERED': '1',
+    })
+    return env
+
+
+def spawn(command, env, log_path):
+    process = subprocess.Popen(
+        command, cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    return process, LogCollector(process, log_path)
+
+
+def stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end delivery load test')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--services-per-user', type=int, default=1)
+    parser.add_argument('--items', type=int, default=200, help='Pages per synthetic Notion database')
+    parser.add_argument('--vocabulary-count', type=int, default=10)
+    parser.add_argument('--notion-latency-ms', type=float, default=0)
+    parser.add_argument('--concurrency', type=int, default=4, help='Celery worker concurrency')
+    parser.add_argument('--start-delay', type=float, default=20, help='Seconds before the first send (worker warm-up)')
+    parser.add_argument('--spread', type=float, default=0, help='Seconds over which sends are spread (0 = one burst)')
+    parser.add_argument('--digest-mode', action='store_true',
+                        help='Seed digest-mode users: expect one combined email per user')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15',
+                        help='Use a dedicated Redis DB: the scheduler resets the schedule ZSET on start')
+    parser.add_argument('--database-url', help='Defaults to a throwaway SQLite file')
+    parser.add_argument('--workdir', help='Where logs, manifest and SQLite file go')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='voca-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    manifest_path = os.path.join(workdir, 'manifest.json')
+
+    notion_server, notion_stats = start_fake_notion(items=args.items, latency_ms=args.notion_latency_ms)
+    smtp_server, sink = start_smtp_sink()
+    env = build_env(args, notion_server.server_address[1], smtp_server.server_address[1], database_url)
+
+    print(f"Workdir: {workdir}", file=sys.stderr)
+    subprocess.run([
+        sys.executable, '-m', 'benchmarks.seed',
+        '--users', str(args.users),
+        '--services-per-user', str(args.services_per_user),
+        '--start-delay', str(args.start_delay),
+        '--spread', str(args.spread),
+        '--vocabulary-count', str(args.vocabulary_count),
+        '--manifest', manifest_path,
+    ] + (['--digest-mode'] if args.digest_mode else []), cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    # In digest mode each user's services go out as one email (if they fit in DIGEST_WINDOW_SECONDS)
+    expected = args.users if args.digest_mode and args.services_per_user > 1 else len(manifest)
+
+    worker_cmd = [
+        sys.executable, '-c',
+        "from app import create_app, celery; app = create_app(); app.app_context().push(); "
+        f"celery.worker_main(['worker', '--loglevel=debug', '--concurrency={args.concurrency}', '--without-gossip', '--without-mingle'])",
+    ]
+    worker, worker_log = spawn(worker_cmd, env, os.path.join(workdir, 'worker.log'))
+    scheduler, _ = spawn([sys.executable, 'scheduler.py'], env, os.path.join(workdir, 'scheduler.log'))
+
+    deadline = time.time() + args.start_delay + args.spread + args.timeout
+    try:
+        while sink.count() < expected and time.time() < deadline:
+            if worker.poll() is not None or scheduler.poll() is not None:
+                print('A benchmark subprocess exited early, see logs in workdir', file=sys.stderr)
+                break
+            time.sleep(0.5)
+    finally:
+        stop(scheduler)
+        stop(worker)
+        worker_log.thread.join(timeout=5)
+        notion_server.shutdown()
+        smtp_server.shutdown()
+
+    messages = [m for m in sink.snapshot() if m['subject'].endswith(SUBJECT_SUFFIX)]
+    lags_ms = []
+    for message in messages:
+        service_name = message['subject'][:-len(SUBJECT_SUFFIX)]
+        if service_name in manifest:
+            lags_ms.append((message['received_at'] - manifest[service_name]) * 1000)
+
+    first_due = min(manifest.values()) if manifest else None
+    last_received = max((m['received_at'] for m in messages), default=None)
+    elapsed = (last_received - first_due) if (first_due and last_received) else None
+
+    report = {
+        'expected': expected,
+        'delivered': len(messages),
+        'elapsed_seconds': round(elapsed, 2) if elapsed else None,
+        'emails_per_minute': round(len(messages) / elapsed * 60, 1) if elapsed and elapsed > 0 else None,
+        'dispatch_lag_ms': summarize(lags_ms),
+        'avg_message_bytes': round(sum(m['size'] for m in messages) / len(messages)) if messages else None,
+        'stage_ms': {stage: summarize(values) for stage, values in worker_log.stages.items()},
+        'notion': notion_stats.snapshot(),
+        'smtp_connections': sink.connections,
+        'workdir': workdir,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Delivered {report['delivered']}/{expected} emails in {report['elapsed_seconds']}s "
+              f"-> {report['emails_per_minute']} emails/min")
+        lag = report['dispatch_lag_ms']
+        print(f"Dispatch lag ms: p50={lag['p50']} p95={lag['p95']} p99={lag['p99']} max={lag['max']}")
+        print(f"Average message size: {report['avg_message_bytes']} bytes")
+        for stage, summary in sorted(report['stage_ms'].items()):
+            print(f"  {stage:<30} n={summary['count']:<6} p50={summary['p50']}ms p95={summary['p95']}ms max={summary['max']}ms")
+        print(f"Notion calls: {report['notion']['requests']}")
+
+    sys.exit(0 if report['delivered'] >= expected else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Seed synthetic users, Notion tokens/databases and email services for load tests.
+
+Every seeded service fires once inside a window starting --start-delay seconds
+from now and lasting --spread seconds. A manifest mapping service name to its
+scheduled UTC timestamp is written so the driver can compute dispatch lag.
+
+Usage:
+    python -m benchmarks.seed --users 100 --services-per-user 2 --manifest /tmp/bench.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytz
+from app import create_app, db
+from app.models import User, NotionToken, NotionDatabase, EmailService
+
+BENCH_EMAIL_DOMAIN = 'bench.local'
+COLUMN_SELECTION = [
+    {'name': 'Word', 'type': 'title'},
+    {'name': 'Meaning', 'type': 'rich_text'},
+    {'name': 'Sentence', 'type': 'rich_text'},
+    {'name': 'Tags', 'type': 'multi_select'},
+]
+
+
+def clear_bench_data():
+    """Delete previously seeded benchmark users (cascades to their rows)"""
+    users = User.query.filter(User.email.like(f"%@{BENCH_EMAIL_DOMAIN}")).all()
+    for user in users:
+        db.session.delete(user)
+    db.session.commit()
+    return len(users)
+
+
+def seed(users, services_per_user, start_delay, spread, vocabulary_count, email_client, digest_mode=False):
+    now = datetime.utcnow()
+    total = users * services_per_user
+    manifest = {}
+
+    # One bcrypt hash shared by all users keeps seeding fast
+    password_hash = None
+
+    for u in range(users):
+        user = User(
+            email=f"bench-{u}@{BENCH_EMAIL_DOMAIN}",
+            first_name='Bench',
+            last_name=str(u),
+            digest_mode=digest_mode,
+        )
+        if password_hash is None:
+            user.set_password('bench-password')
+            password_hash = user.password_hash
+        else:
+            user.password_hash = password_hash
+        db.session.add(user)
+        db.session.flush()
+
+        token = NotionToken(user_id=user.id, token=f"secret_bench_{u}", token_name='bench')
+        db.session.add(token)
+        db.session.flush()
+
+        database_id = f"{u:032x}"
+        database = NotionDatabase(
+            user_id=user.id,
+            token_id=token.id,
+            database_id=database_id,
+            database_name='Benchmark Vocabulary',
+            database_url=f"https://www.notion.so/{database_id}",
+        )
+        db.session.add(database)
+        db.session.flush()
+
+        for s in range(services_per_user):
+            index = u * services_per_user + s
+            offset = start_delay + (spread * index / total if total else 0)
+            next_run = now + timedelta(seconds=offset)
+            service_name = f"bench-u{u}-s{s}"
+            service = EmailService(
+                user_id=user.id,
+                database_id=database.id,
+                service_name=service_name,
+                send_time=next_run.time(),
+                timezone='UTC',
+                frequency='daily',
+                vocabulary_count=vocabulary_count,
+                selection_method='random',
+                email_client=email_client,
+                column_selection=COLUMN_SELECTION,
+                next_run_at=next_run,
+                status='PENDING',
+            )
+            db.session.add(service)
+            manifest[service_name] = next_run.replace(tzinfo=pytz.UTC).timestamp()
+
+        # Commit per user so large seeds don't hold one giant transaction
+        db.session.commit()
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed synthetic data for the delivery load test')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--services-per-user', type=int, default=1)
+    parser.add_argument('--start-delay', type=float, default=15, help='Seconds until the first service fires')
+    parser.add_argument('--spread', type=float, default=30, help='Seconds over which fire times are spread')
+    parser.add_argument('--vocabulary-count', type=int, default=10)
+    parser.add_argument('--email-client', default='apple_mail')
+    parser.add_argument('--digest-mode', action='store_true', help='Seed users with digest mode enabled')
+    parser.add_argument('--manifest', required=True, help='Where to write {service_name: scheduled_ts}')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        removed = clear_bench_data()
+        if removed:
+            print(f"Removed {removed} previously seeded users")
+        manifest = seed(args.users, args.services_per_user, args.start_delay, args.spread,
+                        args.vocabulary_count, args.email_client, args.digest_mode)
+
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f)
+    print(f"Seeded {args.users} users / {len(manifest)} services, manifest written to {args.manifest}")
+
+
+if __name__ == '__main__':
+    main()
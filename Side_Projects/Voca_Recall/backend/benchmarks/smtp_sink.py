@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink for the load-test harness.
+
+Speaks just enough SMTP for smtplib (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA,
+RSET, NOOP, QUIT), accepts any credentials and records every message instead of
+delivering it. Run the app with SMTP_USE_TLS=false against it.
+
+Usage:
+    python -m benchmarks.smtp_sink --port 2525
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.header import decode_header, make_header
+
+
+class SinkStore:
+    """Received messages: (received_at, subject, recipient, size_bytes, session_ms)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+
+    def add(self, received_at, subject, recipient, size, session_ms):
+        with self.lock:
+            self.messages.append({
+                'received_at': received_at,
+                'subject': subject,
+                'to': recipient,
+                'size': size,
+                'session_ms': session_ms,
+            })
+
+    def count(self):
+        with self.lock:
+            return len(self.messages)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.messages)
+
+
+def _subject(raw):
+    message = message_from_bytes(raw)
+    return str(make_header(decode_header(message.get('Subject', ''))))
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    store = None  # set by start_smtp_sink
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        with self.store.lock:
+            self.store.connections += 1
+        session_start = time.time()
+        recipient = None
+        self._reply('220 smtp-sink ready')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b"250-smtp-sink\r\n250-8BITMIME\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 52428800\r\n")
+            elif verb == 'AUTH':
+                parts = command.split()
+                if len(parts) >= 2 and parts[1].upper() == 'LOGIN':
+                    # Username/password prompts; whatever comes back is accepted
+                    if len(parts) == 2:
+                        self._reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self._reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self._reply('235 2.7.0 Authentication successful')
+            elif verb == 'MAIL':
+                recipient = None
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command.split(':', 1)[-1].strip().strip('<>')
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                chunks = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    chunks.append(data_line)
+                raw = b''.join(chunks)
+                self.store.add(time.time(), _subject(raw), recipient, len(raw), (time.time() - session_start) * 1000)
+                self._reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class ThreadingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_smtp_sink(port=0):
+    """Start the sink on a daemon thread; returns (server, store). Port 0 picks a free port."""
+    store = SinkStore()
+    handler = type('BoundSMTPSinkHandler', (SMTPSinkHandler,), {'store': store})
+    server = ThreadingSMTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink for load tests')
+    parser.add_argument('--port', type=int, default=2525)
+    args = parser.parse_args()
+
+    server, store = start_smtp_sink(args.port)
+    print(f"SMTP sink listening on 127.0.0.1:{server.server_address[1]}")
+    try:
+        last = 0
+        while True:
+            time.sleep(5)
+            current = store.count()
+            if current != last:
+                print(f"{current} messages received")
+                last = current
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
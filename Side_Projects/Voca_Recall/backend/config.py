@@ -8,22 +8,183 @@ class Config:
     """Base configuration class"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Process role (web, worker, scheduler) picks the DB pool defaults in app/db_routing.py
+    PROCESS_ROLE = os.environ.get('PROCESS_ROLE', 'web')
+    # Connection pool per process; unset sizes use the role defaults
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_POOL_TIMEOUT_SECONDS = int(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10))
+    # Recycle connections before MySQL's wait_timeout (or a proxy) drops them; pre-ping catches the rest
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # Optional read replica for GET requests; a user's reads stay on the primary
+    # for DB_REPLICA_PIN_SECONDS after they write
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+    DB_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     
     # Notion API
     NOTION_API_KEY = os.environ.get('NOTION_API_KEY')
+    # Override only to point at a local Notion stand-in (see benchmarks/)
+    NOTION_API_BASE_URL = os.environ.get('NOTION_API_BASE_URL', 'https://api.notion.com')
+    # Seconds a cached Notion database schema (title + properties) stays valid
+    NOTION_SCHEMA_CACHE_TTL = int(os.environ.get('NOTION_SCHEMA_CACHE_TTL', 3600))
+    # Short-lived shared cache of vocabulary query results (0 disables); concurrent
+    # sends on one database wait up to NOTION_QUERY_LOCK_TIMEOUT for the in-flight fetch
+    NOTION_QUERY_CACHE_TTL = int(os.environ.get('NOTION_QUERY_CACHE_TTL', 30))
+    NOTION_QUERY_LOCK_TIMEOUT = float(os.environ.get('NOTION_QUERY_LOCK_TIMEOUT', 15))
+    # Per-process LRU of usable Notion tokens (0 disables); entries expire after
+    # IDLE_SECONDS unused or MAX_AGE_SECONDS in total, and edits invalidate them via pub/sub
+    NOTION_TOKEN_CACHE_SIZE = int(os.environ.get('NOTION_TOKEN_CACHE_SIZE', 1024))
+    NOTION_TOKEN_CACHE_IDLE_SECONDS = int(os.environ.get('NOTION_TOKEN_CACHE_IDLE_SECONDS', 900))
+    NOTION_TOKEN_CACHE_MAX_AGE_SECONDS = int(os.environ.get('NOTION_TOKEN_CACHE_MAX_AGE_SECONDS', 3600))
+    # Seconds a missing/inactive token, or one Notion rejected, is remembered as unusable
+    NOTION_TOKEN_NEGATIVE_TTL_SECONDS = int(os.environ.get('NOTION_TOKEN_NEGATIVE_TTL_SECONDS', 300))
+    # Notion calls in flight at once during a bulk database health check (two per
+    # database, so 40 checks 20 databases in one round)
+    NOTION_HEALTH_CHECK_CONCURRENCY = int(os.environ.get('NOTION_HEALTH_CHECK_CONCURRENCY', 40))
+    # Email previews render from a cached sample of each database's newest pages;
+    # a refresh re-reads Notion at most once per PREVIEW_SAMPLE_MIN_REFRESH_SECONDS
+    PREVIEW_SAMPLE_SIZE = int(os.environ.get('PREVIEW_SAMPLE_SIZE', 20))
+    PREVIEW_SAMPLE_TTL = int(os.environ.get('PREVIEW_SAMPLE_TTL', 86400))
+    PREVIEW_SAMPLE_MIN_REFRESH_SECONDS = int(os.environ.get('PREVIEW_SAMPLE_MIN_REFRESH_SECONDS', 10))
+    
+    # Password hashing: bcrypt work factor (hashes at another cost are upgraded on login)
+    # and the per-process pool that runs it off the request thread
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 8))
+    PASSWORD_HASH_WAIT_SECONDS = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS', 2))
+    
+    # Failed-login throttling (per client IP and per account, counted in Redis)
+    LOGIN_THROTTLE_WINDOW_SECONDS = int(os.environ.get('LOGIN_THROTTLE_WINDOW_SECONDS', 900))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 20))
+    LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.environ.get('LOGIN_MAX_FAILURES_PER_ACCOUNT', 5))
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted (0 = none)
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+    
+    # gzip JSON/text responses of at least COMPRESS_MIN_BYTES (disable if the proxy compresses)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 5))
+    
+    # Sliding-window API rate limits ("N/second|minute|hour|day"), per user or client IP.
+    # Notion/SMTP-backed endpoints have their own buckets plus a cap shared by all users
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '300/minute')
+    RATE_LIMIT_BUCKETS = {
+        'send_test': os.environ.get('RATE_LIMIT_SEND_TEST', '5/minute'),
+        'notion': os.environ.get('RATE_LIMIT_NOTION', '30/minute'),
+        'bulk': os.environ.get('RATE_LIMIT_BULK', '10/hour'),
+    }
+    RATE_LIMIT_GLOBAL_BUCKETS = {
+        'send_test': os.environ.get('RATE_LIMIT_SEND_TEST_GLOBAL', '120/minute'),
+        'notion': os.environ.get('RATE_LIMIT_NOTION_GLOBAL', '600/minute'),
+    }
+    # Per-route buckets, e.g. "user.get_stats=60/minute,admin.list_users=30/minute"
+    RATE_LIMIT_ROUTES = os.environ.get('RATE_LIMIT_ROUTES', '')
+    # Per-role limit multipliers, e.g. "admin=10"
+    RATE_LIMIT_ROLE_MULTIPLIERS = os.environ.get('RATE_LIMIT_ROLE_MULTIPLIERS', 'admin=10')
     
     # Email configuration
     SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
     SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
     SMTP_USER = os.environ.get('SMTP_USER')
     SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
-    SMTP_USE_TLS = True
+    SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'true').lower() == 'true'
+    # Quotas for the SMTP_USER account above (0 = no limit); Gmail allows ~500/day, Workspace ~2000/day
+    SMTP_RATE_PER_MINUTE = int(os.environ.get('SMTP_RATE_PER_MINUTE', 0))
+    SMTP_DAILY_CAP = int(os.environ.get('SMTP_DAILY_CAP', 0))
+    # Sender pool as a JSON list of accounts, replacing the single SMTP_USER account, e.g.
+    # [{"name": "relay-1", "host": "smtp.example.com", "port": 587, "user": "...", "password": "...",
+    #   "from": "no-reply@example.com", "weight": 2, "rate_per_minute": 30, "daily_cap": 2000}]
+    SMTP_ACCOUNTS = os.environ.get('SMTP_ACCOUNTS')
+    # Account selection: least_loaded (fewest sends today per unit of weight) or weighted (round-robin)
+    SMTP_ROUTING = os.environ.get('SMTP_ROUTING', 'least_loaded')
+    # How long an account is skipped after throttling / connection errors, and after auth failures
+    SMTP_THROTTLE_COOLDOWN_SECONDS = int(os.environ.get('SMTP_THROTTLE_COOLDOWN_SECONDS', 300))
+    SMTP_AUTH_COOLDOWN_SECONDS = int(os.environ.get('SMTP_AUTH_COOLDOWN_SECONDS', 3600))
+    SMTP_TIMEOUT_SECONDS = float(os.environ.get('SMTP_TIMEOUT_SECONDS', 30))
+    # Hoist repeated inline styles into classes and minify email HTML before sending
+    EMAIL_COMPACT_ENABLED = os.environ.get('EMAIL_COMPACT_ENABLED', 'true').lower() == 'true'
     
     # Redis for Celery
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    # Per-process connection pool (one pool per gunicorn / Celery worker process)
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 20))
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5))
+    # Seconds a thread waits for a free pooled connection before raising
+    REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 2))
+    
+    # Celery routing (see app/celery_config.py): per-task queue overrides, e.g. "send_digest_task=digest",
+    # the queues this worker consumes (unset = all), and per-queue rate limits, e.g. "email=600/m"
+    CELERY_DEFAULT_QUEUE = os.environ.get('CELERY_DEFAULT_QUEUE', 'celery')
+    CELERY_TASK_QUEUES = os.environ.get('CELERY_TASK_QUEUES', '')
+    CELERY_WORKER_QUEUES = os.environ.get('CELERY_WORKER_QUEUES', '')
+    CELERY_QUEUE_RATE_LIMITS = os.environ.get('CELERY_QUEUE_RATE_LIMITS', '')
+    # Tasks whose return values are never read; their results are not stored
+    CELERY_IGNORE_RESULT_TASKS = os.environ.get(
+        'CELERY_IGNORE_RESULT_TASKS', 'deliver_outbox_batch,run_maintenance_task,reload_email_schedules'
+    )
+    # Worker behaviour: tasks reserved per process, ack after completion, and Redis redelivery
+    # timeout for unacknowledged tasks (keep above the longest task)
+    CELERY_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1))
+    CELERY_ACKS_LATE = os.environ.get('CELERY_ACKS_LATE', 'true').lower() == 'true'
+    CELERY_VISIBILITY_TIMEOUT = int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 3600))
+    # Processes per worker (unset = CPU count) and tasks per process before it is replaced (0 = never)
+    CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', 0)) or None
+    CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.environ.get('CELERY_WORKER_MAX_TASKS_PER_CHILD', 0)) or None
+    
+    # Prometheus metrics: buffered per process, flushed to Redis every few seconds, and
+    # served by one target only: 'web' (GET /metrics) or 'scheduler' (on METRICS_PORT)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN')
+    METRICS_EXPORTER = os.environ.get('METRICS_EXPORTER', 'web')
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 0)) or None
+    METRICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('METRICS_FLUSH_INTERVAL_SECONDS', 5))
+    
+    # Random selection skips items a service sent within this many days (index capped at RECENT_ITEMS_MAX per service)
+    RECENT_ITEMS_WINDOW_DAYS = int(os.environ.get('RECENT_ITEMS_WINDOW_DAYS', 7))
+    RECENT_ITEMS_MAX = int(os.environ.get('RECENT_ITEMS_MAX', 1000))
+    # Spaced repetition copies the whole Notion database into vocabulary_reviews, this many pages of 100 per send
+    SPACED_REPETITION_SEED_PAGES = int(os.environ.get('SPACED_REPETITION_SEED_PAGES', 5))
+    
+    # Digest mode: a user's services due within this many seconds of each other go out as one email
+    DIGEST_WINDOW_SECONDS = int(os.environ.get('DIGEST_WINDOW_SECONDS', 300))
+    
+    # Delivery outbox: rows relayed per scheduler tick, rows per worker task, and how long a
+    # queued/sending row is owned before it is relayed again (must exceed one batch's send time)
+    OUTBOX_RELAY_LIMIT = int(os.environ.get('OUTBOX_RELAY_LIMIT', 2000))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 25))
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 900))
+    # Failed sends are retried after OUTBOX_RETRY_BACKOFF_SECONDS * 2^(attempt - 1)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+    OUTBOX_RETRY_BACKOFF_SECONDS = int(os.environ.get('OUTBOX_RETRY_BACKOFF_SECONDS', 60))
+    
+    # Delivery SLO: an email counts as on time if it leaves within this many seconds of next_run_at
+    DELIVERY_ON_TIME_SECONDS = int(os.environ.get('DELIVERY_ON_TIME_SECONDS', 60))
+    
+    # Admin user search: ranked matches kept per query, full-text hits scored for
+    # relevance, and the shortest fragment that triggers a substring search
+    USER_SEARCH_MAX_RESULTS = int(os.environ.get('USER_SEARCH_MAX_RESULTS', 200))
+    USER_SEARCH_RANK_WINDOW = int(os.environ.get('USER_SEARCH_RANK_WINDOW', 1000))
+    USER_SEARCH_MIN_SUBSTRING = int(os.environ.get('USER_SEARCH_MIN_SUBSTRING', 3))
+    
+    # Max services accepted by one POST /api/email-services/bulk request
+    BULK_SERVICE_MAX_ROWS = int(os.environ.get('BULK_SERVICE_MAX_ROWS', 1000))
+    
+    # Background cleanup of expired/orphaned rows (enqueued by the scheduler)
+    MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get('MAINTENANCE_INTERVAL_SECONDS', 3600))
+    MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', 500))
+    MAINTENANCE_MAX_BATCHES = int(os.environ.get('MAINTENANCE_MAX_BATCHES', 100))
+    MAINTENANCE_BATCH_PAUSE_SECONDS = float(os.environ.get('MAINTENANCE_BATCH_PAUSE_SECONDS', 0.1))
+    NOTION_TOKEN_INACTIVE_RETENTION_DAYS = int(os.environ.get('NOTION_TOKEN_INACTIVE_RETENTION_DAYS', 30))
+    # 0 keeps email logs forever; otherwise logs older than this are deleted
+    EMAIL_LOG_RETENTION_DAYS = int(os.environ.get('EMAIL_LOG_RETENTION_DAYS', 0))
+    # Sent/failed/cancelled outbox rows are kept this long (they dedupe replayed schedule ticks)
+    OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
     
     # Frontend URL for email links
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
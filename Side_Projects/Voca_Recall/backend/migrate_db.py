@@ -47,8 +47,136 @@ def migrate():
             except Exception as e:
                 logger.warning(f"Could not add email_client (might exist): {e}")
 
+            # 5. Dispatch-lag tracking on email_logs
+            for column, ddl in (
+                ('service_id', 'INTEGER'),
+                ('scheduled_at', 'DATETIME'),
+                ('stage_timings', 'JSON'),
+            ):
+                try:
+                    logger.info(f"Attempting to add email_logs.{column} column...")
+                    conn.execute(text(f"ALTER TABLE email_logs ADD COLUMN {column} {ddl}"))
+                    logger.info(f"Added column email_logs.{column}")
+                except Exception as e:
+                    logger.warning(f"Could not add email_logs.{column} (might exist): {e}")
+
+            for index, column in (
+                ('ix_email_logs_service_id', 'service_id'),
+                ('ix_email_logs_scheduled_at', 'scheduled_at'),
+            ):
+                try:
+                    conn.execute(text(f"CREATE INDEX {index} ON email_logs ({column})"))
+                    logger.info(f"Created index {index}")
+                except Exception as e:
+                    logger.warning(f"Could not create index {index} (might exist): {e}")
+
+            # 5b. Stored dispatch lag, and the covering index the delivery SLO report aggregates over
+            try:
+                logger.info("Attempting to add email_logs.lag_ms column...")
+                conn.execute(text("ALTER TABLE email_logs ADD COLUMN lag_ms INTEGER"))
+                logger.info("Added column email_logs.lag_ms")
+            except Exception as e:
+                logger.warning(f"Could not add email_logs.lag_ms (might exist): {e}")
+            try:
+                conn.execute(text("CREATE INDEX ix_email_logs_slo ON email_logs (scheduled_at, status, lag_ms)"))
+                logger.info("Created index ix_email_logs_slo")
+            except Exception as e:
+                logger.warning(f"Could not create index ix_email_logs_slo (might exist): {e}")
+
+            if conn.dialect.name == 'sqlite':
+                lag = "CAST(ROUND((julianday(sent_at) - julianday(scheduled_at)) * 86400000) AS INTEGER)"
+            else:
+                lag = "TIMESTAMPDIFF(MICROSECOND, scheduled_at, sent_at) DIV 1000"
+            conn.execute(text(
+                f"UPDATE email_logs SET lag_ms = {lag} "
+                "WHERE lag_ms IS NULL AND scheduled_at IS NOT NULL AND sent_at IS NOT NULL"
+            ))
+            logger.info("Backfilled email_logs.lag_ms")
+
+            # 6. Per-user digest mode
+            try:
+                logger.info("Attempting to add users.digest_mode column...")
+                conn.execute(text("ALTER TABLE users ADD COLUMN digest_mode BOOLEAN DEFAULT FALSE"))
+                logger.info("Added column users.digest_mode")
+            except Exception as e:
+                logger.warning(f"Could not add users.digest_mode (might exist): {e}")
+
+            # 7. Custom cron schedules
+            try:
+                logger.info("Attempting to add email_services.cron_expression column...")
+                conn.execute(text("ALTER TABLE email_services ADD COLUMN cron_expression VARCHAR(100)"))
+                logger.info("Added column email_services.cron_expression")
+            except Exception as e:
+                logger.warning(f"Could not add email_services.cron_expression (might exist): {e}")
+
+            # 7b. Every-N-days schedules
+            for column, ddl in (
+                ('interval_days', 'INTEGER'),
+                ('interval_anchor', 'DATE'),
+            ):
+                try:
+                    logger.info(f"Attempting to add email_services.{column} column...")
+                    conn.execute(text(f"ALTER TABLE email_services ADD COLUMN {column} {ddl}"))
+                    logger.info(f"Added column email_services.{column}")
+                except Exception as e:
+                    logger.warning(f"Could not add email_services.{column} (might exist): {e}")
+
+            # 7c. Spaced-repetition seeding progress
+            for column, ddl in (
+                ('review_cursor', 'VARCHAR(100)'),
+                ('review_seeded', 'BOOLEAN DEFAULT FALSE'),
+            ):
+                try:
+                    logger.info(f"Attempting to add email_services.{column} column...")
+                    conn.execute(text(f"ALTER TABLE email_services ADD COLUMN {column} {ddl}"))
+                    logger.info(f"Added column email_services.{column}")
+                except Exception as e:
+                    logger.warning(f"Could not add email_services.{column} (might exist): {e}")
+
+            # 8. Indexes used by the maintenance task's batched deletes
+            for index, table, columns in (
+                ('ix_password_reset_tokens_expires_at', 'password_reset_tokens', 'expires_at'),
+                ('ix_notion_tokens_active_updated', 'notion_tokens', 'is_active, updated_at'),
+                ('ix_email_logs_user_id', 'email_logs', 'user_id'),
+                ('ix_email_logs_sent_at', 'email_logs', 'sent_at'),
+            ):
+                try:
+                    conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+                    logger.info(f"Created index {index}")
+                except Exception as e:
+                    logger.warning(f"Could not create index {index} (might exist): {e}")
+
+            # 9. Lowercase shadow columns for indexed admin user search
+            for column, ddl in (
+                ('email_lower', 'VARCHAR(120)'),
+                ('first_name_lower', 'VARCHAR(50)'),
+                ('last_name_lower', 'VARCHAR(50)'),
+            ):
+                try:
+                    logger.info(f"Attempting to add users.{column} column...")
+                    conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} {ddl}"))
+                    logger.info(f"Added column users.{column}")
+                except Exception as e:
+                    logger.warning(f"Could not add users.{column} (might exist): {e}")
+                try:
+                    conn.execute(text(f"CREATE INDEX ix_users_{column} ON users ({column})"))
+                    logger.info(f"Created index ix_users_{column}")
+                except Exception as e:
+                    logger.warning(f"Could not create index ix_users_{column} (might exist): {e}")
+
+            conn.execute(text(
+                "UPDATE users SET email_lower = LOWER(TRIM(email)), "
+                "first_name_lower = LOWER(TRIM(first_name)), last_name_lower = LOWER(TRIM(last_name)) "
+                "WHERE email_lower IS NULL"
+            ))
+            logger.info("Backfilled lowercase search columns")
+
             conn.commit()
-            logger.info("Migration completed.")
+
+        # Full-text index (MySQL FULLTEXT / SQLite FTS5) over the same fields
+        from app.user_search import ensure_search_index
+        ensure_search_index()
+        logger.info("Migration completed.")
 
 if __name__ == "__main__":
     migrate()
@@ -1,11 +1,14 @@
 import time
 import logging
 import pytz
+import numpy as np
 from datetime import datetime
 from app import create_app, db
-from app.models import EmailService
-from app.email import send_email_service_task
+from app.models import EmailService, User
+from app.outbox import enqueue_deliveries, relay_outbox
+from app.maintenance import run_maintenance_task
 from app.redis_utils import get_redis_client, SCHEDULE_KEY
+from app.metrics import start_metrics_server
 
 # Configure logging
 logging.basicConfig(
@@ -14,13 +17,109 @@ logging.basicConfig(
 )
 logger = logging.getLogger('scheduler')
 
-app = create_app()
+app = create_app(process_role='scheduler')
+
+def claim_tasks(redis_client, entries):
+    """
+    ZREM each entry; only the scheduler that removes it owns it.
+    
+    Returns:
+        {service_id: scheduled_ts} for the entries this process claimed
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for service_id_bytes, _ in entries:
+        pipeline.zrem(SCHEDULE_KEY, service_id_bytes)
+    removed = pipeline.execute()
+    # Another scheduler instance may have picked some up (rare in this setup)
+    return {
+        int(service_id_bytes): scheduled_ts
+        for (service_id_bytes, scheduled_ts), was_removed in zip(entries, removed)
+        if was_removed
+    }
+
+
+def collect_digests(redis_client, claimed, services, now_ts):
+    """
+    Group claimed services of digest-mode users, adding their other services
+    due within DIGEST_WINDOW_SECONDS (those are claimed here as well).
+    
+    Returns:
+        {user_id: [[service_id, scheduled_ts], ...]}
+    """
+    user_ids = {service.user_id for service in services.values()}
+    if not user_ids:
+        return {}
+    digest_users = {
+        user_id for (user_id,) in db.session.query(User.id)
+        .filter(User.id.in_(list(user_ids)), User.digest_mode.is_(True))
+    }
+    if not digest_users:
+        return {}
+    
+    digests = {}
+    for service_id, scheduled_ts in claimed.items():
+        service = services.get(service_id)
+        if service and service.user_id in digest_users:
+            digests.setdefault(service.user_id, []).append([service_id, scheduled_ts])
+    
+    window = app.config.get('DIGEST_WINDOW_SECONDS', 300)
+    upcoming = redis_client.zrangebyscore(SCHEDULE_KEY, f"({now_ts}", now_ts + window, withscores=True)
+    if upcoming:
+        upcoming_scores = {int(member): score for member, score in upcoming}
+        siblings = EmailService.query.filter(
+            EmailService.id.in_(list(upcoming_scores)),
+            EmailService.user_id.in_(list(digests))
+        ).all()
+        early = claim_tasks(redis_client, [(str(service.id), upcoming_scores[service.id]) for service in siblings])
+        for service in siblings:
+            if service.id in early:
+                services[service.id] = service
+                claimed[service.id] = early[service.id]
+                digests[service.user_id].append([service.id, early[service.id]])
+    
+    return digests
+
+
+def reschedule(redis_client, claimed, services, now_ts):
+    """Compute each claimed service's next run, commit it (with any pending outbox rows) and put it back in the ZSET"""
+    active = []
+    for service_id, scheduled_ts in claimed.items():
+        service = services.get(service_id)
+        if service and service.is_active:
+            active.append((service, scheduled_ts))
+        else:
+            logger.info(f"Service {service_id} stopped/removed (Active: {getattr(service, 'is_active', False)})")
+
+    # Next run relative to NOW (or to the fire time of services pulled into a digest early), in one batch
+    next_runs = {}
+    scheduled = np.fromiter((scheduled_ts for _, scheduled_ts in active), dtype='f8', count=len(active))
+    new_next_runs = EmailService.calculate_next_runs(
+        [service for service, _ in active],
+        np.maximum(now_ts, scheduled),
+    )
+    for (service, _), new_next_run in zip(active, new_next_runs):
+        service.next_run_at = new_next_run
+        next_runs[service.id] = new_next_run
+    
+    # Update DB, then add back to Redis with the new scores
+    db.session.commit()
+    if next_runs:
+        redis_client.zadd(SCHEDULE_KEY, {
+            str(service_id): next_run.replace(tzinfo=pytz.UTC).timestamp()
+            for service_id, next_run in next_runs.items()
+        })
+    for service_id, next_run in next_runs.items():
+        logger.info(f"Rescheduled service {service_id} to {next_run}")
+
 
 def run_scheduler():
     logger.info("Starting Email Service Scheduler (Redis ZSET)...")
     
     redis_client = None
     
+    if app.config.get('METRICS_PORT') and app.config.get('METRICS_EXPORTER') == 'scheduler':
+        start_metrics_server(app, app.config['METRICS_PORT'])
+    
     with app.app_context():
         # Redis connection setup
         while redis_client is None:
@@ -47,12 +146,13 @@ def run_scheduler():
             count = 0
             now = datetime.utcnow().replace(tzinfo=pytz.UTC)
             
+            # If next_run_at is missing, calculate it (all missing ones in one batch)
+            unscheduled = [service for service in active_services if not service.next_run_at]
+            for service, next_run in zip(unscheduled, EmailService.calculate_next_runs(unscheduled, now)):
+                service.next_run_at = next_run
+                db.session.add(service)
+
             for service in active_services:
-                # If next_run_at is missing, calculate it
-                if not service.next_run_at:
-                    service.next_run_at = service.calculate_next_run(now)
-                    db.session.add(service)
-                
                 # Ensure next_run_at is aware (UTC)
                 next_run = service.next_run_at
                 if next_run.tzinfo is None:
@@ -70,6 +170,7 @@ def run_scheduler():
             # Continue to loop, maybe Redis serves old data or eventually recovers
 
     # 2. Polling Loop
+    last_maintenance = None
     while True:
         try:
             # We don't strictly need app context for Redis ops, but we need it for DB ops (rescheduling)
@@ -77,43 +178,41 @@ def run_scheduler():
                 now_ts = time.time()
                 
                 # Fetch tasks due (score <= now)
-                # Redis zrangebyscore returns list of members (bytes)
-                ready_tasks = redis_client.zrangebyscore(SCHEDULE_KEY, '-inf', now_ts)
+                # Redis zrangebyscore returns (member bytes, score) pairs; the score is
+                # the scheduled fire time, passed on so the worker can record dispatch lag
+                ready_tasks = redis_client.zrangebyscore(SCHEDULE_KEY, '-inf', now_ts, withscores=True)
                 
                 if ready_tasks:
                     logger.info(f"Found {len(ready_tasks)} due tasks")
                     
-                    for service_id_bytes in ready_tasks:
-                        service_id = int(service_id_bytes)
-                        
-                        # Atomicity Attempt: Remove it. If we remove it, we own it.
-                        if redis_client.zrem(SCHEDULE_KEY, service_id_bytes) > 0:
-                            logger.info(f"Processing task for service {service_id}")
-                            
-                            # 1. Dispatch Task to Worker
-                            send_email_service_task.delay(service_id)
-                            
-                            # 2. Calculate Next Run & Re-schedule
-                            service = EmailService.query.get(service_id)
-                            
-                            if service and service.is_active:
-                                # Calculate next run relative to NOW
-                                new_next_run = service.calculate_next_run(datetime.utcnow())
-                                
-                                # Update DB
-                                service.next_run_at = new_next_run
-                                db.session.commit()
-                                
-                                # Add back to Redis with new score
-                                ts = new_next_run.replace(tzinfo=pytz.UTC).timestamp()
-                                redis_client.zadd(SCHEDULE_KEY, {str(service.id): ts})
-                                
-                                logger.info(f"Rescheduled service {service_id} to {new_next_run}")
-                            else:
-                                logger.info(f"Service {service_id} stopped/removed (Active: {getattr(service, 'is_active', False)})")
-                        else:
-                            # Another scheduler instance picked it up (rare in this setup)
-                            pass
+                    claimed = claim_tasks(redis_client, ready_tasks)
+                    services = {
+                        service.id: service
+                        for service in EmailService.query.filter(EmailService.id.in_(list(claimed))).all()
+                    } if claimed else {}
+                    
+                    # Digest-mode users: pull in their services due within the window
+                    digests = collect_digests(redis_client, claimed, services, now_ts)
+                    
+                    # Outbox rows and next runs are committed together; if that fails, nothing
+                    # was written and the claimed entries go back in the ZSET for the next tick
+                    try:
+                        enqueue_deliveries(claimed, services, digests)
+                        reschedule(redis_client, claimed, services, now_ts)
+                    except Exception:
+                        db.session.rollback()
+                        redis_client.zadd(SCHEDULE_KEY, {
+                            str(service_id): scheduled_ts for service_id, scheduled_ts in claimed.items()
+                        })
+                        raise
+                
+                # Hand due outbox rows (new ones, retries and expired leases) to the workers
+                relay_outbox()
+                
+                # Periodic cleanup of expired/orphaned rows runs on a worker
+                if last_maintenance is None or now_ts - last_maintenance >= app.config['MAINTENANCE_INTERVAL_SECONDS']:
+                    run_maintenance_task.delay()
+                    last_maintenance = now_ts
                             
         except Exception as e:
             logger.error(f"Scheduler loop error: {e}")
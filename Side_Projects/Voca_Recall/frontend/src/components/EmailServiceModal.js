@@ -10,6 +10,9 @@ const EmailServiceModal = ({ isOpen, onClose, database, databases = null, servic
     send_time: '09:00',
     timezone: 'Asia/Taipei',
     frequency: 'daily',
+    cron_expression: '',
+    interval_days: 3,
+    interval_anchor: '',
     vocabulary_count: 10,
     selection_method: 'random',
     email_client: 'apple_mail',
@@ -84,6 +87,9 @@ const EmailServiceModal = ({ isOpen, onClose, database, databases = null, servic
         send_time: service.send_time || '09:00',
         timezone: service.timezone || 'Asia/Taipei',
         frequency: service.frequency || 'daily',
+        cron_expression: service.cron_expression || '',
+        interval_days: service.interval_days || 3,
+        interval_anchor: service.interval_anchor || '',
         vocabulary_count: service.vocabulary_count || 10,
         selection_method: service.selection_method || 'random',
         email_client: service.email_client || 'apple_mail',
@@ -326,9 +332,57 @@ const EmailServiceModal = ({ isOpen, onClose, database, databases = null, servic
                 >
                   <option value="daily">Daily</option>
                   <option value="weekly">Weekly</option>
+                  <option value="monthly">Monthly</option>
+                  <option value="interval">Every N days</option>
                   <option value="custom">Custom</option>
                 </select>
               </div>
+
+              {/* Cron expression - only for custom frequency */}
+              {formData.frequency === 'custom' && (
+                <div>
+                  <label className="form-label">Cron Expression *</label>
+                  <input
+                    type="text"
+                    value={formData.cron_expression}
+                    onChange={(e) => setFormData({ ...formData, cron_expression: e.target.value })}
+                    className="input-field font-mono"
+                    placeholder="30 7 * * 1-5"
+                    required
+                  />
+                  <p className="mt-1 text-sm text-gray-500">
+                    minute hour day-of-month month day-of-week, in the selected timezone (e.g. <code>30 7 * * 1-5</code> = weekdays at 07:30, <code>0 9 1,15 * *</code> = the 1st and 15th at 09:00)
+                  </p>
+                </div>
+              )}
+
+              {/* Day interval - only for interval frequency */}
+              {formData.frequency === 'interval' && (
+                <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
+                  <div>
+                    <label className="form-label">Every N Days *</label>
+                    <input
+                      type="number"
+                      min="1"
+                      max="365"
+                      value={formData.interval_days}
+                      onChange={(e) => setFormData({ ...formData, interval_days: parseInt(e.target.value, 10) || '' })}
+                      className="input-field"
+                      required
+                    />
+                  </div>
+                  <div>
+                    <label className="form-label">Starting On</label>
+                    <input
+                      type="date"
+                      value={formData.interval_anchor}
+                      onChange={(e) => setFormData({ ...formData, interval_anchor: e.target.value })}
+                      className="input-field"
+                    />
+                    <p className="mt-1 text-sm text-gray-500">Defaults to today</p>
+                  </div>
+                </div>
+              )}
             </div>
           </div>
 
@@ -370,11 +424,13 @@ const EmailServiceModal = ({ isOpen, onClose, database, databases = null, servic
                   <option value="random">Random Selection</option>
                   <option value="latest">Latest Items</option>
                   <option value="date_range">Date Range Selection</option>
+                  <option value="spaced_repetition">Spaced Repetition</option>
                 </select>
                 <p className="mt-1 text-sm text-gray-500">
                   {formData.selection_method === 'random' && 'Randomly select items from the entire database'}
                   {formData.selection_method === 'latest' && 'Select the most recently created items'}
                   {formData.selection_method === 'date_range' && 'Select items created within a specific date range'}
+                  {formData.selection_method === 'spaced_repetition' && 'Send the items most overdue for review, spacing repeats further apart each time'}
                 </p>
               </div>
 
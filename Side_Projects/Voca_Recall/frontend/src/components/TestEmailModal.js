@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { X, Send, Hash, Filter, Calendar, List, GripVertical, Eye, EyeOff, Mail } from 'lucide-react';
+import { X, Send, Hash, Filter, Calendar, List, GripVertical, Eye, EyeOff, Mail, RefreshCw } from 'lucide-react';
 import apiService from '../utils/apiService';
 import toast from 'react-hot-toast';
 
@@ -13,6 +13,8 @@ const TestEmailModal = ({ isOpen, onClose, databases }) => {
     date_range_end: '',
   });
   const [sending, setSending] = useState(false);
+  const [previewing, setPreviewing] = useState(false);
+  const [preview, setPreview] = useState(null); // { html, sample } from /email/preview
   
   // Column Selection Stuffs
   const [availableColumns, setAvailableColumns] = useState([]);
@@ -30,6 +32,7 @@ const TestEmailModal = ({ isOpen, onClose, databases }) => {
   }, [databases, formData.database_id]);
 
   useEffect(() => {
+    setPreview(null);
     if (formData.database_id) {
       fetchColumns(formData.database_id);
     }
@@ -86,13 +89,41 @@ const TestEmailModal = ({ isOpen, onClose, databases }) => {
     setDragStartIndex(null);
   };
 
+  // Only visible columns, in order
+  const getSelectedColumns = () => columnsConfig
+    .filter(c => c.isVisible)
+    .map(({ isVisible, ...col }) => col);
+
+  // Renders from a cached sample of the database: no Notion call (unless refreshing) and no email sent
+  const handlePreview = async (refresh = false) => {
+    const selectedColumns = getSelectedColumns();
+    if (selectedColumns.length === 0) {
+      toast.error('Please select at least one property to display.');
+      return;
+    }
+
+    setPreviewing(true);
+    try {
+      const response = await apiService.previewEmail({
+        database_pk: parseInt(formData.database_id),
+        vocabulary_count: parseInt(formData.vocabulary_count),
+        email_client: formData.email_client,
+        column_selection: selectedColumns,
+        refresh
+      });
+      setPreview(response.data);
+    } catch (error) {
+      toast.error(error.message || 'Failed to render preview');
+    } finally {
+      setPreviewing(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
 
     // Prepare column selection: only visible columns, in order
-    const selectedColumns = columnsConfig
-      .filter(c => c.isVisible)
-      .map(({ isVisible, ...col }) => col);
+    const selectedColumns = getSelectedColumns();
 
     if (selectedColumns.length === 0) {
       toast.error('Please select at least one property to display.');
@@ -339,6 +370,32 @@ const TestEmailModal = ({ isOpen, onClose, databases }) => {
             </div>
           </div>
 
+          {/* Preview */}
+          {preview && (
+            <div className="border rounded-lg overflow-hidden">
+              <div className="flex items-center justify-between px-3 py-2 bg-gray-50 text-xs text-gray-500">
+                <span>
+                  Sample of {preview.sample.size} newest items from {new Date(preview.sample.cached_at).toLocaleString()}
+                </span>
+                <button
+                  type="button"
+                  onClick={() => handlePreview(true)}
+                  className="flex items-center text-blue-600 hover:text-blue-800"
+                  disabled={previewing}
+                >
+                  <RefreshCw className="h-3 w-3 mr-1" />
+                  Refresh sample
+                </button>
+              </div>
+              <iframe
+                title="Email preview"
+                srcDoc={preview.html}
+                sandbox=""
+                className="w-full h-96 bg-white"
+              />
+            </div>
+          )}
+
           {/* Action Buttons */}
           <div className="border-t pt-6 flex justify-end space-x-3">
             <button
@@ -349,6 +406,15 @@ const TestEmailModal = ({ isOpen, onClose, databases }) => {
             >
               Cancel
             </button>
+            <button
+              type="button"
+              onClick={() => handlePreview(false)}
+              className="btn-secondary flex items-center"
+              disabled={sending || previewing || !formData.database_id}
+            >
+              <Eye className="h-4 w-4 mr-2" />
+              {previewing ? 'Rendering...' : 'Preview'}
+            </button>
             <button
               type="submit"
               className="btn-primary inline-flex items-center"
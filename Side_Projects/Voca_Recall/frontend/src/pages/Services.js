@@ -111,14 +111,15 @@ const Services = () => {
     const badges = {
       random: { color: 'bg-blue-100 text-blue-800', icon: Filter },
       latest: { color: 'bg-green-100 text-green-800', icon: Clock },
-      date_range: { color: 'bg-purple-100 text-purple-800', icon: Calendar }
+      date_range: { color: 'bg-purple-100 text-purple-800', icon: Calendar },
+      spaced_repetition: { color: 'bg-amber-100 text-amber-800', icon: Clock }
     };
     const badge = badges[method] || badges.random;
     const Icon = badge.icon;
     return (
       <span className={`inline-flex items-center px-2 py-1 rounded-full text-xs font-medium ${badge.color}`}>
         <Icon className="h-3 w-3 mr-1" />
-        {method.replace('_', ' ')}
+        {method.replaceAll('_', ' ')}
       </span>
     );
   };
@@ -360,7 +360,7 @@ const Settings = () => {
                               Selection:
                             </span>
                             <p className="font-medium text-gray-900 capitalize">
-                              {service.selection_method.replace('_', ' ')}
+                              {service.selection_method.replaceAll('_', ' ')}
                             </p>
                           </div>
                           <div>
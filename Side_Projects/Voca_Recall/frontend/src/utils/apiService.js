@@ -278,6 +278,18 @@ class ApiService {
     }
   }
 
+  async previewEmail(previewData) {
+    try {
+      apiLogger.debug('Rendering email preview');
+      const response = await this.post('/email/preview', previewData);
+      apiLogger.debug('Email preview rendered', { fromCache: response.data?.sample?.from_cache });
+      return response;
+    } catch (error) {
+      apiLogger.error('Failed to render email preview', error);
+      throw error;
+    }
+  }
+
   async getEmailLogs(page = 1, perPage = 10) {
     try {
       apiLogger.debug('Fetching email logs', { page, perPage });
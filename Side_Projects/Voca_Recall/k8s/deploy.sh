@@ -126,6 +126,9 @@ print_info "Waiting for Celery workers to be ready..."
 kubectl wait --for=condition=ready pod -l app=celery-worker -n $NAMESPACE --timeout=120s || {
     print_warning "Celery worker pods are not ready yet. Check logs with: kubectl logs -n $NAMESPACE -l app=celery-worker"
 }
+kubectl wait --for=condition=ready pod -l app=celery-worker-maintenance -n $NAMESPACE --timeout=120s || {
+    print_warning "Maintenance worker pods are not ready yet. Check logs with: kubectl logs -n $NAMESPACE -l app=celery-worker-maintenance"
+}
 
 # 9. Deploy Frontend
 print_header "Deploying Frontend"
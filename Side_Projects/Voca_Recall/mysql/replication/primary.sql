@@ -0,0 +1,3 @@
+-- Runs once when the primary's data volume is initialised (docker-compose.replica.yml)
+CREATE USER IF NOT EXISTS 'repl'@'%' IDENTIFIED BY 'repl';
+GRANT REPLICATION SLAVE ON *.* TO 'repl'@'%';
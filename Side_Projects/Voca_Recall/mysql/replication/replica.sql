@@ -0,0 +1,15 @@
+-- Runs once when the replica's data volume is initialised (docker-compose.replica.yml)
+-- The schema arrives through replication; the database must exist for it to land in
+SET SQL_LOG_BIN = 0;
+CREATE DATABASE IF NOT EXISTS voca_recaller_dev;
+SET SQL_LOG_BIN = 1;
+
+CHANGE REPLICATION SOURCE TO
+    SOURCE_HOST = 'mysql',
+    SOURCE_PORT = 3306,
+    SOURCE_USER = 'repl',
+    SOURCE_PASSWORD = 'repl',
+    SOURCE_AUTO_POSITION = 1,
+    SOURCE_CONNECT_RETRY = 5,
+    GET_SOURCE_PUBLIC_KEY = 1;
+START REPLICA;